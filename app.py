@@ -1,28 +1,610 @@
 # Import necessary libraries from Flask and other packages
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+from flask import Flask, Blueprint, current_app, request, jsonify, render_template, redirect, url_for, session, g, Response, stream_with_context, has_request_context, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-import requests
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import click
 import os
-from datetime import datetime
+import sqlite3
+import json
+import queue
+import re
+import secrets
+import tempfile
+import threading
+import time
+import difflib
+import unicodedata
+import base64
+import hashlib
+import csv
+import io
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import wraps
+try:
+    import orjson # Optional (listed in requirements.txt); dump_json() falls back to the json module
+except ImportError:
+    orjson = None
 
 # --- Application Setup ---
-# Create the Flask application instance
-app = Flask(__name__)
-
-# Configure the database URI (where to store the SQLite file)
-# os.path.join ensures the path works on different operating systems
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'expenses.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Turn off a feature we don't need, avoids warnings
-
-# Configure JWT (for secure login)
-app.config['SECRET_KEY'] = 'your-super-secret-key-change-this-in-production' # Use a strong, random key in real projects
+# The extensions are created unbound and the routes are collected on
+# blueprints; create_app() builds a configured Flask app and binds them to it.
+# Importing this module only defines things, so each preforked worker (or
+# test) pays for the app it creates and nothing else. Integrations that only
+# some code paths need (requests for outbound calls, the dialect-specific
+# insert constructs) are imported where they're first used.
+db = SQLAlchemy()
+bcrypt = Bcrypt()
+jwt = JWTManager()
+
+# Routes are grouped by area; CLI commands hang off the same blueprints
+# (cli_group=None keeps them top-level, e.g. `flask --app app migrate`)
+auth_bp = Blueprint('auth', __name__) # Signup, login, token checks
+expenses_bp = Blueprint('expenses', __name__, cli_group=None) # Expense, approval, admin and reporting APIs
+frontend_bp = Blueprint('frontend', __name__) # Server-rendered pages
+system_bp = Blueprint('system', __name__, cli_group=None) # Metrics, cache status, migrations
+
+
+def create_app(config=None):
+    """Create and configure the Flask app.
+
+    Settings start from the defaults below, then EXPENSES_* environment
+    variables override them (EXPENSES_EXPENSE_PAGE_SIZE=100 sets
+    EXPENSE_PAGE_SIZE; values are parsed as JSON where possible), then the
+    `config` mapping does.
+    """
+    # Create the Flask application instance
+    app = Flask(__name__)
+
+    # Configure the database URI (where to store the SQLite file)
+    # os.path.join ensures the path works on different operating systems
+    # (DATABASE_URL in the environment overrides it, e.g. to point benchmarks at a temp file)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:///{os.path.join(os.path.dirname(__file__), 'expenses.db')}")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Turn off a feature we don't need, avoids warnings
+
+    # Configure storage tuning (see the Storage Tuning section below the extensions)
+    # 'tuned' turns on WAL and the pragmas below for SQLite; 'basic' keeps SQLite's defaults
+    app.config['STORAGE_MODE'] = os.environ.get('STORAGE_MODE', 'tuned')
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL') # Safe with WAL, far fewer fsyncs than FULL
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) # Wait this long for a lock instead of failing
+    app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)) # Bytes of the file read via mmap
+
+    # Configure JWT (for secure login)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-super-secret-key-change-this-in-production') # Use a strong, random key in real projects
+
+    # Configure password hashing (bcrypt runs on a small worker pool, not on request threads)
+    app.config['BCRYPT_LOG_ROUNDS'] = 12 # bcrypt cost; existing hashes are upgraded on the next successful login
+    app.config['PASSWORD_HASH_WORKERS'] = os.cpu_count() or 2 # Threads doing bcrypt work in parallel
+    app.config['PASSWORD_HASH_QUEUE_LIMIT'] = 32 # Extra hashing jobs allowed to wait; beyond this requests get a 503
+    app.config['PASSWORD_HASH_TIMEOUT'] = 10 # Seconds a request waits for its hashing job
+
+    # Configure the authenticated-user cache (user, role, company currency, approver) shared across requests
+    app.config['PRINCIPAL_CACHE_TTL'] = 30 # Seconds; 0 disables the process-level cache (per-request caching always applies)
+    app.config['APPROVAL_PLAN_CACHE_TTL'] = 30 # Seconds a compiled approval plan is reused; bounds how long other worker processes apply old rules
+
+    # Configure currency conversion (rates are cached in memory and snapshotted to disk)
+    app.config['EXCHANGE_RATE_API_URL'] = 'https://api.exchangerate-api.com/v4/latest/{base}' # {base} is replaced with the source currency
+    app.config['EXCHANGE_RATE_API_TIMEOUT'] = 5 # Seconds to wait for the rate API before falling back
+    app.config['EXCHANGE_RATE_CACHE_TTL'] = 3600 # Seconds a fetched rate table stays fresh
+    app.config['EXCHANGE_RATE_RETRY_BACKOFF'] = 60 # Seconds to keep serving a stale table before retrying the API after a failed fetch
+    app.config['EXCHANGE_RATE_CACHE_SIZE'] = 32 # Max number of base currencies kept in memory (least recently used are evicted)
+    app.config['EXCHANGE_RATE_SNAPSHOT_PATH'] = os.path.join(os.path.dirname(__file__), 'exchange_rates_snapshot.json') # Last-known-good rates
+    app.config['EXCHANGE_RATE_MAX_AGE_DAYS'] = 7 # A day's rate also covers this many following days (weekends, holidays)
+    app.config['EXCHANGE_RATE_HISTORY_URL'] = os.environ.get('EXCHANGE_RATE_HISTORY_URL', '') # e.g. 'https://api.frankfurter.app/{date}?from={base}'; empty disables
+    app.config['RECONVERT_BATCH_SIZE'] = 5000 # Expenses read, converted and written back per chunk by reconvert-expenses
+
+    # Configure the background currency conversion queue (used when a rate isn't already cached at submit time)
+    app.config['CONVERSION_WORKER_ENABLED'] = os.environ.get('CONVERSION_WORKER_ENABLED', '1') != '0' # Run the worker thread in this process
+    app.config['CONVERSION_BATCH_SIZE'] = 200 # Jobs claimed per worker pass
+    app.config['CONVERSION_FETCH_WORKERS'] = 4 # Rate tables fetched in parallel within one pass
+    app.config['CONVERSION_POLL_INTERVAL'] = 5 # Seconds between passes when no new jobs were queued
+    app.config['CONVERSION_MAX_ATTEMPTS'] = 8 # After this many failed attempts the expense is marked 'failed'
+    app.config['CONVERSION_RETRY_BASE'] = 30 # Seconds before the first retry; doubles on every attempt
+    app.config['CONVERSION_RETRY_MAX'] = 3600 # Upper bound on the retry delay
+    app.config['CONVERSION_JOB_LEASE'] = 120 # Seconds a claimed job is hidden from other workers
+
+    # Configure the country -> currency lookup used at signup (bundled file, optionally refreshed in the background)
+    app.config['COUNTRY_CURRENCY_INDEX_PATH'] = os.path.join(os.path.dirname(__file__), 'data', 'country_currencies.json')
+    app.config['COUNTRY_INDEX_REFRESH_URL'] = 'https://restcountries.com/v3.1/all?fields=name,currencies'
+    app.config['COUNTRY_INDEX_REFRESH_INTERVAL'] = 0 # Seconds between background refreshes; 0 disables refreshing
+    app.config['COUNTRY_INDEX_REFRESH_TIMEOUT'] = 10 # Seconds to wait for restcountries to send the (large) response
+
+    # Configure the shared client for outbound API calls (exchange rates, restcountries)
+    app.config['OUTBOUND_CONNECT_TIMEOUT'] = 3.05 # Seconds to establish a connection; read timeouts are set per API
+    app.config['OUTBOUND_RETRIES'] = 2 # Extra attempts after a connection error or a 502/503/504
+    app.config['OUTBOUND_RETRY_BACKOFF'] = 0.3 # Seconds; doubles on every retry
+    app.config['OUTBOUND_POOL_SIZE'] = 10 # Keep-alive connections kept per host
+    app.config['OUTBOUND_BREAKER_THRESHOLD'] = 5 # Consecutive failures that open an upstream's circuit
+    app.config['OUTBOUND_BREAKER_RESET'] = 30 # Seconds the circuit stays open before one trial call
+
+    # Configure expense list pagination (used by the JSON API and the dashboards)
+    app.config['EXPENSE_PAGE_SIZE'] = 50 # Default number of expenses per page
+    app.config['EXPENSE_PAGE_SIZE_MAX'] = 200 # Upper bound for the ?limit= query parameter
+    app.config['EXPENSE_BATCH_MAX'] = 500 # Max number of expenses accepted by one batch submission
+    app.config['EXPORT_BATCH_SIZE'] = 1000 # Rows read from the database per query while streaming an export
+    app.config['EXPENSE_LIST_CACHE_SIZE'] = 512 # Serialized /my and /pending pages kept in memory (least recently used are evicted); 0 disables
+
+    # Configure the live pending-queue streams (server-sent events) for approvers
+    app.config['EVENT_BACKEND'] = os.environ.get('EVENT_BACKEND', 'local') # 'local' (this process only) or 'database' (shared by all worker processes)
+    app.config['EVENT_POLL_INTERVAL'] = 1 # Seconds between checks for new events with the 'database' backend, only while a stream is open
+    app.config['EVENT_RETENTION'] = 300 # Seconds events are kept in the pending_event table ('database' backend)
+    app.config['EVENT_STREAM_HEARTBEAT'] = 15 # Seconds between keep-alive comments on an idle stream
+    app.config['EVENT_QUEUE_SIZE'] = 100 # Events buffered per open stream; a client that falls further behind gets a fresh snapshot
+
+    # Configure request instrumentation (exposed on /metrics in the Prometheus text format)
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') != '0'
+    app.config['SLOW_REQUEST_LOG_MS'] = float(os.environ.get('SLOW_REQUEST_LOG_MS', 0)) # Log requests slower than this with their query breakdown; 0 disables
+
+    # Apply overrides: the environment first, then whatever the caller passed
+    app.config.from_prefixed_env('EXPENSES')
+    if config:
+        app.config.update(config)
+
+    # Connection pool sizing (used for file-based SQLite and server databases such as PostgreSQL via DATABASE_URL)
+    # Set after the overrides, since it depends on the final database URI
+    if ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']: # In-memory SQLite uses a single static connection
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)), # Seconds to wait for a free connection
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)), # Replace connections older than this (server DBs drop idle ones)
+            'pool_pre_ping': True # Check a connection is alive before handing it out
+        })
 
-# Initialize the extensions with the Flask app
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-jwt = JWTManager(app)
+    # Initialize the extensions and routes with the Flask app
+    db.init_app(app)
+    bcrypt.init_app(app)
+    jwt.init_app(app)
+    for blueprint in (auth_bp, expenses_bp, frontend_bp, system_bp):
+        app.register_blueprint(blueprint)
+
+    # Shared index used by signup, loaded once when the app starts
+    country_index.load(app.config['COUNTRY_CURRENCY_INDEX_PATH'])
+    # The in-process caches are keyed by row IDs, so a new app (e.g. a test's fresh database) starts them empty
+    for cache in (principal_cache, expense_list_pages, approval_plans):
+        cache.clear()
+
+    # Background threads for this process, started here so a WSGI server (e.g. gunicorn 'app:create_app()')
+    # gets them too, not just `python app.py`
+    with app.app_context():
+        # Pick up conversions left queued by a previous run or a migration. A database that hasn't been
+        # migrated yet has no queue; `python app.py` notifies again after migrating
+        if app.config['CONVERSION_WORKER_ENABLED'] and db.inspect(db.engine).has_table(ConversionJob.__tablename__):
+            conversion_worker.notify()
+        # Optionally keep the country -> currency index fresh in the background
+        if app.config['COUNTRY_INDEX_REFRESH_INTERVAL'] > 0:
+            country_index.start_background_refresh(app.config['COUNTRY_INDEX_REFRESH_INTERVAL'])
+    return app
+
+# --- Storage Tuning ---
+
+# Apply the SQLite pragmas to every new connection (server databases are left alone)
+@event.listens_for(Engine, 'connect')
+def tune_sqlite_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection) or current_app.config['STORAGE_MODE'] != 'tuned':
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers keep going while one writer commits, instead of everyone blocking on the file lock
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f"PRAGMA synchronous={current_app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={int(current_app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cursor.execute(f"PRAGMA mmap_size={int(current_app.config['SQLITE_MMAP_SIZE'])}")
+    cursor.close()
+
+
+def upsert_insert(table):
+    """INSERT for the current database's dialect, which supports on_conflict_do_update().
+
+    The dialect module is imported on first use; workers on SQLite never load the PostgreSQL one.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+# --- Instrumentation ---
+# Per-route latency, SQL statement count/time per request, outbound HTTP and
+# password hashing timings. Counters live in process memory and are served on
+# /metrics; a request that runs past SLOW_REQUEST_LOG_MS is printed together
+# with where its time went.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Seconds
+STATEMENT_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._families = {} # name -> (type, help, buckets); registration order is render order
+        self._values = {} # (name, labels) -> float for counters/gauges, [bucket counts..., sum, count] for histograms
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self._families[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._families[name] = ('histogram', help_text, buckets)
+
+    def gauge(self, name, help_text):
+        self._families[name] = ('gauge', help_text, None)
+
+    def inc(self, name, labels=(), amount=1):
+        """Add to a counter. labels is a tuple of (label, value) pairs."""
+        with self._lock:
+            self._values[(name, labels)] = self._values.get((name, labels), 0) + amount
+
+    def set(self, name, value, labels=()):
+        """Set a gauge to its current value."""
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    def observe(self, name, value, labels=()):
+        """Record one value in a histogram."""
+        buckets = self._families[name][2]
+        with self._lock:
+            series = self._values.get((name, labels))
+            if series is None:
+                series = self._values[(name, labels)] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1 # Prometheus buckets are cumulative
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (series_name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                if series_name != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {value[-1]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {value[-2]}')
+                lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+metrics = MetricsRegistry()
+metrics.counter('http_requests_total', 'HTTP requests by route, method and status.')
+metrics.histogram('http_request_duration_seconds', 'HTTP request latency by route.')
+metrics.histogram('http_request_sql_statements', 'SQL statements issued per HTTP request.', STATEMENT_COUNT_BUCKETS)
+metrics.histogram('http_request_sql_duration_seconds', 'Time spent in SQL per HTTP request.')
+metrics.counter('sql_statements_total', 'SQL statements executed, in and out of requests.')
+metrics.counter('sql_duration_seconds_total', 'Time spent executing SQL statements.')
+metrics.histogram('outbound_request_duration_seconds', 'Outbound HTTP calls by target and outcome.')
+metrics.histogram('password_hash_duration_seconds', 'bcrypt hashing/verification, including time queued for the pool.')
+metrics.counter('password_hash_timeouts_total', 'Password hashing jobs that missed PASSWORD_HASH_TIMEOUT (answered with a 503).')
+
+
+def new_request_stats():
+    return {'sql_count': 0, 'sql_time': 0.0, 'queries': {}, 'outbound': [], 'password_hash_time': 0.0}
+
+
+def request_stats():
+    """The current request's timing accumulator, or None outside a request."""
+    if not has_request_context():
+        return None
+    if 'request_stats' not in g:
+        g.request_stats = new_request_stats()
+    return g.request_stats
+
+
+def record_timing(kind, seconds, detail=None):
+    """Add a measured step ('outbound' with (target, outcome), or 'password_hash') to the current request."""
+    stats = request_stats()
+    if stats is None:
+        return
+    if kind == 'outbound':
+        stats['outbound'].append((detail, seconds))
+    else:
+        stats['password_hash_time'] += seconds
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'handle_error')
+def discard_statement_timer(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('statement_started'):
+        conn.info['statement_started'].pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+    metrics.inc('sql_statements_total')
+    metrics.inc('sql_duration_seconds_total', amount=elapsed)
+    stats = request_stats()
+    if stats is None:
+        return
+    stats['sql_count'] += 1
+    stats['sql_time'] += elapsed
+    if current_app.config['SLOW_REQUEST_LOG_MS'] > 0:
+        # Group by statement text so the slow log shows "this SELECT ran 40 times"
+        entry = stats['queries'].setdefault(' '.join(statement.split())[:160], [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+@system_bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_stats = new_request_stats()
+
+
+@system_bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None or not current_app.config['METRICS_ENABLED']:
+        return response
+    elapsed = time.perf_counter() - started
+    # Label by the route pattern (/api/expenses/<int:expense_id>/approve), not the raw path
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    stats = g.pop('request_stats', None) or new_request_stats()
+    metrics.inc('http_requests_total', (('method', request.method), ('route', route), ('status', str(response.status_code))))
+    metrics.observe('http_request_duration_seconds', elapsed, (('method', request.method), ('route', route)))
+    metrics.observe('http_request_sql_statements', stats['sql_count'], (('route', route),))
+    metrics.observe('http_request_sql_duration_seconds', stats['sql_time'], (('route', route),))
+
+    threshold = current_app.config['SLOW_REQUEST_LOG_MS']
+    if threshold > 0 and elapsed * 1000 >= threshold:
+        print(f"Slow request: {request.method} {request.path} -> {response.status_code} in {elapsed * 1000:.1f} ms "
+              f"(sql: {stats['sql_count']} statements, {stats['sql_time'] * 1000:.1f} ms; "
+              f"password hashing: {stats['password_hash_time'] * 1000:.1f} ms; "
+              f"outbound: {sum(seconds for _, seconds in stats['outbound']) * 1000:.1f} ms)")
+        for statement, (count, seconds) in sorted(stats['queries'].items(), key=lambda item: -item[1][1])[:10]:
+            print(f"    {count:4d}x {seconds * 1000:8.1f} ms  {statement}")
+        for call, seconds in stats['outbound']:
+            print(f"          {seconds * 1000:8.1f} ms  GET {call}")
+    return response
+
+
+# Prometheus scrape endpoint (unauthenticated, like most exporters: keep it off the public internet)
+@system_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'message': 'Metrics are disabled.'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- Outbound HTTP ---
+# Every call to a third-party API goes through one shared client: a pooled
+# requests.Session (keep-alive, so repeat calls skip the TCP/TLS handshake),
+# connect and read timeouts on every request, bounded retries with backoff for
+# connection errors and 502/503/504, and a circuit breaker per upstream that
+# fails fast while the upstream is unhealthy instead of tying up a worker.
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Closed -> open after OUTBOUND_BREAKER_THRESHOLD consecutive failures.
+
+    While open every call is refused. After OUTBOUND_BREAKER_RESET seconds one
+    trial call is let through (half-open): success closes the circuit, failure
+    opens it again.
+    """
+
+    STATES = {'closed': 0, 'open': 1, 'half_open': 2} # Gauge values on /metrics
+
+    def __init__(self, target):
+        self.target = target
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < current_app.config['OUTBOUND_BREAKER_RESET']:
+                    metrics.inc('outbound_circuit_rejections_total', (('target', self.target),))
+                    raise CircuitOpen(f'{self.target} is unavailable (circuit open), not calling it.')
+                self._set_state('half_open') # Let this one call through as a trial
+            elif self.state == 'half_open':
+                # A trial call is already in flight; don't pile more onto a struggling upstream
+                metrics.inc('outbound_circuit_rejections_total', (('target', self.target),))
+                raise CircuitOpen(f'{self.target} is being retried, not calling it.')
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self._set_state('closed')
+                return
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= current_app.config['OUTBOUND_BREAKER_THRESHOLD']:
+                self.opened_at = time.monotonic()
+                self._set_state('open')
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set('outbound_circuit_state', self.STATES[state], (('target', self.target),))
+
+
+class OutboundClient:
+    """Shared HTTP client for third-party APIs (see the section comment)."""
+
+    def __init__(self):
+        self._session = None # Built on first use, so the config can be changed before then
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, target, url, read_timeout):
+        """GET url on behalf of `target` (e.g. 'exchange_rates').
+
+        Returns the response (any status, after retries) or raises CircuitOpen or
+        a requests exception. Timing and outcome are recorded in the metrics.
+        """
+        breaker = self._breaker(target)
+        breaker.before_call()
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = self._get_session().get(url, timeout=(current_app.config['OUTBOUND_CONNECT_TIMEOUT'], read_timeout))
+            outcome = str(response.status_code)
+            retries = response.raw.retries.history if getattr(response.raw, 'retries', None) else ()
+            if retries:
+                metrics.inc('outbound_retries_total', (('target', target),), len(retries))
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            breaker.record(outcome != 'error' and int(outcome) < 500) # 4xx means the upstream is up
+            metrics.observe('outbound_request_duration_seconds', elapsed, (('target', target), ('outcome', outcome)))
+            record_timing('outbound', elapsed, f'{target} {outcome}')
+
+    def _breaker(self, target):
+        with self._lock:
+            if target not in self._breakers:
+                self._breakers[target] = CircuitBreaker(target)
+                metrics.set('outbound_circuit_state', 0, (('target', target),))
+            return self._breakers[target]
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                # Imported here: requests (and urllib3 under it) is only needed once a worker makes an outbound call
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                retry = Retry(
+                    total=current_app.config['OUTBOUND_RETRIES'],
+                    backoff_factor=current_app.config['OUTBOUND_RETRY_BACKOFF'], # Sleeps backoff * 2**(n-1) between tries
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({'GET'}),
+                    raise_on_status=False # Hand back the last response; the caller decides what a 503 means
+                )
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=current_app.config['OUTBOUND_POOL_SIZE'], max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+
+metrics.counter('outbound_retries_total', 'Outbound HTTP retries by target.')
+metrics.counter('outbound_circuit_rejections_total', 'Outbound calls refused because the circuit breaker was open.')
+metrics.gauge('outbound_circuit_state', 'Circuit breaker state per target (0 closed, 1 open, 2 half-open).')
+
+# Shared client used by the exchange-rate cache and the country index refresh
+outbound = OutboundClient()
+
+# --- Password Hashing ---
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool is saturated; turned into a 503 response."""
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing/verification on a bounded worker pool.
+
+    A burst of logins can't pin every request thread on CPU-bound hashing:
+    at most PASSWORD_HASH_WORKERS jobs run at once, at most
+    PASSWORD_HASH_QUEUE_LIMIT more may wait, and anything beyond that is
+    rejected immediately with PasswordHasherBusy. A job that doesn't finish
+    within PASSWORD_HASH_TIMEOUT is reported as PasswordHasherBusy too.
+    """
+
+    def __init__(self):
+        self._executor = None # Created on first use, so the config can be changed before then
+        self._slots = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                workers = current_app.config['PASSWORD_HASH_WORKERS']
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+                self._slots = threading.BoundedSemaphore(workers + current_app.config['PASSWORD_HASH_QUEUE_LIMIT'])
+        # Don't wait for a free slot: if the pool and queue are full, fail fast
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy('Password hashing is saturated, try again shortly.')
+        started = time.perf_counter()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            # The job keeps its slot until it finishes; the request gets the same 503 as a full pool
+            with self._lock:
+                self.timed_out += 1
+            metrics.inc('password_hash_timeouts_total')
+            raise PasswordHasherBusy('Password hashing is taking too long, try again shortly.')
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe('password_hash_duration_seconds', elapsed, (('operation', fn.__name__),))
+            record_timing('password_hash', elapsed)
+
+    def hash(self, password):
+        """Hash a password with the configured bcrypt cost."""
+        rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+        return self._submit(bcrypt.generate_password_hash, password, rounds).decode('utf-8')
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash."""
+        return self._submit(bcrypt.check_password_hash, password_hash, password)
+
+    @staticmethod
+    def needs_rehash(password_hash):
+        """True if the hash was made with a different cost than BCRYPT_LOG_ROUNDS."""
+        try:
+            # bcrypt hashes look like $2b$12$<salt+hash>; the third field is the cost
+            return int(password_hash.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
+        except (IndexError, ValueError):
+            return False
+
+
+# Shared hasher used by the User model
+password_hasher = PasswordHasher()
+
+
+# Return a 503 (instead of queueing forever) when the hashing pool is full
+@auth_bp.app_errorhandler(PasswordHasherBusy)
+def handle_password_hasher_busy(e):
+    response = jsonify({'message': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
 
 # --- Database Models (Tables Definition) ---
 # These define the structure of our data in the database
@@ -52,13 +634,17 @@ class User(db.Model):
     # Self-referencing relationship for manager/employee
     manager = db.relationship('User', remote_side=[id], backref='subordinates')
 
-    # Method to hash and set the password
+    # Method to hash and set the password (runs on the password hashing pool)
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash(password)
 
-    # Method to check if the provided password matches the hash
+    # Method to check if the provided password matches the hash (runs on the password hashing pool)
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    # True if the stored hash uses an outdated bcrypt cost and should be upgraded
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
 # --- API Routes (Endpoints) ---
 
@@ -105,7 +691,7 @@ class User(db.Model):
 #         print(f"Error fetching currency: {e}") # Log error for debugging
 #         return jsonify({'message': 'An error occurred while fetching currency data.'}), 500
 # Route for user signup (handles initial company creation too)
-@app.route('/api/auth/signup', methods=['POST'])
+@auth_bp.route('/api/auth/signup', methods=['POST'])
 def signup():
     # Get the JSON data sent by the user
     data = request.get_json()
@@ -126,31 +712,13 @@ def signup():
     if not company_name or not country_name:
         return jsonify({'message': 'Company name and country are required for the first signup.'}), 400
 
-    # --- Fetch Currency Code from External API ---
-    try:
-        country_api_url = f"https://restcountries.com/v3.1/name/{country_name}?fields=currencies"
-        response = requests.get(country_api_url)
-        if response.status_code == 200:
-            country_data = response.json()
-            if country_data:
-                # Get the first currency code from the API response
-                currency_dict = country_data[0].get('currencies', {})
-                if currency_dict:
-                    base_currency_code = list(currency_dict.keys())[0] # e.g., 'USD'
-                else:
-                    return jsonify({'message': 'Currency information not found for the country.'}), 400
-            else:
-                return jsonify({'message': 'Country not found in the API.'}), 400
-        else:
-            return jsonify({'message': 'Failed to fetch currency data from API.'}), 500
-    except Exception as e:
-        print(f"Error fetching currency: {e}") # Log error for debugging
-        return jsonify({'message': 'An error occurred while fetching currency data.'}), 500
+    # --- Look up Currency Code in the local country index ---
+    # (preloaded at startup, so signup never waits on an outbound API call)
+    base_currency_code = country_index.lookup(country_name)
+    if not base_currency_code:
+        return jsonify({'message': 'Country not found.'}), 400
 
     # --- Create Company and Admin User ---
-    # Hash the user's password
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-
     # Create the new Company record
     new_company = Company(name=company_name, base_currency_code=base_currency_code)
 
@@ -252,7 +820,7 @@ def signup():
 #         return jsonify({'message': 'Invalid username or password'}), 401
 
 # Route for user login
-@app.route('/api/auth/login', methods=['POST'])
+@auth_bp.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username')
@@ -263,6 +831,14 @@ def login():
 
     # Check if user exists and password is correct
     if user and user.check_password(password):
+        # Transparently upgrade the hash if the bcrypt cost has changed since it was made
+        if user.password_needs_rehash():
+            user.set_password(password)
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Database error during password rehash: {e}") # Login still succeeds with the old hash
         # Generate a JWT token for the authenticated user (if needed for API calls)
         access_token = create_access_token(identity=str(user.id))
         # For frontend session: SET THE SESSION HERE
@@ -280,13 +856,11 @@ def login():
         return jsonify({'message': 'Invalid username or password'}), 401
 
 # A simple protected route to test authentication
-@app.route('/api/protected', methods=['GET'])
+@auth_bp.route('/api/protected', methods=['GET'])
 @jwt_required()
 def protected():
-    # Get the user ID from the JWT token
-    current_user_id = int(get_jwt_identity())
-    # Fetch the user object from the database
-    user = User.query.get(current_user_id)
+    # Get the (cached) user for the JWT token
+    user = get_current_principal()
     if user:
         return jsonify({'message': f'Hello, {user.username}!', 'role': user.role}), 200
     else:
@@ -299,15 +873,31 @@ class Expense(db.Model):
     amount = db.Column(db.Float, nullable=False) # Amount of the expense
     original_currency_code = db.Column(db.String(3), nullable=False) # Currency the expense was submitted in
     converted_amount = db.Column(db.Float, nullable=True) # Amount converted to company currency
+    conversion_status = db.Column(db.String(20), nullable=False, default='converted', server_default='converted') # 'pending', 'converted', 'approximate', 'failed'
     category = db.Column(db.String(100), nullable=False) # e.g., Travel, Food, Supplies
     description = db.Column(db.Text, nullable=True) # Description of the expense
     date = db.Column(db.Date, nullable=False) # Date of the expense
     receipt_image_path = db.Column(db.String(255), nullable=True) # Path to uploaded receipt image (optional for now)
     status = db.Column(db.String(20), nullable=False, default='pending') # 'pending', 'approved', 'rejected'
     submitted_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # Link to the employee who submitted
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True) # The submitter's company, copied at submission so tenant queries skip the User join
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow) # When it was submitted
     current_approver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) # Link to the manager currently responsible for approval
 
+    # Multi-step approval state (see the Approval Engine section)
+    approval_chain = db.Column(db.String(255), nullable=True) # Comma-separated approver IDs in order, fixed at submission
+    approval_step = db.Column(db.Integer, nullable=False, default=0, server_default='0') # Position of current_approver_id in approval_chain
+    approvals_count = db.Column(db.Integer, nullable=False, default=0, server_default='0') # Approvals received so far
+
+    # Indexes for the hot queries: "my expenses" (newest first) and an approver's pending queue,
+    # plus company-leading ones for the admin dashboard (newest first) and the by-ID scans (export, re-conversion)
+    __table_args__ = (
+        db.Index('ix_expense_submitted_by_submitted_at', 'submitted_by_id', 'submitted_at'),
+        db.Index('ix_expense_approver_status', 'current_approver_id', 'status'),
+        db.Index('ix_expense_company_submitted_at', 'company_id', 'submitted_at'),
+        db.Index('ix_expense_company_id', 'company_id', 'id'),
+    )
+
     # Relationship to the User who submitted it - FIXED: Added foreign_keys
     submitted_by = db.relationship('User', foreign_keys=[submitted_by_id], backref='submitted_expenses')
     # Relationship to the User who is the current approver - ADDED: Added foreign_keys
@@ -323,10 +913,17 @@ class Approval(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), nullable=False)
     approver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True) # Same as the expense's company_id
     status = db.Column(db.String(20), nullable=False, default='pending') # 'pending', 'approved', 'rejected'
     comment = db.Column(db.Text, nullable=True) # Optional comment from the approver
     approved_at = db.Column(db.DateTime, nullable=True) # When it was approved/rejected
 
+    # Indexes for loading an expense's approval history and a company's decisions by date
+    __table_args__ = (
+        db.Index('ix_approval_expense_id', 'expense_id'),
+        db.Index('ix_approval_company_approved_at', 'company_id', 'approved_at'),
+    )
+
     # Relationships
     approver = db.relationship('User', backref='approvals_given')
 
@@ -350,135 +947,2110 @@ class ApprovalRule(db.Model):
     specific_approver_required = db.relationship('User')
 
 
+# Define the UserHierarchy Model
+# Closure table of the manager tree: one row per (manager, anyone below them) pair,
+# plus a depth-0 row for each user. Kept in sync with User.manager_id automatically
+# (see the Team Hierarchy section), so "everyone under X" is a single indexed lookup.
+class UserHierarchy(db.Model):
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True) # The manager (or the user themself at depth 0)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True) # Someone in their (transitive) team
+    depth = db.Column(db.Integer, nullable=False) # 1 = direct report, 2 = report's report, ...
+
+    __table_args__ = (
+        db.Index('ix_user_hierarchy_descendant', 'descendant_id'),
+    )
+
+
+# Define the ExpenseSummary Model
+# Running spend totals per submitter, category, month and status, kept up to date
+# in the same transaction as submit/approve/reject (see the Spend Summaries section)
+class ExpenseSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    submitted_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    month = db.Column(db.String(7), nullable=False) # 'YYYY-MM' of the expense date
+    status = db.Column(db.String(20), nullable=False) # 'pending', 'approved', 'rejected'
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    total_converted = db.Column(db.Float, nullable=False, default=0) # Sum of converted_amount (company currency)
+    unconverted_count = db.Column(db.Integer, nullable=False, default=0) # Expenses with no converted_amount yet
+
+    __table_args__ = (
+        db.UniqueConstraint('submitted_by_id', 'category', 'month', 'status', name='uq_expense_summary_key'),
+        db.Index('ix_expense_summary_company_month', 'company_id', 'month'),
+    )
+
+
+# Define the ConversionJob Model
+# One row per expense waiting for its converted_amount (see the Currency Conversion Queue section).
+# Rows are deleted once the expense is converted; failed ones are kept with their last error.
+class ConversionJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), nullable=False, unique=True)
+    from_currency = db.Column(db.String(3), nullable=False)
+    to_currency = db.Column(db.String(3), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued') # 'queued', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Also pushed forward while a worker holds the job
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Index for the worker's "due jobs" query
+    __table_args__ = (
+        db.Index('ix_conversion_job_status_due', 'status', 'next_attempt_at'),
+    )
+
+    expense = db.relationship('Expense', backref=db.backref('conversion_job', uselist=False, cascade='all, delete-orphan'))
+
+
+# Define the ExchangeRate Model
+# Historical rates: one row per day and currency pair (see the Historical Exchange Rates section)
+class ExchangeRate(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    rate_date = db.Column(db.Date, nullable=False)
+    base_currency = db.Column(db.String(3), nullable=False)
+    quote_currency = db.Column(db.String(3), nullable=False)
+    rate = db.Column(db.Float, nullable=False) # Units of quote_currency for one unit of base_currency
+    source = db.Column(db.String(20), nullable=False, default='live') # 'live', 'history', 'import'
+
+    # One rate per pair and day; also serves the "all days for this pair" lookup
+    __table_args__ = (
+        db.UniqueConstraint('base_currency', 'quote_currency', 'rate_date', name='uq_exchange_rate_pair_date'),
+    )
+
+
+# Define the PendingEvent Model
+# Pending-queue events shared between worker processes by the 'database' event backend
+# (see the Pending Queue Events section); rows are deleted after EVENT_RETENTION seconds.
+class PendingEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    approver_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False) # JSON event body
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_pending_event_created_at', 'created_at'),
+    )
+
+
+# Define the ExpenseListVersion Model
+# Per-user counter bumped whenever an expense the user submitted or has to approve changes
+# (see the Expense List Versions section). No row means version 0.
+class ExpenseListVersion(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# --- Schema Migrations ---
+# db.create_all() only creates missing tables; it never changes existing ones.
+# Changes to existing tables go in a numbered migration below, so an existing
+# expenses.db can be upgraded in place with `flask --app app migrate`.
+
+# Records which migrations have been applied to this database
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Random per row; the newest one is this database's salt (e.g. for the expense list ETags)
+    salt = db.Column(db.String(32))
+
+
+def create_index_if_missing(model, index_name):
+    """Create one of a model's declared indexes unless the database already has it."""
+    index = next(ix for ix in model.__table__.indexes if ix.name == index_name)
+    index.create(db.engine, checkfirst=True)
+
+
+def migration_0001_hot_query_indexes():
+    """Add composite indexes for the expense list, pending queue and approval lookups."""
+    create_index_if_missing(Expense, 'ix_expense_submitted_by_submitted_at')
+    create_index_if_missing(Expense, 'ix_expense_approver_status')
+    create_index_if_missing(Approval, 'ix_approval_expense_id')
+
+
+def migration_0002_expense_summaries():
+    """Fill the new expense_summary table from the existing expenses (once they have a company_id)."""
+    # The summaries are grouped by Expense.company_id, which migration 8 adds and fills; it rebuilds them
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns(Expense.__tablename__)}
+    if 'company_id' in existing:
+        rebuild_expense_summaries()
+
+
+def add_column_if_missing(model, column_name):
+    """Add one of a model's declared columns to an existing table (ALTER TABLE ... ADD COLUMN)."""
+    table = model.__table__
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+    if column_name in existing:
+        return
+    column = table.c[column_name]
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ''
+    not_null = ' NOT NULL' if not column.nullable and default else ''
+    with db.engine.begin() as connection:
+        connection.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column_name}" {column_type}{default}{not_null}'))
+
+
+def migration_0003_approval_engine_state():
+    """Add the per-expense approval chain and counters; open expenses get a one-step chain."""
+    add_column_if_missing(Expense, 'approval_chain')
+    add_column_if_missing(Expense, 'approval_step')
+    add_column_if_missing(Expense, 'approvals_count')
+    db.session.execute(
+        db.update(Expense)
+        .where(Expense.status == 'pending', Expense.approval_chain.is_(None), Expense.current_approver_id.isnot(None))
+        .values(approval_chain=db.cast(Expense.current_approver_id, db.String))
+    )
+    db.session.commit()
+
+
+def migration_0004_user_hierarchy():
+    """Fill the new user_hierarchy closure table from User.manager_id."""
+    rebuild_user_hierarchy()
+
+
+def migration_0005_conversion_queue():
+    """Add Expense.conversion_status; expenses stored without a converted amount are queued for conversion."""
+    add_column_if_missing(Expense, 'conversion_status')
+    now = datetime.utcnow()
+    db.session.execute(
+        db.insert(ConversionJob).from_select(
+            ['expense_id', 'from_currency', 'to_currency', 'status', 'attempts', 'next_attempt_at', 'created_at'],
+            db.select(Expense.id, Expense.original_currency_code, Company.base_currency_code,
+                      db.literal('queued'), db.literal(0), db.literal(now), db.literal(now))
+            .join(User, Expense.submitted_by_id == User.id)
+            .join(Company, User.company_id == Company.id)
+            .where(Expense.converted_amount.is_(None))
+        )
+    )
+    db.session.execute(db.update(Expense).where(Expense.converted_amount.is_(None)).values(conversion_status='pending'))
+    db.session.commit()
+
+
+def migration_0006_exchange_rate_history():
+    """Seed the new exchange_rate table from the last-known-good rate snapshot, dated by when it was fetched."""
+    try:
+        with open(current_app.config['EXCHANGE_RATE_SNAPSHOT_PATH']) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return # No snapshot yet; history starts with the next live fetch
+    store_rates([
+        (datetime.utcfromtimestamp(entry['fetched_at']).date(), base, quote, rate)
+        for base, entry in snapshot.items() for quote, rate in entry['rates'].items()
+    ], 'live')
+
+
+def migration_0007_expense_search():
+    """Add the full-text search index over expense descriptions and categories."""
+    create_expense_search_index()
+
+
+def migration_0008_tenant_columns():
+    """Copy each expense's company onto Expense and Approval rows and add the company-leading indexes."""
+    add_column_if_missing(Expense, 'company_id')
+    add_column_if_missing(Approval, 'company_id')
+    db.session.execute(
+        db.update(Expense)
+        .where(Expense.company_id.is_(None))
+        .values(company_id=db.select(User.company_id).where(User.id == Expense.submitted_by_id).scalar_subquery())
+    )
+    db.session.execute(
+        db.update(Approval)
+        .where(Approval.company_id.is_(None))
+        .values(company_id=db.select(Expense.company_id).where(Expense.id == Approval.expense_id).scalar_subquery())
+    )
+    db.session.commit()
+    create_index_if_missing(Expense, 'ix_expense_company_submitted_at')
+    create_index_if_missing(Expense, 'ix_expense_company_id')
+    create_index_if_missing(Approval, 'ix_approval_company_approved_at')
+    # Summaries are keyed by Expense.company_id from now on
+    rebuild_expense_summaries()
+
+
+def migration_0009_schema_version_salt():
+    """Add the salt column to schema_version; run_migrations() fills it for this and later migrations."""
+    add_column_if_missing(SchemaVersion, 'salt')
+
+
+# Ordered list of (version, migration function); append new migrations at the end
+MIGRATIONS = [
+    (1, migration_0001_hot_query_indexes),
+    (2, migration_0002_expense_summaries),
+    (3, migration_0003_approval_engine_state),
+    (4, migration_0004_user_hierarchy),
+    (5, migration_0005_conversion_queue),
+    (6, migration_0006_exchange_rate_history),
+    (7, migration_0007_expense_search),
+    (8, migration_0008_tenant_columns),
+    (9, migration_0009_schema_version_salt),
+]
+
+
+def run_migrations():
+    """Create missing tables, then apply every migration not yet recorded in schema_version."""
+    db.create_all()
+    applied = set(db.session.scalars(db.select(SchemaVersion.version))) # Only the columns every schema_version has
+    for version, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        migrate()
+        db.session.add(SchemaVersion(version=version, name=migrate.__name__, salt=secrets.token_hex(16)))
+        db.session.commit()
+        print(f"Applied migration {version}: {migrate.__name__}")
+
+
+# CLI command: flask --app app migrate
+@system_bp.cli.command('migrate')
+def migrate_command():
+    """Create missing tables and apply pending schema migrations."""
+    run_migrations()
+
+
+# --- Authenticated Principal Cache ---
+# Everything a hot endpoint needs to know about the logged-in user, loaded
+# with one query and cached: on flask.g for the rest of the request, and in a
+# process-level TTL cache across requests. Any change to a User or Company row
+# drops the cached entries for that company.
+
+Principal = namedtuple('Principal', [
+    'id', 'username', 'role', 'company_id',
+    'base_currency_code', # The company's currency
+    'manager_id',
+    'manager_is_approver', # True if the direct manager approves this user's expenses
+    'company_admin_id' # First admin in the company (fallback approver)
+])
+
+
+class PrincipalCache:
+    """Process-level TTL cache of Principal tuples, keyed by user ID."""
+
+    def __init__(self):
+        self._entries = {} # user ID -> (expires_at, principal)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        return None
+
+    def put(self, principal):
+        ttl = current_app.config['PRINCIPAL_CACHE_TTL']
+        if ttl > 0:
+            with self._lock:
+                self._entries[principal.id] = (time.time() + ttl, principal)
+
+    def invalidate_company(self, company_id):
+        """Drop every cached principal belonging to this company."""
+        with self._lock:
+            self._entries = {user_id: entry for user_id, entry in self._entries.items()
+                             if entry[1].company_id != company_id}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def load_principal(user_id):
+    """Load a Principal straight from the database with a single query (None if the user doesn't exist)."""
+    manager = db.aliased(User)
+    admin = db.aliased(User)
+    company_admin_id = (
+        db.select(admin.id)
+        .where(admin.company_id == Company.id, admin.role == 'admin')
+        .order_by(admin.id)
+        .limit(1)
+        .correlate(Company)
+        .scalar_subquery()
+    )
+    row = db.session.execute(
+        db.select(User.id, User.username, User.role, User.company_id, Company.base_currency_code,
+                  User.manager_id, manager.is_manager_approver, company_admin_id)
+        .join(Company, User.company_id == Company.id)
+        .outerjoin(manager, User.manager_id == manager.id)
+        .where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    return Principal(*row[:6], bool(row[6]), row[7])
+
+
+def get_current_principal():
+    """Return the Principal for the JWT identity, or None if the user no longer exists.
+
+    Only call this inside a @jwt_required() route.
+    """
+    if 'principal' in g:
+        return g.principal
+    user_id = int(get_jwt_identity())
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        principal = load_principal(user_id)
+        if principal is not None:
+            principal_cache.put(principal)
+    g.principal = principal
+    return principal
+
+
+# Remember which companies had users/companies changed in this transaction...
+@event.listens_for(Session, 'after_flush')
+def track_principal_changes(db_session, flush_context):
+    changed = db_session.info.setdefault('principal_companies_changed', set())
+    for instance in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+        if isinstance(instance, User) and instance.company_id is not None:
+            changed.add(instance.company_id)
+        elif isinstance(instance, Company) and instance.id is not None:
+            changed.add(instance.id)
+    # Drop them right away so this process doesn't re-serve the old values...
+    for company_id in changed:
+        principal_cache.invalidate_company(company_id)
+
+
+# ...and again once committed, in case another request re-cached them in between
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_principals(db_session):
+    for company_id in db_session.info.pop('principal_companies_changed', ()):
+        principal_cache.invalidate_company(company_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_principal_changes(db_session):
+    db_session.info.pop('principal_companies_changed', None)
+
+
+# --- Spend Summaries ---
+# ExpenseSummary rows are adjusted by small deltas whenever an expense is
+# submitted or decided, inside the same transaction, so reports never scan the
+# Expense table. Keys only use values that never change for an expense
+# (submitter, category, month) plus its status; grouping by manager joins the
+# submitter's current manager at report time. `flask --app app rebuild-summaries`
+# recomputes everything from the raw Expense rows.
+
+class SummaryDeltas:
+    """Collects summary changes for one transaction and writes them with a single upsert."""
+
+    def __init__(self):
+        self._deltas = {} # key -> [count, total, unconverted]
+
+    def add(self, company_id, submitted_by_id, category, expense_date, status, converted_amount, sign=1):
+        key = (company_id, submitted_by_id, category, expense_date.strftime('%Y-%m'), status)
+        delta = self._deltas.setdefault(key, [0, 0.0, 0])
+        delta[0] += sign
+        if converted_amount is None:
+            delta[2] += sign
+        else:
+            delta[1] += sign * converted_amount
+
+    def move(self, company_id, expense, old_status, new_status):
+        """Move an expense's totals from one status to another (approve/reject)."""
+        self.add(company_id, expense.submitted_by_id, expense.category, expense.date, old_status, expense.converted_amount, -1)
+        self.add(company_id, expense.submitted_by_id, expense.category, expense.date, new_status, expense.converted_amount, 1)
+
+    def flush(self):
+        """Upsert the collected deltas in the current transaction (caller commits)."""
+        if not self._deltas:
+            return
+        table = ExpenseSummary.__table__
+        statement = upsert_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['submitted_by_id', 'category', 'month', 'status'],
+            set_={
+                'expense_count': table.c.expense_count + statement.excluded.expense_count,
+                'total_converted': table.c.total_converted + statement.excluded.total_converted,
+                'unconverted_count': table.c.unconverted_count + statement.excluded.unconverted_count
+            }
+        )
+        db.session.execute(statement, [
+            {
+                'company_id': company_id, 'submitted_by_id': submitted_by_id, 'category': category,
+                'month': month, 'status': status, 'expense_count': count,
+                'total_converted': total, 'unconverted_count': unconverted
+            }
+            for (company_id, submitted_by_id, category, month, status), (count, total, unconverted) in self._deltas.items()
+        ])
+        self._deltas = {}
+
+
+def month_of(date_column):
+    """SQL expression for the 'YYYY-MM' month of a date column."""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.to_char(date_column, 'YYYY-MM')
+    return db.func.strftime('%Y-%m', date_column)
+
+
+def rebuild_expense_summaries():
+    """Recompute every ExpenseSummary row from the Expense table (reconciles any drift)."""
+    month = month_of(Expense.date)
+    db.session.execute(db.delete(ExpenseSummary))
+    db.session.execute(
+        db.insert(ExpenseSummary).from_select(
+            ['company_id', 'submitted_by_id', 'category', 'month', 'status',
+             'expense_count', 'total_converted', 'unconverted_count'],
+            db.select(
+                Expense.company_id, Expense.submitted_by_id, Expense.category, month, Expense.status,
+                db.func.count(Expense.id),
+                db.func.coalesce(db.func.sum(Expense.converted_amount), 0),
+                db.func.count(Expense.id) - db.func.count(Expense.converted_amount)
+            )
+            .group_by(Expense.company_id, Expense.submitted_by_id, Expense.category, month, Expense.status)
+        )
+    )
+    db.session.commit()
+
+
+# CLI command: flask --app app rebuild-summaries
+@expenses_bp.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Recompute the spend summary tables from the raw expenses."""
+    rebuild_expense_summaries()
+    print(f"Rebuilt {ExpenseSummary.query.count()} summary rows.")
+
+
+# --- Expense List Versions ---
+# Anything that changes an expense (submit, approve, reject, conversions) bumps
+# the list version of its submitter and of its old and new approver, in the
+# same transaction. /api/expenses/my and /api/expenses/pending derive their
+# ETag from the caller's version: a matching If-None-Match gets a 304 after one
+# primary-key lookup, and other repeat requests are answered from a small cache
+# of serialized pages, so an unchanged list never re-queries the Expense table.
+# The ETag and the cached pages also carry the database's salt (the newest
+# SchemaVersion.salt) and EXPENSE_LIST_FORMAT, so a reset or restored database,
+# or a deploy that changes the response shape, never matches an old ETag.
+
+# Bump whenever the JSON shape of /api/expenses/my or /api/expenses/pending changes
+EXPENSE_LIST_FORMAT = 1
+
+class ListVersionBumps:
+    """Collects the users whose expense lists changed in one transaction and bumps them with a single upsert."""
+
+    def __init__(self):
+        self._user_ids = set()
+
+    def add(self, *user_ids):
+        self._user_ids.update(user_id for user_id in user_ids if user_id is not None)
+
+    def add_expense(self, expense):
+        """The submitter and current approver of an expense (model instance or row)."""
+        self.add(expense.submitted_by_id, expense.current_approver_id)
+
+    def flush(self):
+        """Upsert the bumps in the current transaction (caller commits)."""
+        if not self._user_ids:
+            return
+        table = ExpenseListVersion.__table__
+        statement = upsert_insert(table)
+        statement = statement.on_conflict_do_update(index_elements=['user_id'], set_={'version': table.c.version + 1})
+        # Sorted, so concurrent transactions lock the rows in the same order
+        db.session.execute(statement, [{'user_id': user_id, 'version': 1} for user_id in sorted(self._user_ids)])
+        self._user_ids = set()
+
+
+def expense_list_version(user_id):
+    """(database salt, list version) for a user, in one query."""
+    salt = (db.select(SchemaVersion.salt).where(SchemaVersion.salt.is_not(None))
+            .order_by(SchemaVersion.version.desc()).limit(1).scalar_subquery())
+    version = db.select(ExpenseListVersion.version).where(ExpenseListVersion.user_id == user_id).scalar_subquery()
+    salt, version = db.session.execute(db.select(salt, version)).one()
+    return salt or '', version or 0
+
+
+class ExpenseListPageCache:
+    """In-process LRU cache of serialized list responses, keyed by (endpoint, user, query args).
+
+    Each entry remembers the (salt, list version) it was built from and is only
+    served while that is still the user's version.
+    """
+
+    def __init__(self):
+        self._pages = OrderedDict() # key -> (version, body), oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._pages.move_to_end(key) # Mark as most recently used
+            return entry[1]
+
+    def put(self, key, version, body):
+        size = current_app.config['EXPENSE_LIST_CACHE_SIZE']
+        if size <= 0:
+            return
+        with self._lock:
+            self._pages[key] = (version, body)
+            self._pages.move_to_end(key)
+            while len(self._pages) > size:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+expense_list_pages = ExpenseListPageCache()
+
+metrics.counter('expense_list_responses_total', 'Expense list requests by how they were answered (not_modified, cached, built).')
+
+
+def conditional_expense_list(view):
+    """Give a per-user expense list route an ETag, 304 responses and the page cache.
+
+    Goes below @jwt_required(). The wrapped view only runs when the page isn't
+    cached for the caller's current list version; error responses pass through
+    uncached.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = int(get_jwt_identity())
+        version = expense_list_version(user_id)
+        key = (request.endpoint, user_id, tuple(sorted(request.args.items(multi=True))))
+        etag = hashlib.sha1(repr((EXPENSE_LIST_FORMAT, key, version)).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            outcome = 'not_modified'
+            response = current_app.response_class(status=304)
+        else:
+            body = expense_list_pages.get(key, version)
+            if body is not None:
+                outcome = 'cached'
+                response = current_app.response_class(body, mimetype='application/json')
+            else:
+                outcome = 'built'
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                expense_list_pages.put(key, version, response.get_data())
+        metrics.inc('expense_list_responses_total', (('outcome', outcome),))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache' # Clients may keep the page but must revalidate it
+        return response
+    return wrapper
+
+
+# --- Approval Engine ---
+# Each company's ApprovalRule rows are compiled once into an ApprovalPlan and
+# cached in memory until a rule changes in this process, or for at most
+# APPROVAL_PLAN_CACHE_TTL seconds (so other worker processes pick up changes
+# too). At submission the plan fixes the expense's approver chain (stored on
+# the expense); each approval then only bumps the expense's running counters
+# and checks the plan's thresholds:
+#
+#   * every rule with a specific approver adds that person as a step, in
+#     sequence_order, after the employee's first approver
+#   * 'specific' rules: an approval from that person finalizes the expense
+#   * 'percentage' rules: the expense is approved once that share of the chain
+#     has approved
+#   * 'hybrid' rules: either of the above
+#   * otherwise the expense is approved when the last step approves
+#
+# Any rejection rejects the expense straight away.
+
+RULE_TYPES = ('percentage', 'specific', 'hybrid')
+
+
+class ApprovalPlan:
+    """Compiled approval rules for one company."""
+
+    def __init__(self, rules):
+        self.step_approver_ids = [] # Extra approvers after the first one, in sequence order
+        self.finalizing_approver_ids = set() # An approval from any of these finalizes the expense
+        self.percentage_required = None # Lowest percentage threshold across the rules
+        for rule in sorted(rules, key=lambda rule: (rule.sequence_order, rule.id)):
+            is_hybrid = rule.rule_type == 'hybrid' or rule.is_hybrid_rule
+            approver_id = rule.specific_approver_required_id
+            if approver_id and approver_id not in self.step_approver_ids:
+                self.step_approver_ids.append(approver_id)
+            if approver_id and (rule.rule_type == 'specific' or is_hybrid):
+                self.finalizing_approver_ids.add(approver_id)
+            if rule.percentage_required and (rule.rule_type == 'percentage' or is_hybrid):
+                if self.percentage_required is None or rule.percentage_required < self.percentage_required:
+                    self.percentage_required = rule.percentage_required
+
+    def chain_for(self, first_approver_id, submitter_id):
+        """Approver IDs, in order, for a new expense (the submitter never approves their own expense)."""
+        chain = [first_approver_id] if first_approver_id and first_approver_id != submitter_id else []
+        for approver_id in self.step_approver_ids:
+            if approver_id != submitter_id and approver_id not in chain:
+                chain.append(approver_id)
+        return chain
+
+    def apply_approval(self, expense, approver_id):
+        """Record one approval on a pending expense: finalize it or move it to the next approver.
+
+        Uses only the expense's own counters, never the Approval history.
+        Returns the expense's new status.
+        """
+        expense.approvals_count = (expense.approvals_count or 0) + 1
+        chain = parse_approval_chain(expense.approval_chain) or [approver_id]
+        next_step = (expense.approval_step or 0) + 1
+        threshold_met = (
+            approver_id in self.finalizing_approver_ids
+            or (self.percentage_required is not None
+                and expense.approvals_count * 100 >= self.percentage_required * len(chain))
+        )
+        if threshold_met or next_step >= len(chain):
+            expense.status = 'approved'
+            expense.current_approver_id = None # No more approver needed after final approval
+        else:
+            expense.approval_step = next_step
+            expense.current_approver_id = chain[next_step]
+        return expense.status
+
+
+def parse_approval_chain(chain):
+    return [int(approver_id) for approver_id in chain.split(',')] if chain else []
+
+
+def format_approval_chain(chain):
+    return ','.join(str(approver_id) for approver_id in chain) or None
+
+
+class ApprovalPlanCache:
+    """Compiled ApprovalPlan per company, dropped whenever that company's rules change or its TTL runs out."""
+
+    def __init__(self):
+        self._plans = {} # company ID -> (expires_at, plan)
+        self._lock = threading.Lock()
+
+    def get(self, company_id):
+        entry = self._plans.get(company_id)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        plan = ApprovalPlan(ApprovalRule.query.filter_by(company_id=company_id).all())
+        ttl = current_app.config['APPROVAL_PLAN_CACHE_TTL']
+        if ttl > 0:
+            with self._lock:
+                self._plans[company_id] = (time.time() + ttl, plan)
+        return plan
+
+    def invalidate(self, company_id):
+        with self._lock:
+            self._plans.pop(company_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+
+approval_plans = ApprovalPlanCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def track_rule_changes(db_session, flush_context):
+    changed = db_session.info.setdefault('rule_companies_changed', set())
+    for instance in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+        if isinstance(instance, ApprovalRule) and instance.company_id is not None:
+            changed.add(instance.company_id)
+    for company_id in changed:
+        approval_plans.invalidate(company_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_plans(db_session):
+    for company_id in db_session.info.pop('rule_companies_changed', ()):
+        approval_plans.invalidate(company_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rule_changes(db_session):
+    db_session.info.pop('rule_companies_changed', None)
+
+
+# --- Team Hierarchy ---
+# The user_hierarchy closure table is patched on every flush that adds users,
+# deletes users or changes a manager_id, in the same transaction.
+
+def rebuild_user_hierarchy():
+    """Recompute the whole closure table from User.manager_id with a recursive query."""
+    tree = db.select(
+        User.id.label('ancestor_id'), User.id.label('descendant_id'), db.literal(0).label('depth')
+    ).cte('tree', recursive=True)
+    child = db.aliased(User)
+    tree = tree.union_all(
+        db.select(tree.c.ancestor_id, child.id, tree.c.depth + 1)
+        .join(child, child.manager_id == tree.c.descendant_id)
+        .where(tree.c.depth < 50) # Guards against a manager_id cycle
+    )
+    db.session.execute(db.delete(UserHierarchy))
+    db.session.execute(
+        db.insert(UserHierarchy).from_select(['ancestor_id', 'descendant_id', 'depth'], db.select(tree))
+    )
+    db.session.commit()
+
+
+def move_in_hierarchy(connection, user_id, new_manager_id):
+    """Re-attach user_id (and everyone under them) below new_manager_id in the closure table."""
+    hierarchy = UserHierarchy.__table__
+    subtree = db.select(hierarchy.c.descendant_id).where(hierarchy.c.ancestor_id == user_id)
+    if new_manager_id is not None and connection.execute(
+        db.select(hierarchy.c.descendant_id).where(
+            hierarchy.c.ancestor_id == user_id, hierarchy.c.descendant_id == new_manager_id)
+    ).first():
+        print(f"Warning: Not moving user {user_id} under {new_manager_id}; that would create a management cycle")
+        return
+    # Cut the subtree loose from its old managers...
+    connection.execute(
+        db.delete(hierarchy)
+        .where(hierarchy.c.descendant_id.in_(subtree))
+        .where(hierarchy.c.ancestor_id.not_in(subtree))
+    )
+    if new_manager_id is None:
+        return
+    # ...and link every manager above (and including) the new one to every member of the subtree
+    above = hierarchy.alias('above')
+    below = hierarchy.alias('below')
+    connection.execute(
+        db.insert(hierarchy).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            db.select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1)
+            .select_from(above)
+            .join(below, db.true()) # Deliberate cross join: every manager above x every member below
+            .where(above.c.descendant_id == new_manager_id, below.c.ancestor_id == user_id)
+        )
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def sync_user_hierarchy(db_session, flush_context):
+    hierarchy = UserHierarchy.__table__
+    connection = db_session.connection()
+    for instance in db_session.deleted:
+        if isinstance(instance, User):
+            connection.execute(db.delete(hierarchy).where(
+                db.or_(hierarchy.c.ancestor_id == instance.id, hierarchy.c.descendant_id == instance.id)))
+    new_users = [instance for instance in db_session.new if isinstance(instance, User)]
+    # Every new user's own row first: db_session.new is unordered, and a user can arrive
+    # in the same flush as their new manager. Once all rows exist, moving a subtree keeps
+    # everything below it attached, so the links can then be made in any order.
+    if new_users:
+        connection.execute(db.insert(hierarchy), [
+            {'ancestor_id': user.id, 'descendant_id': user.id, 'depth': 0} for user in new_users
+        ])
+    for user in new_users:
+        if user.manager_id is not None:
+            move_in_hierarchy(connection, user.id, user.manager_id)
+    for instance in db_session.dirty:
+        if isinstance(instance, User) and db.inspect(instance).attrs.manager_id.history.has_changes():
+            move_in_hierarchy(connection, instance.id, instance.manager_id)
+
+
+def team_expense_query(manager_id, query=None):
+    """Expenses from everyone under manager_id, at any depth: one join through user_hierarchy.
+
+    Filters `query` (an ORM query or a select()), by default expense_list_query().
+    """
+    if query is None:
+        query = expense_list_query()
+    return (
+        query
+        .join(UserHierarchy, UserHierarchy.descendant_id == Expense.submitted_by_id)
+        .filter(UserHierarchy.ancestor_id == manager_id, UserHierarchy.depth > 0)
+    )
+
+
 # --- Utility Functions ---
 
+class ExchangeRateCache:
+    """In-process TTL/LRU cache of exchange-rate tables, keyed by base currency.
+
+    Every table fetched from the API is also written to a last-known-good
+    snapshot on disk, which is used when the API is unreachable.
+    """
+
+    def __init__(self):
+        self._tables = OrderedDict() # base currency -> (fetched_at, rates dict, retry_at), oldest first
+        self._snapshot = None # Loaded from disk on first use
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock() # One snapshot writer at a time (the conversion worker fetches in parallel)
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0 # API failed (or is backing off), served an expired in-memory table
+        self.snapshot_hits = 0 # API failed, served the on-disk snapshot
+        self.fetch_errors = 0
+
+    def get_rates(self, base_currency):
+        """Return the rate table for base_currency, or None if no rates are available at all."""
+        now = time.time()
+        with self._lock:
+            entry = self._tables.get(base_currency)
+            if entry and now - entry[0] < current_app.config['EXCHANGE_RATE_CACHE_TTL']:
+                self._tables.move_to_end(base_currency) # Mark as most recently used
+                self.hits += 1
+                return entry[1]
+            if entry and now < entry[2]:
+                # A fetch failed a moment ago: keep serving the expired table until the backoff ends
+                self._tables.move_to_end(base_currency)
+                self.stale_hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Cache miss (or expired entry): go to the API outside the lock so other currencies aren't blocked
+        rates = self._fetch(base_currency)
+        if rates is not None:
+            self._store(base_currency, rates, now)
+            self._save_snapshot(base_currency, rates, now)
+            self._record_history(base_currency, rates, now)
+            return rates
+
+        # The API is down: prefer an expired in-memory table, then the on-disk snapshot. Either is
+        # kept with its original fetch time, so it never counts as fresh (peek() ignores it), plus
+        # a retry time so the API isn't called on every request while it's down.
+        retry_at = now + current_app.config['EXCHANGE_RATE_RETRY_BACKOFF']
+        if entry:
+            with self._lock:
+                self.stale_hits += 1
+            self._store(base_currency, entry[1], entry[0], retry_at)
+            return entry[1]
+        snapshot_entry = self._load_snapshot().get(base_currency)
+        if snapshot_entry:
+            with self._lock:
+                self.snapshot_hits += 1
+            self._store(base_currency, snapshot_entry['rates'], snapshot_entry.get('fetched_at', 0), retry_at)
+            return snapshot_entry['rates']
+        return None
+
+    def peek(self, base_currency):
+        """Return the rate table for base_currency only if it is cached and fresh; never calls the API."""
+        with self._lock:
+            entry = self._tables.get(base_currency)
+            if entry and time.time() - entry[0] < current_app.config['EXCHANGE_RATE_CACHE_TTL']:
+                self._tables.move_to_end(base_currency)
+                self.hits += 1
+                return entry[1]
+        return None
+
+    def stats(self):
+        """Return the cache counters (used by the rate-cache stats endpoint)."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'snapshot_hits': self.snapshot_hits,
+                'fetch_errors': self.fetch_errors,
+                'cached_currencies': list(self._tables.keys())
+            }
+
+    def clear(self):
+        """Drop all in-memory tables and reset the counters (the disk snapshot is kept)."""
+        with self._lock:
+            self._tables.clear()
+            self._snapshot = None
+            self.hits = self.misses = self.stale_hits = self.snapshot_hits = self.fetch_errors = 0
+
+    def _store(self, base_currency, rates, fetched_at, retry_at=0):
+        with self._lock:
+            self._tables[base_currency] = (fetched_at, rates, retry_at)
+            self._tables.move_to_end(base_currency)
+            # Evict the least recently used tables once we're over the size limit
+            while len(self._tables) > current_app.config['EXCHANGE_RATE_CACHE_SIZE']:
+                self._tables.popitem(last=False)
+
+    def _fetch(self, base_currency):
+        try:
+            url = current_app.config['EXCHANGE_RATE_API_URL'].format(base=base_currency)
+            response = outbound.get('exchange_rates', url, read_timeout=current_app.config['EXCHANGE_RATE_API_TIMEOUT'])
+            if response.status_code == 200:
+                return response.json()['rates']
+            print(f"Warning: Failed to fetch conversion rates from API. Status code: {response.status_code}")
+        except Exception as e:
+            print(f"Error fetching conversion rates: {e}")
+        with self._lock:
+            self.fetch_errors += 1
+        return None
+
+    def _record_history(self, base_currency, rates, fetched_at):
+        # Every live table becomes that day's rates in the ExchangeRate history (needs the database, so an app context)
+        if not has_app_context():
+            return
+        day = datetime.utcfromtimestamp(fetched_at).date()
+        try:
+            store_rates([(day, base_currency, quote, rate) for quote, rate in rates.items()], 'live')
+        except Exception as e:
+            print(f"Warning: Could not record exchange rate history: {e}")
+
+    def _load_snapshot(self):
+        if self._snapshot is None:
+            try:
+                with open(current_app.config['EXCHANGE_RATE_SNAPSHOT_PATH']) as f:
+                    self._snapshot = json.load(f)
+            except (OSError, ValueError):
+                self._snapshot = {} # No usable snapshot yet
+        return self._snapshot
+
+    def _save_snapshot(self, base_currency, rates, fetched_at):
+        path = current_app.config['EXCHANGE_RATE_SNAPSHOT_PATH']
+        # Merge and write under the writer lock, so the last file written holds every table saved so far
+        with self._snapshot_lock:
+            with self._lock:
+                snapshot = dict(self._load_snapshot())
+                snapshot[base_currency] = {'fetched_at': fetched_at, 'rates': rates}
+                self._snapshot = snapshot
+            try:
+                # Write to a temp file of our own first so a crash never leaves a half-written snapshot behind
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump(snapshot, f)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            except OSError as e:
+                print(f"Warning: Could not write exchange rate snapshot: {e}")
+
+
+# Shared cache instance used by convert_currency
+rate_cache = ExchangeRateCache()
+
+
+class CountryCurrencyIndex:
+    """Country name -> currency code lookup, preloaded from a bundled JSON file.
+
+    Names are matched case- and accent-insensitively, with a fuzzy fallback for
+    typos. The table can optionally be refreshed from restcountries in a
+    background thread, so signup never waits on an outbound call.
+    """
+
+    def __init__(self):
+        self._by_name = {} # normalized name -> currency code; filled by load() when the app is created
+
+    @staticmethod
+    def _normalize(name):
+        # "Côte d'Ivoire " -> "cote d ivoire"
+        name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+        return ' '.join(''.join(ch if ch.isalnum() else ' ' for ch in name.lower()).split())
+
+    def load(self, path):
+        """Load the bundled index file (called once at startup)."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                countries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not load country currency index: {e}")
+            return
+        by_name = {}
+        for country in countries:
+            for name in [country['name']] + country.get('aliases', []):
+                by_name[self._normalize(name)] = country['currency']
+        self._by_name = by_name
+
+    def lookup(self, country_name):
+        """Return the currency code for country_name, or None if it can't be matched."""
+        key = self._normalize(country_name or '')
+        if not key:
+            return None
+        by_name = self._by_name # Take a reference so a concurrent refresh can't change it mid-lookup
+        if key in by_name:
+            return by_name[key]
+        # Fall back to the closest known name (handles typos like "Germny")
+        matches = difflib.get_close_matches(key, by_name.keys(), n=1, cutoff=0.8)
+        return by_name[matches[0]] if matches else None
+
+    def refresh_from_api(self):
+        """Merge the latest restcountries data into the index. Returns True on success."""
+        try:
+            response = outbound.get('country_index', current_app.config['COUNTRY_INDEX_REFRESH_URL'],
+                                    read_timeout=current_app.config['COUNTRY_INDEX_REFRESH_TIMEOUT'])
+            if response.status_code != 200:
+                print(f"Warning: Country index refresh failed. Status code: {response.status_code}")
+                return False
+            by_name = dict(self._by_name) # Keep bundled aliases the API doesn't know about
+            for country in response.json():
+                currencies = country.get('currencies') or {}
+                if not currencies:
+                    continue
+                currency_code = list(currencies.keys())[0]
+                names = country.get('name', {})
+                for name in (names.get('common'), names.get('official')):
+                    if name:
+                        by_name[self._normalize(name)] = currency_code
+            self._by_name = by_name # Swap in the new table in one step
+            return True
+        except Exception as e:
+            print(f"Error refreshing country index: {e}")
+            return False
+
+    def start_background_refresh(self, interval):
+        """Refresh the index every `interval` seconds on a daemon thread (call it inside an app context)."""
+        app = current_app._get_current_object() # The thread reads the config of the app that started it
+        def refresh_loop():
+            while True:
+                with app.app_context():
+                    self.refresh_from_api()
+                time.sleep(interval)
+        thread = threading.Thread(target=refresh_loop, name='country-index-refresh', daemon=True)
+        thread.start()
+        return thread
+
+
+# Shared index used by signup, loaded by create_app()
+country_index = CountryCurrencyIndex()
+
+
+def get_conversion_rate(from_currency, to_currency):
+    """Return the exchange rate from one currency to another, or None if it isn't available."""
+    if from_currency == to_currency:
+        return 1
+
+    rates = rate_cache.get_rates(from_currency)
+    if rates is None:
+        print(f"Warning: No conversion rates available for {from_currency}")
+        return None
+    rate = rates.get(to_currency)
+    if not rate:
+        print(f"Warning: Conversion rate for {to_currency} not found in rates for {from_currency}")
+        return None
+    return rate
+
+
 def convert_currency(amount, from_currency, to_currency):
-    """Convert amount from one currency to another using an external API."""
+    """Convert amount from one currency to another using cached exchange rates.
+
+    Returns None if no rate is available (API down and no snapshot), so the
+    expense is never stored with an unconverted amount posing as converted.
+    """
     if from_currency == to_currency:
         return amount
 
+    rate = get_conversion_rate(from_currency, to_currency)
+    if rate is None:
+        return None
+    return round(amount * rate, 2)
+
+
+def validate_expense_data(data):
+    """Check one submitted expense.
+
+    Returns (fields, None) with the cleaned column values, or (None, message)
+    if the expense is invalid.
+    """
+    amount = data.get('amount')
+    original_currency_code = data.get('original_currency_code', 'USD') # Default to USD if not provided
+    category = data.get('category')
+    description = data.get('description', '') # Default to empty string
+    date_str = data.get('date') # Expecting date in YYYY-MM-DD format
+
+    # Validate required fields
+    if not amount or not category or not date_str:
+        return None, 'Amount, category, and date are required.'
+
+    # Convert date string to date object
     try:
-        response = requests.get(f"https://api.exchangerate-api.com/v4/latest/{from_currency}")
-        if response.status_code == 200:
-            data = response.json()
-            rate = data['rates'].get(to_currency)
-            if rate:
-                return round(amount * rate, 2)
-            else:
-                print(f"Warning: Conversion rate for {to_currency} not found in API response for {from_currency}")
-                return amount # Fallback to original amount if rate not found
-        else:
-            print(f"Warning: Failed to fetch conversion rate from API. Status code: {response.status_code}")
-            return amount # Fallback to original amount if API call fails
+        expense_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None, 'Invalid date format. Use YYYY-MM-DD.'
+
+    # Validate amount is a positive number
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        return None, 'Amount must be a number.'
+    if amount <= 0:
+        return None, 'Amount must be greater than zero.'
+
+    return {
+        'amount': amount,
+        'original_currency_code': original_currency_code,
+        'category': category,
+        'description': description,
+        'date': expense_date
+    }, None
+
+
+def resolve_initial_approver_id(principal):
+    """Pick who approves a new expense from this user (a Principal).
+
+    The direct manager if they are an approver, otherwise the first admin in
+    the company. Returns None if neither exists.
+    """
+    if principal.manager_id and principal.manager_is_approver:
+        return principal.manager_id
+    return principal.company_admin_id
+
+
+# --- Historical Exchange Rates ---
+# ExchangeRate keeps one rate per (day, base, quote). Every table fetched from
+# the live API is recorded under the day it was fetched, older days can be
+# imported from a CSV (`flask --app app import-rates`) or fetched on demand
+# from EXCHANGE_RATE_HISTORY_URL, and expenses convert with the rate for
+# Expense.date. A stored rate also covers the next EXCHANGE_RATE_MAX_AGE_DAYS
+# days (weekends and holidays have no rates of their own). When no rate for
+# the date can be found, the conversion worker falls back to the closest
+# stored rate (or the live one) and marks the expense 'approximate'.
+
+def store_rates(rows, source):
+    """Upsert (day, base, quote, rate) tuples into ExchangeRate, in a transaction of their own."""
+    rows = [{'rate_date': day, 'base_currency': base, 'quote_currency': quote, 'rate': float(rate), 'source': source}
+            for day, base, quote, rate in rows if base != quote and rate]
+    if not rows:
+        return 0
+    table = ExchangeRate.__table__
+    statement = upsert_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['base_currency', 'quote_currency', 'rate_date'],
+        set_={'rate': statement.excluded.rate, 'source': statement.excluded.source}
+    )
+    with db.engine.begin() as connection:
+        connection.execute(statement, rows)
+    return len(rows)
+
+
+def rate_is_current(day):
+    """True if the live rate table is good enough for an expense dated `day`."""
+    return day >= datetime.utcnow().date() - timedelta(days=current_app.config['EXCHANGE_RATE_MAX_AGE_DAYS'])
+
+
+class RateSeries:
+    """One currency pair's stored rates in date order, as parallel arrays (day number, rate)."""
+
+    def __init__(self, points):
+        days = sorted(points) # points: {date.toordinal(): rate}
+        self.days = array('l', days)
+        self.rates = array('d', (points[day] for day in days))
+
+    def rate_on(self, day):
+        """The rate in effect on day number `day`, or None if the latest earlier rate is too old."""
+        i = bisect_right(self.days, day) - 1
+        if i < 0 or day - self.days[i] > current_app.config['EXCHANGE_RATE_MAX_AGE_DAYS']:
+            return None
+        return self.rates[i]
+
+    def nearest(self, day):
+        """The stored rate closest in time to day number `day`, however old, or None if there are none."""
+        if not self.days:
+            return None
+        i = bisect_right(self.days, day)
+        if i == len(self.days) or (i > 0 and day - self.days[i - 1] <= self.days[i] - day):
+            i -= 1
+        return self.rates[i]
+
+    def convert(self, amounts, days):
+        """Convert parallel arrays of amounts and day numbers; None where no rate is in effect.
+
+        Each amount still costs one bisect of the pair's day index; the gain is
+        that the series is loaded once per pair, not queried once per expense.
+        """
+        days_index, rates, max_age = self.days, self.rates, current_app.config['EXCHANGE_RATE_MAX_AGE_DAYS']
+        converted = [None] * len(amounts)
+        for n, (amount, day) in enumerate(zip(amounts, days)):
+            i = bisect_right(days_index, day) - 1
+            if i >= 0 and day - days_index[i] <= max_age:
+                converted[n] = round(amount * rates[i], 2)
+        return converted
+
+
+def load_rate_series(pairs):
+    """Load the stored rates for (from, to) pairs in one query. Inverse rates fill days a pair has no rate for."""
+    points = {pair: {} for pair in pairs}
+    wanted = set(pairs) | {(to_currency, from_currency) for from_currency, to_currency in pairs}
+    inverse = []
+    if pairs:
+        for base, quote, day, rate in db.session.execute(
+            db.select(ExchangeRate.base_currency, ExchangeRate.quote_currency, ExchangeRate.rate_date, ExchangeRate.rate)
+            .where(db.tuple_(ExchangeRate.base_currency, ExchangeRate.quote_currency).in_(sorted(wanted)))
+        ):
+            if (base, quote) in points:
+                points[(base, quote)][day.toordinal()] = rate
+            if (quote, base) in points and rate:
+                inverse.append(((quote, base), day.toordinal(), 1 / rate))
+    for pair, day, rate in inverse:
+        points[pair].setdefault(day, rate)
+    return {pair: RateSeries(pair_points) for pair, pair_points in points.items()}
+
+
+def fetch_rate_for_day(from_currency, to_currency, day):
+    """Get a rate that isn't stored yet: the live API for recent days, the history API (if configured) for older ones.
+
+    Whatever is fetched is recorded in ExchangeRate. Returns None if no rate is available.
+    """
+    if from_currency == to_currency:
+        return 1
+    if rate_is_current(day):
+        return get_conversion_rate(from_currency, to_currency) # Live fetches are recorded by the rate cache
+    history_url = current_app.config['EXCHANGE_RATE_HISTORY_URL']
+    if not history_url:
+        return None
+    try:
+        response = outbound.get('exchange_rate_history', history_url.format(date=day.isoformat(), base=from_currency),
+                                read_timeout=current_app.config['EXCHANGE_RATE_API_TIMEOUT'])
+        if response.status_code != 200:
+            print(f"Warning: Failed to fetch historical rates for {from_currency} on {day}. Status code: {response.status_code}")
+            return None
+        rates = response.json()['rates']
     except Exception as e:
-        print(f"Error converting currency: {e}")
-        return amount # Fallback to original amount on exception
+        print(f"Error fetching historical rates: {e}")
+        return None
+    store_rates([(day, from_currency, quote, rate) for quote, rate in rates.items()], 'history')
+    return rates.get(to_currency) or None
+
+
+def reconvert_expenses(company_id=None, reset_missing=False):
+    """Recompute converted_amount from the stored rate for each expense's date, into its company's current currency.
+
+    Expenses are read in keyset chunks of RECONVERT_BATCH_SIZE; each chunk is
+    grouped by currency pair, converted against the pairs' in-memory rate
+    series (RateSeries.convert, one lookup per expense) and written back with
+    one bulk UPDATE plus one summary upsert. Expenses with no stored rate keep their amount,
+    unless reset_missing is set (e.g. after a base currency change), in which
+    case they are queued for the conversion worker instead.
+    Returns counts of updated, unchanged, missing and queued expenses.
+    """
+    statement = (
+        db.select(Expense.id, Expense.amount, Expense.original_currency_code, Expense.date, Expense.converted_amount,
+                  Expense.conversion_status, Expense.status, Expense.submitted_by_id, Expense.current_approver_id,
+                  Expense.category, Expense.company_id, Company.base_currency_code)
+        .join(Company, Expense.company_id == Company.id)
+    )
+    if company_id is not None:
+        statement = statement.where(Expense.company_id == company_id)
+    counts = {'updated': 0, 'unchanged': 0, 'missing': 0, 'queued': 0}
+    series = {}
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            statement.where(Expense.id > last_id).order_by(Expense.id).limit(current_app.config['RECONVERT_BATCH_SIZE'])
+        ).all()
+        if not rows:
+            return counts
+        last_id = rows[-1].id
+
+        # Group the chunk by currency pair and convert each group against its pair's rate series
+        groups = {}
+        for index, row in enumerate(rows):
+            groups.setdefault((row.original_currency_code, row.base_currency_code), []).append(index)
+        series.update(load_rate_series([pair for pair in groups if pair[0] != pair[1] and pair not in series]))
+        new_amounts = [None] * len(rows)
+        for pair, indexes in groups.items():
+            amounts = array('d', (rows[i].amount for i in indexes))
+            if pair[0] == pair[1]:
+                converted = list(amounts)
+            else:
+                converted = series[pair].convert(amounts, array('l', (rows[i].date.toordinal() for i in indexes)))
+            for i, amount in zip(indexes, converted):
+                new_amounts[i] = amount
+
+        updates = []
+        queued = []
+        summary = SummaryDeltas()
+        versions = ListVersionBumps()
+        reset_approver_ids = set() # Approvers whose open queues should be re-sent after this chunk
+        for row, new_amount in zip(rows, new_amounts):
+            if new_amount is None:
+                if not reset_missing:
+                    counts['missing'] += 1
+                    continue
+            elif new_amount == row.converted_amount and row.conversion_status == 'converted':
+                counts['unchanged'] += 1
+                continue
+            new_status = 'converted' if new_amount is not None else 'pending'
+            updates.append({'id': row.id, 'converted_amount': new_amount, 'conversion_status': new_status})
+            summary.add(row.company_id, row.submitted_by_id, row.category, row.date, row.status, row.converted_amount, -1)
+            summary.add(row.company_id, row.submitted_by_id, row.category, row.date, row.status, new_amount, 1)
+            versions.add_expense(row)
+            if row.status == 'pending':
+                reset_approver_ids.add(row.current_approver_id)
+            if new_amount is None:
+                queued.append({'expense_id': row.id, 'from_currency': row.original_currency_code,
+                               'to_currency': row.base_currency_code})
+        if updates:
+            changed_ids = [update['id'] for update in updates]
+            # Replace any queued job for these expenses (it may target the old currency)
+            db.session.execute(db.delete(ConversionJob).where(ConversionJob.expense_id.in_(changed_ids)))
+            db.session.execute(db.update(Expense), updates)
+            if queued:
+                db.session.execute(db.insert(ConversionJob), queued)
+            summary.flush()
+            versions.flush()
+        db.session.commit()
+        pending_events.publish([reset_event(approver_id) for approver_id in reset_approver_ids])
+        counts['updated'] += len(updates) - len(queued)
+        counts['missing'] += len(queued)
+        counts['queued'] += len(queued)
+
+
+# CLI command: flask --app app import-rates rates.csv
+@expenses_bp.cli.command('import-rates')
+@click.argument('path')
+def import_rates_command(path):
+    """Load historical rates from a CSV with the columns date,base,quote,rate."""
+    with open(path, newline='') as f:
+        rows = [(datetime.strptime(row['date'], '%Y-%m-%d').date(), row['base'].upper(), row['quote'].upper(), float(row['rate']))
+                for row in csv.DictReader(f)]
+    print(f"Imported {store_rates(rows, 'import')} exchange rates.")
+
+
+# CLI command: flask --app app reconvert-expenses [--company-id N] [--base-currency EUR]
+@expenses_bp.cli.command('reconvert-expenses')
+@click.option('--company-id', type=int, default=None, help='Only this company (default: all companies).')
+@click.option('--base-currency', default=None, help="Change the company's base currency first (needs --company-id).")
+def reconvert_expenses_command(company_id, base_currency):
+    """Recompute converted amounts from the historical rate for each expense's date."""
+    if base_currency:
+        company = db.session.get(Company, company_id) if company_id is not None else None
+        if company is None:
+            raise click.UsageError('--base-currency needs the --company-id of an existing company.')
+        company.base_currency_code = base_currency.upper()
+        db.session.commit()
+    started = time.perf_counter()
+    # After a currency change, amounts without a rate would be in the old currency: queue them instead
+    counts = reconvert_expenses(company_id, reset_missing=bool(base_currency))
+    elapsed = time.perf_counter() - started
+    total = sum(counts[key] for key in ('updated', 'unchanged', 'missing'))
+    print(f"Reconverted {total} expenses in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f}/s): "
+          f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['missing']} without a stored rate "
+          f"({counts['queued']} queued for the conversion worker).")
+    if counts['queued']:
+        conversion_worker.notify()
+
+
+# --- Currency Conversion Queue ---
+# Submitting an expense never waits on the exchange-rate API. If the rate is
+# already cached in memory the amount is converted inline; otherwise the
+# expense is stored with conversion_status='pending' plus a ConversionJob row,
+# and a background worker fills in converted_amount later. The worker claims
+# jobs with a lease (next_attempt_at pushed forward), so several processes can
+# run workers, and jobs held by a worker that died come back on their own.
+
+CONVERSION_STATUSES = ('pending', 'converted', 'approximate', 'failed')
+
+metrics.counter('conversion_jobs_total', 'Queued currency conversions processed, by outcome.')
+
+
+def cached_conversion_rate(from_currency, to_currency):
+    """Return the rate if it's available without an API call, else None."""
+    if from_currency == to_currency:
+        return 1
+    rates = rate_cache.peek(from_currency)
+    return (rates or {}).get(to_currency) or None
+
+
+def queue_conversion(expense, to_currency):
+    """Mark a new, unconverted expense as pending and add its job to the session."""
+    expense.converted_amount = None
+    expense.conversion_status = 'pending'
+    db.session.add(ConversionJob(expense=expense, from_currency=expense.original_currency_code, to_currency=to_currency))
+
+
+class ConversionWorker:
+    """Converts queued expenses in batches, using the rate for each expense's date, with retries and backoff."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def notify(self):
+        """Wake the worker thread (starting it on first use) after new jobs were committed."""
+        if not current_app.config['CONVERSION_WORKER_ENABLED']:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                # The thread works for the app that started it
+                self._thread = threading.Thread(target=self._run, args=(current_app._get_current_object(),),
+                                                name='conversion-worker', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self, app):
+        while True:
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    claimed = self.run_once()
+            except Exception as e:
+                print(f"Error in conversion worker: {e}")
+                claimed = 0
+            # A full batch means more jobs are probably due; otherwise sleep until notified or the next poll
+            if claimed < app.config['CONVERSION_BATCH_SIZE']:
+                self._wake.wait(app.config['CONVERSION_POLL_INTERVAL'])
+
+    def run_once(self):
+        """Claim one batch of due jobs and process it. Returns the number of jobs claimed."""
+        jobs = self._claim()
+        if not jobs:
+            return 0
+
+        # Rates for each expense's date: stored history first (one query for all pairs),
+        # then one fetch per missing (pair, day), in parallel
+        pairs = sorted({(job.from_currency, job.to_currency) for job in jobs if job.from_currency != job.to_currency})
+        series = load_rate_series(pairs)
+        rates = {}
+        for job in jobs:
+            pair = (job.from_currency, job.to_currency)
+            rates[job.id] = 1 if pair[0] == pair[1] else series[pair].rate_on(job.date.toordinal())
+        missing = sorted({(job.from_currency, job.to_currency, job.date) for job in jobs if rates[job.id] is None})
+        if missing:
+            app = current_app._get_current_object()
+            def fetch(key):
+                with app.app_context():
+                    return fetch_rate_for_day(*key)
+            with ThreadPoolExecutor(max_workers=current_app.config['CONVERSION_FETCH_WORKERS']) as pool:
+                fetched = dict(zip(missing, pool.map(fetch, missing)))
+            for job in jobs:
+                if rates[job.id] is None:
+                    rates[job.id] = fetched[(job.from_currency, job.to_currency, job.date)]
+
+        # Still no rate for the date (too old for the live table, no history source): use the
+        # closest stored rate, else the live one, and mark the amount approximate.
+        # reconvert-expenses replaces it once a rate for the date is imported.
+        approximate = set()
+        for job in jobs:
+            if rates[job.id] is None:
+                rates[job.id] = (series[(job.from_currency, job.to_currency)].nearest(job.date.toordinal())
+                                 or get_conversion_rate(job.from_currency, job.to_currency))
+                if rates[job.id] is not None:
+                    approximate.add(job.expense_id)
+
+        converted = {job.expense_id: round(job.amount * rates[job.id], 2) for job in jobs if rates[job.id] is not None}
+        failed = [job for job in jobs if job.expense_id not in converted]
+        try:
+            gave_up = self._save(jobs, converted, failed, approximate)
+        except Exception:
+            db.session.rollback() # The lease runs out and the jobs are picked up again
+            raise
+        metrics.inc('conversion_jobs_total', (('outcome', 'converted'),), len(converted) - len(approximate))
+        metrics.inc('conversion_jobs_total', (('outcome', 'approximate'),), len(approximate))
+        metrics.inc('conversion_jobs_total', (('outcome', 'retried'),), len(failed) - gave_up)
+        metrics.inc('conversion_jobs_total', (('outcome', 'failed'),), gave_up)
+        return len(jobs)
+
+    def _claim(self):
+        """Push the next_attempt_at of up to CONVERSION_BATCH_SIZE due jobs past the lease and return them."""
+        now = datetime.utcnow()
+        due = (
+            db.select(ConversionJob.id)
+            .where(ConversionJob.status == 'queued', ConversionJob.next_attempt_at <= now)
+            .order_by(ConversionJob.next_attempt_at)
+            .limit(current_app.config['CONVERSION_BATCH_SIZE'])
+            .with_for_update(skip_locked=True) # PostgreSQL: concurrent workers skip each other's rows
+        )
+        # One UPDATE that re-checks the due condition, so two workers can't both claim a job
+        claimed_ids = db.session.scalars(
+            db.update(ConversionJob)
+            .where(ConversionJob.id.in_(due.scalar_subquery()), ConversionJob.status == 'queued',
+                   ConversionJob.next_attempt_at <= now)
+            .values(next_attempt_at=now + timedelta(seconds=current_app.config['CONVERSION_JOB_LEASE']))
+            .returning(ConversionJob.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        if not claimed_ids:
+            return []
+        return db.session.execute(
+            db.select(ConversionJob.id, ConversionJob.expense_id, ConversionJob.from_currency,
+                      ConversionJob.to_currency, ConversionJob.attempts, Expense.amount, Expense.date)
+            .join(Expense, ConversionJob.expense_id == Expense.id)
+            .where(ConversionJob.id.in_(claimed_ids))
+        ).all()
+
+    def _save(self, jobs, converted, failed, approximate=()):
+        """Write converted amounts, summary deltas and retry state in one transaction.
+
+        Expenses in `approximate` were converted without a rate for their date.
+
+        Returns how many expenses were given up on (marked 'failed').
+        """
+        now = datetime.utcnow()
+        gave_up = []
+        versions = ListVersionBumps()
+        events = []
+        # Start with a write so SQLite takes the write lock before we read the expenses' current status
+        db.session.execute(db.delete(ConversionJob).where(ConversionJob.id.in_(
+            [job.id for job in jobs if job.expense_id in converted])))
+        if converted:
+            summary = SummaryDeltas()
+            expenses = db.session.execute(
+                db.select(Expense.id, Expense.submitted_by_id, Expense.current_approver_id, Expense.category, Expense.date,
+                          Expense.status, Expense.company_id)
+                .where(Expense.id.in_(list(converted)))
+                .with_for_update(of=Expense)
+            ).all()
+            for expense in expenses:
+                # The expense moves from "unconverted" to its converted total, in whatever status it's in now
+                summary.add(expense.company_id, expense.submitted_by_id, expense.category, expense.date, expense.status, None, -1)
+                summary.add(expense.company_id, expense.submitted_by_id, expense.category, expense.date, expense.status,
+                            converted[expense.id], 1)
+                versions.add_expense(expense)
+                if expense.status == 'pending':
+                    events.append(conversion_event(expense.id, expense.current_approver_id, converted[expense.id],
+                                                   'approximate' if expense.id in approximate else 'converted'))
+            db.session.execute(db.update(Expense), [
+                {'id': expense_id, 'converted_amount': amount,
+                 'conversion_status': 'approximate' if expense_id in approximate else 'converted'}
+                for expense_id, amount in converted.items()
+            ])
+            summary.flush()
+        if failed:
+            retry_updates = []
+            for job in failed:
+                attempts = job.attempts + 1
+                delay = min(current_app.config['CONVERSION_RETRY_BASE'] * 2 ** (attempts - 1), current_app.config['CONVERSION_RETRY_MAX'])
+                exhausted = attempts >= current_app.config['CONVERSION_MAX_ATTEMPTS']
+                retry_updates.append({
+                    'id': job.id, 'attempts': attempts, 'status': 'failed' if exhausted else 'queued',
+                    'next_attempt_at': now + timedelta(seconds=delay),
+                    'last_error': f'No exchange rate available for {job.from_currency} -> {job.to_currency} on {job.date}'
+                })
+                if exhausted:
+                    gave_up.append(job.expense_id)
+            db.session.execute(db.update(ConversionJob), retry_updates)
+            if gave_up:
+                for expense in db.session.execute(
+                    db.update(Expense).where(Expense.id.in_(gave_up)).values(conversion_status='failed')
+                    .returning(Expense.id, Expense.submitted_by_id, Expense.current_approver_id, Expense.status)
+                    .execution_options(synchronize_session=False)
+                ):
+                    versions.add_expense(expense)
+                    if expense.status == 'pending':
+                        events.append(conversion_event(expense.id, expense.current_approver_id, None, 'failed'))
+        versions.flush()
+        db.session.commit()
+        pending_events.publish(events)
+        return len(gave_up)
+
+
+# Shared worker; started by create_app() (or by the first submission that queues a job, or `flask --app app process-conversions`)
+conversion_worker = ConversionWorker()
+
+
+# CLI command: flask --app app process-conversions
+@expenses_bp.cli.command('process-conversions')
+def process_conversions_command():
+    """Convert every queued expense that is due now, then exit."""
+    total = 0
+    while True:
+        claimed = conversion_worker.run_once()
+        total += claimed
+        if claimed < current_app.config['CONVERSION_BATCH_SIZE']:
+            break
+    pending = ConversionJob.query.filter_by(status='queued').count()
+    print(f"Processed {total} conversion jobs; {pending} still queued.")
+
+
+# --- Expense Serialization ---
+# The JSON list endpoints (my, team, pending, search, the pending streams) and
+# the export select plain column tuples rather than ORM objects, and turn each
+# row into a dict with the serializer for that projection. A serializer's row
+# function is generated once, as a single dict literal over row indexes, so a
+# row costs one call: no object hydration or identity-map work, no attribute
+# lookups, no per-field branching. Dates and datetimes are left as they are;
+# dump_json() writes them as ISO 8601 strings, with orjson (which formats them
+# in C) when it's installed and the json module's C encoder otherwise. Send
+# these dicts through dump_json()/json_response(), not jsonify().
+
+class RowSerializer:
+    """Maps rows of a fixed column projection to JSON-ready dicts.
+
+    `fields` is a list of (key, column) pairs. select() selects exactly those
+    columns (extra ones go after them and are ignored), and dump(row) turns a
+    result row, or any sequence in the same order, into {key: value}.
+    """
+
+    def __init__(self, fields):
+        self.keys = tuple(key for key, _ in fields)
+        self.columns = tuple(column for _, column in fields)
+        # def dump(row): return {'id': row[0], 'amount': row[1], ...}
+        items = ', '.join(f'{key!r}: row[{index}]' for index, key in enumerate(self.keys))
+        namespace = {}
+        exec(f'def dump(row):\n    return {{{items}}}', namespace)
+        self.dump = namespace['dump']
+
+    def select(self, *extra_columns):
+        return db.select(*self.columns, *extra_columns)
+
+    def dump_all(self, rows):
+        return list(map(self.dump, rows))
+
+    def from_object(self, obj, **values):
+        """dump() for an ORM object with attributes named like the keys; `values` supplies the others."""
+        return self.dump([values[key] if key in values else getattr(obj, key) for key in self.keys])
+
+
+# An expense as listed to its submitter (/api/expenses/my)
+EXPENSE_ROW = RowSerializer([
+    ('id', Expense.id),
+    ('amount', Expense.amount),
+    ('original_currency_code', Expense.original_currency_code),
+    ('converted_amount', Expense.converted_amount),
+    ('conversion_status', Expense.conversion_status), # 'pending' until the background conversion has run
+    ('category', Expense.category),
+    ('description', Expense.description),
+    ('date', Expense.date),
+    ('status', Expense.status),
+    ('submitted_at', Expense.submitted_at)
+])
+
+# An expense with its submitter, for lists that span several people (team, pending queue, search)
+SUBMITTED_EXPENSE_ROW = RowSerializer(list(zip(EXPENSE_ROW.keys, EXPENSE_ROW.columns)) + [
+    ('submitted_by_id', Expense.submitted_by_id),
+    ('submitted_by_username', User.username)
+])
+
+# One step of an expense's approval history (the export); the approver is an aliased User
+approval_approver = db.aliased(User, name='approver')
+APPROVAL_ROW = RowSerializer([
+    ('approver', approval_approver.username),
+    ('status', Approval.status),
+    ('comment', Approval.comment),
+    ('approved_at', Approval.approved_at)
+])
+
+
+def submitted_expense_select():
+    """SUBMITTED_EXPENSE_ROW columns, joined to the submitter; add the filters."""
+    return SUBMITTED_EXPENSE_ROW.select().join(User, Expense.submitted_by_id == User.id)
+
+
+def _json_default(value):
+    if isinstance(value, date): # Also datetime
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def dump_json(payload):
+    """Compact JSON as UTF-8 bytes; dates and datetimes become ISO 8601 strings."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return _json_encoder.encode(payload).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Like jsonify(), but encoded with dump_json() (use it for the large list responses)."""
+    return current_app.response_class(dump_json(payload), status=status, mimetype='application/json')
+
+
+# --- Expense List Queries & Pagination ---
+
+EXPENSE_STATUSES = ('pending', 'approved', 'rejected')
+
+
+def expense_list_query():
+    """Expense query that loads the submitter and current approver in the same SELECT.
+
+    Use this for anything that lists expenses together with user names, so
+    templates and serializers never trigger one lazy User lookup per row.
+    """
+    return Expense.query.options(
+        db.joinedload(Expense.submitted_by),
+        db.joinedload(Expense.current_approver)
+    )
+
+
+def encode_expense_cursor(expense):
+    """Build an opaque cursor pointing just after this expense in (submitted_at, id) order."""
+    raw = f"{expense.submitted_at.isoformat()}|{expense.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_expense_cursor(cursor):
+    """Turn a cursor back into (submitted_at, id). Raises ValueError if it's malformed."""
+    try:
+        submitted_at, expense_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(submitted_at), int(expense_id)
+    except Exception:
+        raise ValueError('Invalid cursor.')
+
+
+def apply_expense_filters(query, args):
+    """Apply the status/category/date-range filters from request args in SQL.
+
+    Works on both Expense.query and db.select(...) statements. Raises
+    ValueError on bad input.
+    """
+    status = args.get('status')
+    if status:
+        if status not in EXPENSE_STATUSES:
+            raise ValueError(f"Invalid status. Use one of: {', '.join(EXPENSE_STATUSES)}.")
+        query = query.filter(Expense.status == status)
+    category = args.get('category')
+    if category:
+        query = query.filter(Expense.category == category)
+    try:
+        if args.get('date_from'):
+            query = query.filter(Expense.date >= datetime.strptime(args['date_from'], '%Y-%m-%d').date())
+        if args.get('date_to'):
+            query = query.filter(Expense.date <= datetime.strptime(args['date_to'], '%Y-%m-%d').date())
+    except ValueError:
+        raise ValueError('Invalid date format. Use YYYY-MM-DD.')
+    return query
+
+
+def paginate_expenses(query, args):
+    """Apply the status/category/date filters and keyset pagination from request args.
+
+    Expenses are ordered newest first by (submitted_at, id); the cursor marks
+    the last row of the previous page, so each page is a single indexed range
+    scan no matter how deep the user pages. `query` is an ORM query (rows are
+    Expense objects) or a select() of columns including Expense.id and
+    Expense.submitted_at (rows are tuples). Returns (rows, next_cursor), where
+    next_cursor is None on the last page. Raises ValueError on bad input.
+    """
+    # --- Filters (all applied in SQL) ---
+    query = apply_expense_filters(query, args)
+
+    # --- Page size ---
+    try:
+        limit = int(args.get('limit', current_app.config['EXPENSE_PAGE_SIZE']))
+    except ValueError:
+        raise ValueError('limit must be an integer.')
+    limit = max(1, min(limit, current_app.config['EXPENSE_PAGE_SIZE_MAX']))
+
+    # --- Keyset: only rows strictly after the cursor ---
+    cursor = args.get('cursor')
+    if cursor:
+        cursor_submitted_at, cursor_id = decode_expense_cursor(cursor)
+        query = query.filter(db.or_(
+            Expense.submitted_at < cursor_submitted_at,
+            db.and_(Expense.submitted_at == cursor_submitted_at, Expense.id < cursor_id)
+        ))
+
+    # Fetch one extra row to find out whether there is a next page
+    query = query.order_by(Expense.submitted_at.desc(), Expense.id.desc()).limit(limit + 1)
+    rows = db.session.execute(query).all() if isinstance(query, db.Select) else query.all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_expense_cursor(rows[-1])
+    return rows, None
+
+
+def next_page_url(endpoint, next_cursor):
+    """URL of the next dashboard page, keeping the current filters."""
+    if not next_cursor:
+        return None
+    args = request.args.to_dict()
+    args['cursor'] = next_cursor
+    return url_for(endpoint, **args)
+
+
+# --- Pending Queue Events ---
+# Approvers can keep a server-sent-events stream open instead of reloading
+# their dashboard. Routes publish small events after they commit (an expense
+# added to or removed from someone's queue, a conversion finishing), and the
+# hub fans them out to that approver's open streams. An idle stream just waits
+# on its queue, so it costs no queries. Events go through a pluggable backend:
+# 'local' delivers inside this process only; 'database' writes them to the
+# pending_event table, which one listener thread per process polls while any
+# stream is open, so every worker process sees every event.
+
+def pending_item(expense, submitted_by_username):
+    """One row of an approver's pending queue (SUBMITTED_EXPENSE_ROW), built from an Expense object."""
+    return SUBMITTED_EXPENSE_ROW.from_object(expense, submitted_by_username=submitted_by_username)
+
+
+def pending_queue(approver_id):
+    """Every expense waiting for this approver, as listed by /api/expenses/pending and sent as stream snapshots."""
+    rows = db.session.execute(
+        submitted_expense_select().where(Expense.current_approver_id == approver_id, Expense.status == 'pending')
+    )
+    return SUBMITTED_EXPENSE_ROW.dump_all(rows)
+
+
+def added_event(expense, submitted_by_username):
+    """The expense has just entered its current approver's queue."""
+    return expense.current_approver_id, {'type': 'added', 'expense': pending_item(expense, submitted_by_username)}
+
+
+def removed_event(approver_id, expense):
+    """The expense has left this approver's queue (decided, or handed to the next approver)."""
+    return approver_id, {'type': 'removed', 'expense_id': expense.id, 'status': expense.status}
+
+
+def conversion_event(expense_id, approver_id, converted_amount, conversion_status):
+    """A queued conversion finished (or gave up) for an expense still in this approver's queue."""
+    return approver_id, {'type': 'updated', 'expense_id': expense_id, 'converted_amount': converted_amount,
+                         'conversion_status': conversion_status}
+
+
+def reset_event(approver_id):
+    """The approver's queue changed in bulk; open streams re-send a full snapshot."""
+    return approver_id, {'type': 'reset'}
+
+
+class LocalEventBackend:
+    """Delivers events straight to the streams open in this process."""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, events):
+        self.hub.deliver(events)
+
+    def listen(self):
+        pass
+
+
+class DatabaseEventBackend:
+    """Shares events between processes through the pending_event table.
+
+    publish() inserts the events; a listener thread in each process polls for
+    new rows every EVENT_POLL_INTERVAL seconds (only while that process has
+    open streams) and hands them to the hub, including its own.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, events):
+        db.session.execute(db.insert(PendingEvent), [
+            {'approver_id': approver_id, 'payload': dump_json(payload).decode(), 'created_at': datetime.utcnow()}
+            for approver_id, payload in events
+        ])
+        db.session.commit()
+
+    def listen(self):
+        """Start the listener thread unless it's already running (called by the first stream to open)."""
+        with self._lock:
+            if self._thread is None:
+                # Read the starting point now, before the new stream takes its snapshot, so nothing falls in between
+                last_id = db.session.scalar(db.select(db.func.max(PendingEvent.id))) or 0
+                app = current_app._get_current_object()
+                self._thread = threading.Thread(target=self._run, args=(app, last_id), name='pending-event-listener', daemon=True)
+                self._thread.start()
+
+    def _run(self, app, last_id):
+        while True:
+            with self._lock:
+                # Stop once the last stream has closed; listen() starts a new thread for the next one
+                if not self.hub.has_subscribers():
+                    self._thread = None
+                    return
+            time.sleep(app.config['EVENT_POLL_INTERVAL'])
+            try:
+                with app.app_context():
+                    rows = db.session.execute(
+                        db.select(PendingEvent.id, PendingEvent.approver_id, PendingEvent.payload)
+                        .where(PendingEvent.id > last_id).order_by(PendingEvent.id)
+                    ).all()
+                    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['EVENT_RETENTION'])
+                    db.session.execute(db.delete(PendingEvent).where(PendingEvent.created_at < cutoff))
+                    db.session.commit()
+            except Exception as e:
+                print(f"Error reading pending events: {e}")
+                continue
+            if rows:
+                last_id = rows[-1].id
+                self.hub.deliver([(row.approver_id, json.loads(row.payload)) for row in rows])
+
+
+# Backends selectable with EVENT_BACKEND; add another class here to plug in a different transport
+EVENT_BACKENDS = {
+    'local': LocalEventBackend,
+    'database': DatabaseEventBackend,
+}
+
+metrics.gauge('pending_stream_subscribers', 'Pending-queue event streams open in this process.')
+
+
+class PendingQueueHub:
+    """In-process publish/subscribe of pending-queue events, keyed by approver ID."""
+
+    def __init__(self):
+        self._subscribers = {} # approver ID -> set of queue.Queue, one per open stream
+        self._lock = threading.Lock()
+        self._backend = None
+        self._backend_name = None
+
+    @property
+    def backend(self):
+        """The EVENT_BACKENDS entry named by EVENT_BACKEND (created on first use)."""
+        name = current_app.config['EVENT_BACKEND']
+        if self._backend_name != name:
+            self._backend = EVENT_BACKENDS[name](self)
+            self._backend_name = name
+        return self._backend
+
+    def subscribe(self, approver_id):
+        events = queue.Queue(maxsize=current_app.config['EVENT_QUEUE_SIZE'])
+        with self._lock:
+            self._subscribers.setdefault(approver_id, set()).add(events)
+            metrics.set('pending_stream_subscribers', sum(len(queues) for queues in self._subscribers.values()))
+        self.backend.listen()
+        return events
+
+    def unsubscribe(self, approver_id, events):
+        with self._lock:
+            queues = self._subscribers.get(approver_id)
+            if queues is not None:
+                queues.discard(events)
+                if not queues:
+                    del self._subscribers[approver_id]
+            metrics.set('pending_stream_subscribers', sum(len(queues) for queues in self._subscribers.values()))
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+    def publish(self, events):
+        """Send (approver ID, event) pairs through the backend. Call after the change is committed."""
+        events = [(approver_id, payload) for approver_id, payload in events if approver_id is not None]
+        if not events:
+            return
+        try:
+            self.backend.publish(events)
+        except Exception as e:
+            # The change itself is committed; streams catch up on their next snapshot
+            db.session.rollback()
+            print(f"Error publishing pending-queue events: {e}")
+
+    def deliver(self, events):
+        """Put events on the queues of this process's streams for their approvers."""
+        with self._lock:
+            targets = [(list(self._subscribers.get(approver_id, ())), payload) for approver_id, payload in events]
+        for queues, payload in targets:
+            for events_queue in queues:
+                try:
+                    events_queue.put_nowait(payload)
+                except queue.Full:
+                    # The client fell behind: drop what's buffered and have it re-sent as one snapshot
+                    while True:
+                        try:
+                            events_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                    events_queue.put_nowait({'type': 'reset'})
+
+
+pending_events = PendingQueueHub()
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {dump_json(data).decode()}\n\n"
+
+
+def pending_event_stream(approver_id):
+    """text/event-stream response for one approver: a snapshot of the queue, then live events.
+
+    The generator runs outside the request context, and only opens an app
+    context (and a database session) to build a snapshot.
+    """
+    app = current_app._get_current_object()
+
+    def snapshot():
+        with app.app_context():
+            return format_sse('snapshot', {'expenses': pending_queue(approver_id)})
+
+    def generate():
+        # Subscribe only once the body is actually read (a HEAD response never is), and before
+        # the snapshot, so no event between the two is missed
+        with app.app_context():
+            events = pending_events.subscribe(approver_id)
+        try:
+            yield 'retry: 5000\n\n' # Reconnect delay for EventSource, in milliseconds
+            yield snapshot()
+            while True:
+                try:
+                    payload = events.get(timeout=app.config['EVENT_STREAM_HEARTBEAT'])
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield snapshot() if payload['type'] == 'reset' else format_sse(payload['type'], payload)
+        finally:
+            pending_events.unsubscribe(approver_id, events)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}) # No proxy buffering
 
 
 # --- API Routes (Endpoints) ---
 
 # Route for employee to view their own submitted expenses
-@app.route('/api/expenses/my', methods=['GET'])
+@expenses_bp.route('/api/expenses/my', methods=['GET'])
 @jwt_required() # Requires a valid JWT token
+@conditional_expense_list # ETag / 304 from the user's list version
 def view_my_expenses():
     # Get the user ID from the JWT token
     current_user_id = int(get_jwt_identity()) # Convert string identity back to int
 
     # Query the database for expenses submitted by the current user
-    # Order by submission date, newest first
-    user_expenses = Expense.query.filter_by(submitted_by_id=current_user_id).order_by(Expense.submitted_at.desc()).all()
-
-    # Prepare the response data
-    expenses_list = []
-    for expense in user_expenses:
-        expenses_list.append({
-            'id': expense.id,
-            'amount': expense.amount,
-            'original_currency_code': expense.original_currency_code,
-            'converted_amount': expense.converted_amount, # Include converted amount
-            'category': expense.category,
-            'description': expense.description,
-            'date': expense.date.isoformat(), # Convert date object to string
-            'status': expense.status,
-            'submitted_at': expense.submitted_at.isoformat() # Convert datetime object to string
-        })
+    # Newest first, one page at a time (see paginate_expenses for the filters), as column rows
+    try:
+        rows, next_cursor = paginate_expenses(
+            EXPENSE_ROW.select().where(Expense.submitted_by_id == current_user_id), request.args
+        )
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    return jsonify({
+    return json_response({
         'message': 'Expenses retrieved successfully',
-        'expenses': expenses_list
-    }), 200
+        'expenses': EXPENSE_ROW.dump_all(rows),
+        'next_cursor': next_cursor # Pass back as ?cursor= to get the next page; None on the last page
+    })
 
 # Route for employee to submit an expense
-@app.route('/api/expenses/submit', methods=['POST'])
+@expenses_bp.route('/api/expenses/submit', methods=['POST'])
 @jwt_required() # Requires a valid JWT token
 def submit_expense():
-    # Get the user ID from the JWT token
-    current_user_id = int(get_jwt_identity()) # Convert string identity back to int
-    current_user = User.query.get(current_user_id)
+    # Get the user for the JWT token
+    current_user = get_current_principal() # Cached user, company currency and approver
 
     if not current_user:
          return jsonify({'message': 'User not found'}), 404
 
-    # Get the JSON data sent by the user
+    # Get the JSON data sent by the user and validate it
     data = request.get_json()
-    amount = data.get('amount')
-    original_currency_code = data.get('original_currency_code', 'USD') # Default to USD if not provided
-    category = data.get('category')
-    description = data.get('description', '') # Default to empty string
-    date_str = data.get('date') # Expecting date in YYYY-MM-DD format
-
-    # Validate required fields
-    if not amount or not category or not date_str:
-        return jsonify({'message': 'Amount, category, and date are required.'}), 400
-
-    # Convert date string to date object
-    try:
-        from datetime import datetime # Import inside function if not at top level
-        expense_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-    except ValueError:
-        return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD.'}), 400
-
-    # Optional: Validate amount is positive
-    if amount <= 0:
-        return jsonify({'message': 'Amount must be greater than zero.'}), 400
-
-    # --- Currency Conversion ---
-    company = Company.query.get(current_user.company_id)
-    converted_amount = convert_currency(amount, original_currency_code, company.base_currency_code)
+    fields, error = validate_expense_data(data)
+    if error:
+        return jsonify({'message': error}), 400
 
     # Create the new Expense record
     new_expense = Expense(
-        amount=amount,
-        original_currency_code=original_currency_code,
-        converted_amount=converted_amount, # Store the converted amount
-        category=category,
-        description=description,
-        date=expense_date,
+        **fields,
         submitted_by_id=current_user.id, # Link the expense to the logged-in user
+        company_id=current_user.company_id,
         status='pending' # Initial status is pending
     )
 
-    # --- Assign Initial Approver (Simple Logic) ---
-    # For now, assign to the direct manager if they are an approver, otherwise to an admin
-    if current_user.manager and current_user.manager.is_manager_approver:
-        new_expense.current_approver_id = current_user.manager_id
+    # --- Currency Conversion ---
+    # Convert now if the rate is already cached; otherwise queue it so we never wait on the rate API
+    # (the live rate only stands in for recent dates; backdated expenses wait for the historical rate)
+    from_currency, to_currency = fields['original_currency_code'], current_user.base_currency_code
+    rate = cached_conversion_rate(from_currency, to_currency) if from_currency == to_currency or rate_is_current(fields['date']) else None
+    if rate is not None:
+        new_expense.converted_amount = fields['amount'] if rate == 1 else round(fields['amount'] * rate, 2)
+        new_expense.conversion_status = 'converted'
     else:
-        # Find the first admin user in the company
-        admin_user = User.query.filter_by(company_id=current_user.company_id, role='admin').first()
-        if admin_user:
-            new_expense.current_approver_id = admin_user.id
-        # If no admin found, current_approver_id remains None, which might need handling
-
-    # Add the expense to the database session
+        queue_conversion(new_expense, current_user.base_currency_code)
+    converted_amount = new_expense.converted_amount
+
+    # --- Assign Approvers ---
+    # The company's approval plan fixes the chain: first approver, then any rule approvers.
+    chain = approval_plans.get(current_user.company_id).chain_for(resolve_initial_approver_id(current_user), current_user.id)
+    new_expense.approval_chain = format_approval_chain(chain)
+    new_expense.current_approver_id = chain[0] if chain else None
+    # Nobody but the submitter could approve it (e.g. the company's only admin): approve it now
+    # rather than leave it pending with no approver
+    new_expense.status = 'pending' if chain else 'approved'
+
+    # Add the expense to the database session, along with its spend summary update
     db.session.add(new_expense)
+    summary = SummaryDeltas()
+    summary.add(current_user.company_id, current_user.id, new_expense.category, new_expense.date, new_expense.status, converted_amount)
+    summary.flush()
+    versions = ListVersionBumps()
+    versions.add_expense(new_expense)
+    versions.flush()
 
     try:
         # Commit the transaction to save the expense
         db.session.commit()
+        if new_expense.conversion_status == 'pending':
+            conversion_worker.notify()
+        if new_expense.current_approver_id is not None:
+            pending_events.publish([added_event(new_expense, current_user.username)]) # Live update for the approver
         return jsonify({
             'message': 'Expense submitted successfully!',
             'expense_id': new_expense.id,
             'status': new_expense.status,
+            'converted_amount': new_expense.converted_amount, # None until the queued conversion has run
+            'conversion_status': new_expense.conversion_status,
             'current_approver_id': new_expense.current_approver_id # Return the assigned approver ID
         }), 201
     except Exception as e:
@@ -487,42 +3059,149 @@ def submit_expense():
         print(f"Database error during expense submission: {e}") # Log error for debugging
         return jsonify({'message': 'An error occurred while submitting the expense.'}), 500
 
+# Route for employee to submit many expenses at once (e.g. a month-end expense sheet)
+@expenses_bp.route('/api/expenses/submit/batch', methods=['POST'])
+@jwt_required() # Requires a valid JWT token
+def submit_expense_batch():
+    # Get the user for the JWT token
+    current_user = get_current_principal() # Cached user, company currency and approver
+
+    if not current_user:
+        return jsonify({'message': 'User not found'}), 404
+
+    # Accept either a bare JSON array or {"expenses": [...]}
+    data = request.get_json()
+    rows = data.get('expenses') if isinstance(data, dict) else data
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'message': 'A non-empty list of expenses is required.'}), 400
+    if len(rows) > current_app.config['EXPENSE_BATCH_MAX']:
+        return jsonify({'message': f"At most {current_app.config['EXPENSE_BATCH_MAX']} expenses can be submitted at once."}), 400
+
+    # Validate every row first; if any row is invalid nothing is submitted
+    new_rows = []
+    errors = []
+    for index, row in enumerate(rows):
+        if isinstance(row, dict):
+            fields, error = validate_expense_data(row)
+        else:
+            fields, error = None, 'Each expense must be a JSON object.'
+        if error:
+            errors.append({'index': index, 'message': error})
+        else:
+            new_rows.append(fields)
+    if errors:
+        return jsonify({'message': 'Some expenses are invalid. Nothing was submitted.', 'errors': errors}), 400
+
+    # Resolve the company currency and the approver chain once for the whole batch
+    base_currency_code = current_user.base_currency_code
+    chain = approval_plans.get(current_user.company_id).chain_for(resolve_initial_approver_id(current_user), current_user.id)
+    approver_id = chain[0] if chain else None
+    status = 'pending' if chain else 'approved' # Approved now if nobody but the submitter could approve (as in submit_expense)
+
+    # --- Currency Conversion ---
+    # One cached-rate lookup per distinct source currency; backdated rows and rows without a cached rate are queued
+    source_currencies = {row['original_currency_code'] for row in new_rows}
+    rates = {code: cached_conversion_rate(code, base_currency_code) for code in source_currencies}
+    for row in new_rows:
+        rate = rates[row['original_currency_code']] if rate_is_current(row['date']) else None
+        if row['original_currency_code'] == base_currency_code:
+            row['converted_amount'] = row['amount']
+        else:
+            row['converted_amount'] = round(row['amount'] * rate, 2) if rate is not None else None
+        row['conversion_status'] = 'converted' if row['converted_amount'] is not None else 'pending'
+        row['submitted_by_id'] = current_user.id
+        row['company_id'] = current_user.company_id
+        row['current_approver_id'] = approver_id
+        row['approval_chain'] = format_approval_chain(chain)
+        row['status'] = status
+
+    # Spend summary updates for the whole batch (one upsert, same transaction)
+    summary = SummaryDeltas()
+    for row in new_rows:
+        summary.add(current_user.company_id, current_user.id, row['category'], row['date'], status, row['converted_amount'])
+
+    try:
+        # Insert all rows with a single multi-row INSERT in one transaction.
+        # sort_by_parameter_order returns the IDs in the order of new_rows, whatever order the database assigns them in.
+        expense_ids = db.session.scalars(
+            db.insert(Expense).returning(Expense.id, sort_by_parameter_order=True), new_rows
+        ).all()
+        queued = [
+            {'expense_id': expense_id, 'from_currency': row['original_currency_code'], 'to_currency': base_currency_code}
+            for expense_id, row in zip(expense_ids, new_rows) if row['conversion_status'] == 'pending'
+        ]
+        if queued:
+            db.session.execute(db.insert(ConversionJob), queued)
+        summary.flush()
+        versions = ListVersionBumps()
+        versions.add(current_user.id, approver_id)
+        versions.flush()
+        db.session.commit()
+        if queued:
+            conversion_worker.notify()
+        if approver_id is not None:
+            pending_events.publish([added_event(expense, current_user.username)
+                                    for expense in Expense.query.filter(Expense.id.in_(expense_ids)).order_by(Expense.id)])
+        return jsonify({
+            'message': f'{len(expense_ids)} expenses submitted successfully!',
+            'expense_ids': expense_ids, # In the same order as the submitted list
+            'conversions_pending': len(queued), # Converted in the background; see conversion_status on each expense
+            'status': status,
+            'current_approver_id': approver_id
+        }), 201
+    except Exception as e:
+        # If something goes wrong, undo the whole batch
+        db.session.rollback()
+        print(f"Database error during batch expense submission: {e}") # Log error for debugging
+        return jsonify({'message': 'An error occurred while submitting the expenses.'}), 500
+
 # Route for manager to view expenses pending their approval
-@app.route('/api/expenses/pending', methods=['GET'])
+@expenses_bp.route('/api/expenses/pending', methods=['GET'])
 @jwt_required() # Requires a valid JWT token
+@conditional_expense_list # ETag / 304 from the user's list version
 def view_pending_expenses():
     # Get the user ID from the JWT token (the manager's ID)
     current_manager_id = int(get_jwt_identity()) # Convert string identity back to int
 
     # Query the database for expenses where the current user is the current_approver_id and status is pending
-    pending_expenses = Expense.query.filter_by(current_approver_id=current_manager_id, status='pending').all()
-
-    # Prepare the response data
-    expenses_list = []
-    for expense in pending_expenses:
-        # Fetch the employee's name who submitted it for better context
-        submitted_by_user = User.query.get(expense.submitted_by_id)
-        expenses_list.append({
-            'id': expense.id,
-            'amount': expense.amount,
-            'original_currency_code': expense.original_currency_code,
-            'converted_amount': expense.converted_amount,
-            'category': expense.category,
-            'description': expense.description,
-            'date': expense.date.isoformat(), # Convert date object to string
-            'status': expense.status,
-            'submitted_by_id': expense.submitted_by_id, # Include the ID of the submitter
-            'submitted_by_username': submitted_by_user.username if submitted_by_user else 'Unknown', # Include the submitter's username
-            'submitted_at': expense.submitted_at.isoformat() # Convert datetime object to string
-        })
+    # (the submitters are joined into the same query, so there's no per-row user lookup)
+    expenses_list = pending_queue(current_manager_id)
 
-    return jsonify({
+    return json_response({
         'message': 'Pending expenses retrieved successfully',
         'expenses': expenses_list
-    }), 200
+    })
+
+# Route for manager to follow their pending queue live (server-sent events) instead of polling
+@expenses_bp.route('/api/expenses/pending/stream', methods=['GET'])
+@jwt_required() # Requires a valid JWT token
+def stream_pending_expenses():
+    # Events: 'snapshot' (the whole queue, on connect), then 'added', 'removed' and 'updated'
+    return pending_event_stream(int(get_jwt_identity()))
+
+# Route for manager to view expenses from their whole team (direct and indirect reports)
+@expenses_bp.route('/api/expenses/team', methods=['GET'])
+@jwt_required() # Requires a valid JWT token
+def view_team_expenses():
+    # Get the user ID from the JWT token (the manager's ID)
+    current_manager_id = int(get_jwt_identity())
+
+    # One page of team expenses, newest first (same filters and cursor as /api/expenses/my)
+    try:
+        rows, next_cursor = paginate_expenses(
+            team_expense_query(current_manager_id, submitted_expense_select()), request.args
+        )
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return json_response({
+        'message': 'Team expenses retrieved successfully',
+        'expenses': SUBMITTED_EXPENSE_ROW.dump_all(rows),
+        'next_cursor': next_cursor
+    })
 
 # Route for manager to approve an expense
-@app.route('/api/expenses/<int:expense_id>/approve', methods=['POST'])
+@expenses_bp.route('/api/expenses/<int:expense_id>/approve', methods=['POST'])
 @jwt_required()
 def approve_expense(expense_id):
     # Get the manager's ID from the JWT token
@@ -547,6 +3226,7 @@ def approve_expense(expense_id):
     new_approval = Approval(
         expense_id=expense.id,
         approver_id=current_manager_id,
+        company_id=expense.company_id,
         status='approved',
         comment=comment,
         approved_at=datetime.utcnow()
@@ -554,18 +3234,32 @@ def approve_expense(expense_id):
     db.session.add(new_approval)
 
     # --- Update the Expense Status ---
-    # For now, let's assume approving finalizes the expense.
-    # In a full workflow, this is where you'd check rules and assign the next approver.
-    expense.status = 'approved'
-    expense.current_approver_id = None # No more approver needed after final approval
+    # The company's approval plan either finalizes the expense or hands it to the next approver
+    company_id = get_current_principal().company_id
+    new_status = approval_plans.get(company_id).apply_approval(expense, current_manager_id)
+
+    # Once finally approved, move the expense from pending to approved in the spend summaries
+    if new_status == 'approved':
+        summary = SummaryDeltas()
+        summary.move(company_id, expense, 'pending', 'approved')
+        summary.flush()
+    versions = ListVersionBumps()
+    versions.add(current_manager_id) # Leaves this approver's queue...
+    versions.add_expense(expense) # ...and reaches the submitter and the next approver, if any
+    versions.flush()
+    events = [removed_event(current_manager_id, expense)]
+    if new_status == 'pending':
+        events.append(added_event(expense, expense.submitted_by.username))
 
     try:
         # Commit the changes to the database
         db.session.commit()
+        pending_events.publish(events)
         return jsonify({
-            'message': 'Expense approved successfully.',
+            'message': 'Expense approved successfully.' if new_status == 'approved' else 'Approval recorded; the expense moved to the next approver.',
             'expense_id': expense.id,
-            'new_status': expense.status
+            'new_status': expense.status,
+            'current_approver_id': expense.current_approver_id # The next approver, if any
         }), 200
     except Exception as e:
         # If something goes wrong, undo the changes made in this session
@@ -574,7 +3268,7 @@ def approve_expense(expense_id):
         return jsonify({'message': 'An error occurred while processing the approval.'}), 500
 
 # Route for manager to reject an expense
-@app.route('/api/expenses/<int:expense_id>/reject', methods=['POST'])
+@expenses_bp.route('/api/expenses/<int:expense_id>/reject', methods=['POST'])
 @jwt_required()
 def reject_expense(expense_id):
     # Get the manager's ID from the JWT token
@@ -601,19 +3295,30 @@ def reject_expense(expense_id):
     new_approval = Approval(
         expense_id=expense.id,
         approver_id=current_manager_id,
+        company_id=expense.company_id,
         status='rejected',
         comment=comment,
         approved_at=datetime.utcnow()
     )
     db.session.add(new_approval)
 
+    # Move the expense from pending to rejected in the spend summaries
+    summary = SummaryDeltas()
+    summary.move(get_current_principal().company_id, expense, 'pending', 'rejected')
+    summary.flush()
+
     # --- Update the Expense Status ---
     expense.status = 'rejected'
     expense.current_approver_id = None # No more approver needed after rejection
+    versions = ListVersionBumps()
+    versions.add(current_manager_id, expense.submitted_by_id)
+    versions.flush()
+    events = [removed_event(current_manager_id, expense)]
 
     try:
         # Commit the changes to the database
         db.session.commit()
+        pending_events.publish(events)
         return jsonify({
             'message': 'Expense rejected successfully.',
             'expense_id': expense.id,
@@ -625,81 +3330,619 @@ def reject_expense(expense_id):
         print(f"Database error during rejection: {e}") # Log error for debugging
         return jsonify({'message': 'An error occurred while processing the rejection.'}), 500
 
+# Route for manager to approve or reject many expenses at once
+@expenses_bp.route('/api/expenses/bulk-decision', methods=['POST'])
+@jwt_required()
+def bulk_decide_expenses():
+    # Get the manager's ID from the JWT token
+    current_manager_id = int(get_jwt_identity())
+    return decide_expenses(current_manager_id, get_current_principal().company_id, request.get_json() or {})
+
+
+def decide_expenses(current_manager_id, company_id, data):
+    """Apply one approve/reject action to many expenses for an approver; shared by the JWT and session routes."""
+    # Request body: {"action": "approve"|"reject", "comment": "...", "expense_ids": [1, 2]}
+    # or per-item comments: {"action": ..., "items": [{"expense_id": 1, "comment": "..."}]}
+    action = data.get('action')
+    if action not in ('approve', 'reject'):
+        return jsonify({'message': 'action must be "approve" or "reject".'}), 400
+    shared_comment = data.get('comment') or ''
+    if 'items' in data:
+        items = data['items']
+    else:
+        items = [{'expense_id': expense_id} for expense_id in data.get('expense_ids') or []]
+    if not isinstance(items, list) or not items:
+        return jsonify({'message': 'A non-empty list of expense_ids or items is required.'}), 400
+    if len(items) > current_app.config['EXPENSE_BATCH_MAX']:
+        return jsonify({'message': f"At most {current_app.config['EXPENSE_BATCH_MAX']} expenses can be decided at once."}), 400
+    if not all(isinstance(item, dict) and isinstance(item.get('expense_id'), int) for item in items):
+        return jsonify({'message': 'Each item needs an integer expense_id.'}), 400
+
+    # Load every requested expense with one query
+    expense_ids = [item['expense_id'] for item in items]
+    expenses = {expense.id: expense for expense in Expense.query.filter(Expense.id.in_(expense_ids)).all()}
+
+    new_status = 'approved' if action == 'approve' else 'rejected'
+    decided_at = datetime.utcnow()
+    plan = approval_plans.get(company_id)
+    summary = SummaryDeltas()
+    versions = ListVersionBumps()
+    events = []
+    results = []
+    approval_rows = []
+    seen_ids = set()
+    for item in items:
+        expense_id = item['expense_id']
+        comment = item.get('comment') or shared_comment
+        expense = expenses.get(expense_id)
+        # Same checks as the single approve/reject routes, reported per item
+        if expense is None:
+            results.append({'expense_id': expense_id, 'ok': False, 'message': 'Expense not found.'})
+        elif expense_id in seen_ids:
+            results.append({'expense_id': expense_id, 'ok': False, 'message': 'Duplicate expense_id in request.'})
+        elif expense.current_approver_id != current_manager_id:
+            results.append({'expense_id': expense_id, 'ok': False, 'message': f'You are not authorized to {action} this expense.'})
+        elif expense.status != 'pending':
+            results.append({'expense_id': expense_id, 'ok': False, 'message': f'Expense is already {expense.status}.'})
+        elif action == 'reject' and not comment:
+            results.append({'expense_id': expense_id, 'ok': False, 'message': 'A comment is required for rejection.'})
+        else:
+            if action == 'approve':
+                # May finalize the expense or hand it to the next approver in its chain
+                expense_status = plan.apply_approval(expense, current_manager_id)
+            else:
+                expense_status = 'rejected'
+                expense.status = 'rejected'
+                expense.current_approver_id = None # No more approver needed after rejection
+            if expense_status != 'pending':
+                summary.move(company_id, expense, 'pending', expense_status)
+            versions.add(current_manager_id)
+            versions.add_expense(expense)
+            events.append(removed_event(current_manager_id, expense))
+            if expense_status == 'pending':
+                events.append(added_event(expense, expense.submitted_by.username))
+            approval_rows.append({
+                'expense_id': expense_id,
+                'approver_id': current_manager_id,
+                'company_id': expense.company_id,
+                'status': new_status,
+                'comment': comment,
+                'approved_at': decided_at
+            })
+            results.append({'expense_id': expense_id, 'ok': True, 'new_status': expense_status,
+                            'current_approver_id': expense.current_approver_id})
+        seen_ids.add(expense_id)
+
+    try:
+        # Write every Approval row and status update in one transaction
+        if approval_rows:
+            db.session.execute(db.insert(Approval), approval_rows)
+        summary.flush()
+        versions.flush()
+        db.session.commit()
+        pending_events.publish(events)
+        return jsonify({
+            'message': f'{len(approval_rows)} of {len(items)} decisions recorded.',
+            'results': results # Same order as the request
+        }), 200
+    except Exception as e:
+        # If something goes wrong, undo the whole batch
+        db.session.rollback()
+        print(f"Database error during bulk decision: {e}") # Log error for debugging
+        return jsonify({'message': 'An error occurred while processing the decisions.'}), 500
+
+# --- Expense Export ---
+
+EXPORT_ROW = RowSerializer([
+    ('id', Expense.id),
+    ('submitted_by_id', Expense.submitted_by_id),
+    ('submitted_by_username', User.username),
+    ('amount', Expense.amount),
+    ('original_currency_code', Expense.original_currency_code),
+    ('converted_amount', Expense.converted_amount),
+    ('conversion_status', Expense.conversion_status),
+    ('category', Expense.category),
+    ('description', Expense.description),
+    ('date', Expense.date),
+    ('status', Expense.status),
+    ('submitted_at', Expense.submitted_at),
+    ('current_approver_id', Expense.current_approver_id)
+])
+EXPORT_COLUMNS = list(EXPORT_ROW.keys) + ['approvals'] # APPROVAL_ROW dicts
+
+
+def iter_export_batches(company_id, args):
+    """Yield lists of export rows (dicts) for a company, EXPORT_BATCH_SIZE expenses at a time.
+
+    Each batch is one keyset query on Expense.id joined to the submitter, plus
+    one query for that batch's approval history, so memory use depends on the
+    batch size rather than the table size.
+    """
+    statement = apply_expense_filters(
+        EXPORT_ROW.select()
+        .join(User, Expense.submitted_by_id == User.id)
+        .where(Expense.company_id == company_id),
+        args
+    )
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            statement.where(Expense.id > last_id).order_by(Expense.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+
+        # Approval history for just this batch (uses the approval.expense_id index)
+        approvals = {}
+        for row in db.session.execute(
+            APPROVAL_ROW.select(Approval.expense_id)
+            .join(approval_approver, Approval.approver_id == approval_approver.id)
+            .where(Approval.expense_id.in_([row[0] for row in rows]))
+            .order_by(Approval.expense_id, Approval.id)
+        ):
+            approvals.setdefault(row.expense_id, []).append(APPROVAL_ROW.dump(row))
+
+        batch = []
+        for row in rows:
+            record = EXPORT_ROW.dump(row)
+            record['date'] = row.date.isoformat() # Strings for the CSV writer (dump_json would format them too)
+            record['submitted_at'] = row.submitted_at.isoformat() if row.submitted_at else None
+            record['approvals'] = approvals.get(row.id, [])
+            batch.append(record)
+        yield batch
+
+
+def generate_csv_export(company_id, args):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    # Send the header straight away so the first byte doesn't wait on the database
+    writer.writeheader()
+    yield buffer.getvalue()
+    for batch in iter_export_batches(company_id, args):
+        buffer.seek(0)
+        buffer.truncate()
+        for record in batch:
+            record['approvals'] = dump_json(record['approvals']).decode() # Approval history as a JSON list in one cell
+            writer.writerow(record)
+        yield buffer.getvalue()
+
+
+def generate_ndjson_export(company_id, args):
+    for batch in iter_export_batches(company_id, args):
+        yield b''.join(dump_json(record) + b'\n' for record in batch)
+
+
+# Route for admins to download every expense in their company (CSV or NDJSON)
+@expenses_bp.route('/api/admin/expenses/export', methods=['GET'])
+@jwt_required()
+def export_expenses():
+    current_user = get_current_principal()
+    if not current_user or current_user.role != 'admin':
+        return jsonify({'message': 'Only admins can export expenses.'}), 403
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'message': 'format must be "csv" or "ndjson".'}), 400
+    # Validate the filters up front; once streaming starts we can't send a 400 anymore
+    try:
+        apply_expense_filters(db.select(Expense.id), request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    args = request.args.to_dict()
+    if export_format == 'csv':
+        body, mimetype = generate_csv_export(current_user.company_id, args), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson_export(current_user.company_id, args), 'application/x-ndjson'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=expenses.{export_format}'
+    return response
+
+# --- Expense Search ---
+# Full-text search over Expense.description and Expense.category. On SQLite
+# the expense_fts FTS5 table indexes both columns and is kept in sync by
+# triggers on the expense table, so every insert path (including bulk
+# inserts) and every description/category update is indexed in the same
+# transaction. On PostgreSQL a GIN index over the same text serves the
+# search instead. Created by migration 7.
+
+# SQLite: external-content FTS5 table (text lives in expense only) plus sync triggers
+EXPENSE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expense_fts USING fts5("
+    "description, category, content='expense', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS expense_fts_insert AFTER INSERT ON expense BEGIN "
+    "INSERT INTO expense_fts (rowid, description, category) VALUES (new.id, new.description, new.category); END",
+    "CREATE TRIGGER IF NOT EXISTS expense_fts_delete AFTER DELETE ON expense BEGIN "
+    "INSERT INTO expense_fts (expense_fts, rowid, description, category) VALUES ('delete', old.id, old.description, old.category); END",
+    "CREATE TRIGGER IF NOT EXISTS expense_fts_update AFTER UPDATE OF description, category ON expense BEGIN "
+    "INSERT INTO expense_fts (expense_fts, rowid, description, category) VALUES ('delete', old.id, old.description, old.category); "
+    "INSERT INTO expense_fts (rowid, description, category) VALUES (new.id, new.description, new.category); END",
+    "INSERT INTO expense_fts (expense_fts) VALUES ('rebuild')", # Index the existing rows
+]
+
+# PostgreSQL: the query below must use exactly this expression for the index to apply
+EXPENSE_SEARCH_DOCUMENT_PG = "to_tsvector('english', coalesce(description, '') || ' ' || category)"
+
+
+def create_expense_search_index():
+    """Create the full-text index for the current database (see migration 7)."""
+    if db.engine.dialect.name == 'postgresql':
+        statements = [f"CREATE INDEX IF NOT EXISTS ix_expense_search ON expense USING gin ({EXPENSE_SEARCH_DOCUMENT_PG})"]
+    else:
+        statements = EXPENSE_FTS_DDL
+    with db.engine.begin() as connection:
+        for statement in statements:
+            connection.execute(db.text(statement))
+
+
+def search_terms(text):
+    """Split a search box value into plain words; punctuation and FTS syntax are never passed through."""
+    return re.findall(r'\w+', text or '')
+
+
+def encode_search_cursor(score, expense_id):
+    """Opaque cursor pointing just after this result in (score, id) order."""
+    return base64.urlsafe_b64encode(f"{score!r}|{expense_id}".encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    try:
+        score, expense_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return float(score), int(expense_id)
+    except Exception:
+        raise ValueError('Invalid cursor.')
+
+
+def search_expenses(principal, terms, args):
+    """One page of expenses matching every term, best match first, within what the principal may see.
+
+    Admins search their whole company (optionally one submitter via user_id),
+    managers their own and their team's expenses, employees their own. The
+    status/category/date filters from apply_expense_filters apply too. Results
+    are ordered by relevance score (lower is better) then ID, and paged with a
+    (score, id) cursor. Returns (rows, next_cursor); raises ValueError on bad input.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        document = db.literal_column(EXPENSE_SEARCH_DOCUMENT_PG) # Unqualified columns: user has neither
+        query = db.func.plainto_tsquery(db.literal_column("'english'"), ' '.join(terms))
+        score = -db.func.ts_rank(document, query)
+        statement = SUBMITTED_EXPENSE_ROW.select().where(document.op('@@')(query))
+    else:
+        fts = db.table('expense_fts', db.column('rowid'))
+        score = db.func.bm25(db.literal_column('expense_fts'))
+        match = ' '.join(f'"{term}"' for term in terms) # Quoted terms, all required
+        statement = (
+            SUBMITTED_EXPENSE_ROW.select()
+            .select_from(fts)
+            .join(Expense, Expense.id == fts.c.rowid)
+            .where(db.literal_column('expense_fts').op('MATCH')(match))
+        )
+    score = score.label('score')
+    statement = statement.add_columns(score).join(User, Expense.submitted_by_id == User.id)
+
+    # --- Scope: who may see which expenses ---
+    if principal.role == 'admin':
+        statement = statement.where(Expense.company_id == principal.company_id)
+    elif principal.role == 'manager':
+        statement = statement.where(Expense.submitted_by_id.in_(
+            db.select(UserHierarchy.descendant_id).where(UserHierarchy.ancestor_id == principal.id) # Includes themself (depth 0)
+        ))
+    else:
+        statement = statement.where(Expense.submitted_by_id == principal.id)
+    if args.get('user_id'):
+        try:
+            statement = statement.where(Expense.submitted_by_id == int(args['user_id']))
+        except ValueError:
+            raise ValueError('user_id must be an integer.')
+    statement = apply_expense_filters(statement, args)
+
+    # --- Page size and keyset ---
+    try:
+        limit = int(args.get('limit', current_app.config['EXPENSE_PAGE_SIZE']))
+    except ValueError:
+        raise ValueError('limit must be an integer.')
+    limit = max(1, min(limit, current_app.config['EXPENSE_PAGE_SIZE_MAX']))
+    if args.get('cursor'):
+        cursor_score, cursor_id = decode_search_cursor(args['cursor'])
+        statement = statement.where(db.or_(
+            score > cursor_score,
+            db.and_(score == cursor_score, Expense.id > cursor_id)
+        ))
+
+    rows = db.session.execute(statement.order_by(score, Expense.id).limit(limit + 1)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_search_cursor(rows[-1].score, rows[-1].id)
+    return rows, None
+
+
+# Route for searching expense descriptions and categories
+@expenses_bp.route('/api/expenses/search', methods=['GET'])
+@jwt_required()
+def search_expenses_route():
+    current_user = get_current_principal()
+    if not current_user:
+        return jsonify({'message': 'User not found'}), 404
+
+    # e.g. ?q=taxi airport&status=approved&date_from=2025-01-01&limit=20
+    terms = search_terms(request.args.get('q'))
+    if not terms:
+        return jsonify({'message': 'q is required (the words to search for).'}), 400
+    try:
+        rows, next_cursor = search_expenses(current_user, terms, request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return json_response({
+        'message': 'Search results retrieved successfully',
+        'expenses': SUBMITTED_EXPENSE_ROW.dump_all(rows), # Best match first
+        'next_cursor': next_cursor # Pass back as ?cursor= (with the same q and filters) for the next page
+    })
+
+# --- Approval Rule Management ---
+
+def serialize_rule(rule):
+    return {
+        'id': rule.id,
+        'name': rule.name,
+        'rule_type': rule.rule_type,
+        'percentage_required': rule.percentage_required,
+        'specific_approver_required_id': rule.specific_approver_required_id,
+        'is_hybrid_rule': rule.is_hybrid_rule,
+        'sequence_order': rule.sequence_order
+    }
+
+
+# Route for admins to list their company's approval rules
+@expenses_bp.route('/api/admin/approval-rules', methods=['GET'])
+@jwt_required()
+def list_approval_rules():
+    current_user = get_current_principal()
+    if not current_user or current_user.role != 'admin':
+        return jsonify({'message': 'Only admins can manage approval rules.'}), 403
+    rules = ApprovalRule.query.filter_by(company_id=current_user.company_id).order_by(ApprovalRule.sequence_order, ApprovalRule.id).all()
+    return jsonify({'rules': [serialize_rule(rule) for rule in rules]}), 200
+
+
+# Route for admins to add an approval rule (the company's cached approval plan is rebuilt on commit)
+@expenses_bp.route('/api/admin/approval-rules', methods=['POST'])
+@jwt_required()
+def create_approval_rule():
+    current_user = get_current_principal()
+    if not current_user or current_user.role != 'admin':
+        return jsonify({'message': 'Only admins can manage approval rules.'}), 403
+
+    data = request.get_json() or {}
+    rule_type = data.get('rule_type')
+    percentage_required = data.get('percentage_required')
+    approver_id = data.get('specific_approver_required_id')
+    sequence_order = data.get('sequence_order')
+
+    # Validate the rule
+    if not data.get('name') or rule_type not in RULE_TYPES or not isinstance(sequence_order, int):
+        return jsonify({'message': f"name, sequence_order and rule_type ({', '.join(RULE_TYPES)}) are required."}), 400
+    if rule_type in ('percentage', 'hybrid') and not (isinstance(percentage_required, int) and 1 <= percentage_required <= 100):
+        return jsonify({'message': 'percentage_required must be an integer from 1 to 100.'}), 400
+    if rule_type in ('specific', 'hybrid') and not approver_id:
+        return jsonify({'message': 'specific_approver_required_id is required for this rule type.'}), 400
+    if approver_id and not User.query.filter_by(id=approver_id, company_id=current_user.company_id).first():
+        return jsonify({'message': 'The specific approver must be a user in your company.'}), 400
+
+    new_rule = ApprovalRule(
+        name=data['name'],
+        company_id=current_user.company_id,
+        rule_type=rule_type,
+        percentage_required=percentage_required,
+        specific_approver_required_id=approver_id,
+        is_hybrid_rule=rule_type == 'hybrid',
+        sequence_order=sequence_order
+    )
+    db.session.add(new_rule)
+    try:
+        db.session.commit()
+        return jsonify({'message': 'Approval rule created.', 'rule': serialize_rule(new_rule)}), 201
+    except Exception as e:
+        db.session.rollback()
+        print(f"Database error while creating approval rule: {e}") # Log error for debugging
+        return jsonify({'message': 'An error occurred while creating the approval rule.'}), 500
+
+
+# Route for admins to delete an approval rule
+@expenses_bp.route('/api/admin/approval-rules/<int:rule_id>', methods=['DELETE'])
+@jwt_required()
+def delete_approval_rule(rule_id):
+    current_user = get_current_principal()
+    if not current_user or current_user.role != 'admin':
+        return jsonify({'message': 'Only admins can manage approval rules.'}), 403
+    rule = ApprovalRule.query.filter_by(id=rule_id, company_id=current_user.company_id).first_or_404()
+    db.session.delete(rule)
+    try:
+        db.session.commit()
+        return jsonify({'message': 'Approval rule deleted.'}), 200
+    except Exception as e:
+        db.session.rollback()
+        print(f"Database error while deleting approval rule: {e}") # Log error for debugging
+        return jsonify({'message': 'An error occurred while deleting the approval rule.'}), 500
+
+
+# --- Reporting ---
+
+# group_by value -> column expression (manager is the submitter's current manager)
+REPORT_GROUPS = {
+    'category': ExpenseSummary.category,
+    'month': ExpenseSummary.month,
+    'status': ExpenseSummary.status,
+    'submitter': ExpenseSummary.submitted_by_id,
+    'manager': User.manager_id
+}
+
+
+# Route for admins to get spend totals from the summary tables
+@expenses_bp.route('/api/reports/spend', methods=['GET'])
+@jwt_required()
+def spend_report():
+    current_user = get_current_principal()
+    if not current_user or current_user.role != 'admin':
+        return jsonify({'message': 'Only admins can view spend reports.'}), 403
+
+    # e.g. ?group_by=category,month&status=approved&month_from=2025-01&month_to=2025-12
+    group_names = [name for name in request.args.get('group_by', 'category,month').split(',') if name]
+    unknown = [name for name in group_names if name not in REPORT_GROUPS]
+    if unknown:
+        return jsonify({'message': f"Unknown group_by: {', '.join(unknown)}. Use any of: {', '.join(REPORT_GROUPS)}."}), 400
+    group_columns = [REPORT_GROUPS[name] for name in group_names]
+
+    statement = db.select(
+        *group_columns,
+        db.func.sum(ExpenseSummary.expense_count),
+        db.func.sum(ExpenseSummary.total_converted),
+        db.func.sum(ExpenseSummary.unconverted_count)
+    ).where(ExpenseSummary.company_id == current_user.company_id)
+    if 'manager' in group_names:
+        statement = statement.join(User, ExpenseSummary.submitted_by_id == User.id)
+    status = request.args.get('status')
+    if status:
+        statement = statement.where(ExpenseSummary.status == status)
+    if request.args.get('month_from'):
+        statement = statement.where(ExpenseSummary.month >= request.args['month_from'])
+    if request.args.get('month_to'):
+        statement = statement.where(ExpenseSummary.month <= request.args['month_to'])
+    statement = statement.group_by(*group_columns).order_by(*group_columns)
+
+    rows = []
+    for row in db.session.execute(statement):
+        entry = dict(zip(group_names, row[:len(group_names)]))
+        count, total, unconverted = row[len(group_names):]
+        if not count:
+            continue # Every expense in this group has moved to another status
+        entry.update({'expense_count': count, 'total': round(total or 0, 2), 'unconverted_count': unconverted})
+        rows.append(entry)
+
+    return jsonify({
+        'base_currency_code': current_user.base_currency_code,
+        'group_by': group_names,
+        'rows': rows
+    }), 200
+
+# Route for admins to inspect the exchange-rate cache counters
+@system_bp.route('/api/system/rate-cache', methods=['GET'])
+@jwt_required()
+def rate_cache_stats():
+    current_user = get_current_principal()
+    if not current_user or current_user.role != 'admin':
+        return jsonify({'message': 'Only admins can view cache statistics.'}), 403
+    return jsonify(rate_cache.stats()), 200
+
 # --- Frontend Routes (Flask Templates) ---
 # These routes render the HTML pages for the frontend
 
-@app.route('/')
+@frontend_bp.route('/')
 def index():
     # If user is logged in, redirect to their dashboard
     if 'user_id' in session:
         if session['role'] == 'admin':
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('frontend.admin_dashboard'))
         elif session['role'] == 'manager':
-            return redirect(url_for('manager_dashboard'))
+            return redirect(url_for('frontend.manager_dashboard'))
         else: # employee
-            return redirect(url_for('employee_dashboard'))
+            return redirect(url_for('frontend.employee_dashboard'))
     # If not logged in, show the login page
     return render_template('login.html')
 
-@app.route('/login')
+@frontend_bp.route('/login')
 def login_page():
     # Show the login page
     return render_template('login.html')
 
-@app.route('/signup')
+@frontend_bp.route('/signup')
 def signup_page():
     # Show the signup page
     # Only allow signup if no company exists (first admin signup)
     if Company.query.first():
-        return redirect(url_for('login_page'))
+        return redirect(url_for('frontend.login_page'))
     return render_template('signup.html')
 
-@app.route('/employee')
+@frontend_bp.route('/employee')
 def employee_dashboard():
     # Check if user is logged in and is an employee
     if 'user_id' not in session or session['role'] != 'employee':
-        return redirect(url_for('index'))
-    # Fetch user's expenses
-    user_expenses = Expense.query.filter_by(submitted_by_id=session['user_id']).order_by(Expense.submitted_at.desc()).all()
-    return render_template('employee_dashboard.html', expenses=user_expenses)
+        return redirect(url_for('frontend.index'))
+    # Fetch one page of the user's expenses (filters and cursor come from the query string)
+    try:
+        user_expenses, next_cursor = paginate_expenses(expense_list_query().filter_by(submitted_by_id=session['user_id']), request.args)
+    except ValueError as e:
+        return render_template('employee_dashboard.html', expenses=[], error=str(e))
+    return render_template('employee_dashboard.html', expenses=user_expenses,
+                           next_page_url=next_page_url('frontend.employee_dashboard', next_cursor))
 
-@app.route('/manager')
+@frontend_bp.route('/manager')
 def manager_dashboard():
     # Check if user is logged in and is a manager
     if 'user_id' not in session or session['role'] != 'manager':
-        return redirect(url_for('index'))
+        return redirect(url_for('frontend.index'))
     # Fetch pending expenses assigned to the current manager
-    pending_expenses = Expense.query.filter_by(current_approver_id=session['user_id'], status='pending').all()
-    # Fetch all expenses submitted by subordinates (optional view)
-    subordinate_ids = [u.id for u in User.query.filter_by(manager_id=session['user_id']).all()]
-    team_expenses = Expense.query.filter(Expense.submitted_by_id.in_(subordinate_ids)).all()
-    return render_template('manager_dashboard.html', pending_expenses=pending_expenses, team_expenses=team_expenses)
+    pending_expenses = expense_list_query().filter_by(current_approver_id=session['user_id'], status='pending').all()
+    # Fetch one page of expenses from everyone in the manager's team, at any depth
+    # (filters and cursor come from the query string)
+    try:
+        team_expenses, next_cursor = paginate_expenses(team_expense_query(session['user_id']), request.args)
+    except ValueError as e:
+        return render_template('manager_dashboard.html', pending_expenses=pending_expenses, team_expenses=[], error=str(e))
+    return render_template('manager_dashboard.html', pending_expenses=pending_expenses, team_expenses=team_expenses,
+                           next_page_url=next_page_url('frontend.manager_dashboard', next_cursor))
+
+# Live updates for the manager dashboard's pending table (EventSource can't send a JWT, so this uses the login session)
+@frontend_bp.route('/manager/pending/stream')
+def manager_pending_stream():
+    if 'user_id' not in session or session['role'] != 'manager':
+        return jsonify({'message': 'Login required.'}), 401
+    return pending_event_stream(session['user_id'])
 
-@app.route('/admin')
+# Bulk approve/reject for the dashboard, which has the login session but no JWT
+@frontend_bp.route('/manager/bulk-decision', methods=['POST'])
+def manager_bulk_decision():
+    if 'user_id' not in session or session['role'] != 'manager':
+        return jsonify({'message': 'Login required.'}), 401
+    return decide_expenses(session['user_id'], session['company_id'], request.get_json() or {})
+
+@frontend_bp.route('/admin')
 def admin_dashboard():
     # Check if user is logged in and is an admin
     if 'user_id' not in session or session['role'] != 'admin':
-        return redirect(url_for('index'))
+        return redirect(url_for('frontend.index'))
     # Fetch all users in the company
-    company_users = User.query.filter_by(company_id=session['company_id']).all()
-    # Fetch all expenses in the company
-    all_expenses = Expense.query.all()
-    return render_template('admin_dashboard.html', users=company_users, expenses=all_expenses)
+    # (each user's manager is loaded in the same query for the Manager column)
+    company_users = User.query.options(db.joinedload(User.manager)).filter_by(company_id=session['company_id']).all()
+    # Fetch one page of the company's expenses (filters and cursor come from the query string)
+    company_expenses = expense_list_query().filter(Expense.company_id == session['company_id'])
+    try:
+        all_expenses, next_cursor = paginate_expenses(company_expenses, request.args)
+    except ValueError as e:
+        return render_template('admin_dashboard.html', users=company_users, expenses=[], error=str(e))
+    return render_template('admin_dashboard.html', users=company_users, expenses=all_expenses,
+                           next_page_url=next_page_url('frontend.admin_dashboard', next_cursor))
 
-@app.route('/logout')
+@frontend_bp.route('/logout')
 def logout():
     # Clear the user's session
     session.clear()
     # Redirect to the login page
-    return redirect(url_for('index'))
+    return redirect(url_for('frontend.index'))
 
 # --- Main Application Runner ---
 # This block ensures the app only runs if this script is executed directly
 if __name__ == '__main__':
-    # Create the database tables within the application context
+    app = create_app()
+
+    # Create the database tables and apply any pending migrations within the application context
     with app.app_context():
-        db.create_all()
+        run_migrations()
+
+        # Start the conversion worker if create_app() skipped it because the queue table didn't exist yet
+        conversion_worker.notify()
 
     # Run the Flask development server
     # debug=True helps with error messages during development
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,109 @@
+"""Approval decision latency benchmark.
+
+Seeds a company with a three-step approval chain (manager -> finance -> CFO,
+with a hybrid 60%-or-CFO rule) and thousands of open expenses into a
+throwaway SQLite database, then times POST /api/expenses/<id>/approve
+requests for each step and reports p50/p99 latency.
+
+    python benchmarks/bench_approvals.py --open-expenses 5000 --decisions 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+# Point the app at a temp database before it is created
+_db_dir = tempfile.mkdtemp(prefix='bench-approvals-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as expense_app  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def seed(open_expenses):
+    """Create the company, users, rules and open expenses; return (approver IDs, expense IDs)."""
+    db = expense_app.db
+    expense_app.run_migrations()
+    company = expense_app.Company(name='Bench Co', base_currency_code='USD')
+    db.session.add(company)
+    db.session.flush()
+    users = {}
+    for username, role in [('admin', 'admin'), ('manager', 'manager'), ('finance', 'manager'), ('cfo', 'manager')]:
+        users[username] = expense_app.User(username=username, email=f'{username}@example.com', role=role,
+                                           company_id=company.id, password_hash='x', is_manager_approver=True)
+        db.session.add(users[username])
+    db.session.flush()
+    employee = expense_app.User(username='employee', email='employee@example.com', role='employee',
+                                company_id=company.id, manager_id=users['manager'].id, password_hash='x')
+    db.session.add(employee)
+    db.session.add(expense_app.ApprovalRule(name='Finance', company_id=company.id, rule_type='percentage',
+                                            percentage_required=60, specific_approver_required_id=users['finance'].id,
+                                            sequence_order=1))
+    db.session.add(expense_app.ApprovalRule(name='CFO', company_id=company.id, rule_type='hybrid', is_hybrid_rule=True,
+                                            percentage_required=60, specific_approver_required_id=users['cfo'].id,
+                                            sequence_order=2))
+    db.session.commit()
+
+    chain = expense_app.approval_plans.get(company.id).chain_for(users['manager'].id, employee.id)
+    rows = [{
+        'amount': 10 + i % 90, 'original_currency_code': 'USD', 'converted_amount': 10 + i % 90,
+        'category': 'Travel', 'description': f'Bench expense {i}', 'date': date(2025, 1 + i % 12, 1),
+        'status': 'pending', 'submitted_by_id': employee.id, 'company_id': company.id, 'current_approver_id': chain[0],
+        'approval_chain': expense_app.format_approval_chain(chain)
+    } for i in range(open_expenses)]
+    expense_ids = sorted(db.session.scalars(db.insert(expense_app.Expense).returning(expense_app.Expense.id), rows).all())
+    db.session.commit()
+    expense_app.rebuild_expense_summaries()
+    return chain, expense_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--open-expenses', type=int, default=5000, help='open multi-step expenses to seed')
+    parser.add_argument('--decisions', type=int, default=300, help='expenses to push through every step')
+    args = parser.parse_args()
+
+    flask_app = expense_app.create_app()
+    with flask_app.app_context():
+        chain, expense_ids = seed(args.open_expenses)
+        tokens = [create_access_token(identity=str(approver_id)) for approver_id in chain]
+
+    client = flask_app.test_client()
+    latencies = []
+    statuses = {}
+    started = time.perf_counter()
+    for expense_id in expense_ids[:args.decisions]:
+        for token in tokens:
+            request_started = time.perf_counter()
+            response = client.post(f'/api/expenses/{expense_id}/approve', json={'comment': 'ok'},
+                                   headers={'Authorization': f'Bearer {token}'})
+            latencies.append(time.perf_counter() - request_started)
+            if response.status_code != 200:
+                statuses['error'] = statuses.get('error', 0) + 1
+                break
+            status = response.get_json()['new_status']
+            if status != 'pending':
+                statuses[status] = statuses.get(status, 0) + 1
+                break
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"open expenses={args.open_expenses} decided={args.decisions} chain length={len(chain)}")
+    print(f"final statuses: {statuses}")
+    print(f"decisions:      {len(latencies)} in {wall_time:.2f}s ({len(latencies) / wall_time:.1f}/s)")
+    print(f"latency p50:    {percentile(latencies, 50) * 1000:.2f} ms")
+    print(f"latency p99:    {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
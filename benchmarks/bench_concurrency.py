@@ -0,0 +1,128 @@
+"""Concurrent write benchmark: submit and approve from many threads at once.
+
+Seeds a company with employees and approving managers into a throwaway
+database, then runs submitter threads (POST /api/expenses/submit) and
+approver threads (GET /api/expenses/pending + POST .../approve) against it
+for a fixed time. Reports throughput per operation, how many requests
+failed (any non-2xx answer), and how many "database is locked" errors the
+engine raised: the app answers those with a 500, so they are also counted
+separately through the engine's handle_error event.
+
+    python benchmarks/bench_concurrency.py --submitters 8 --approvers 4 --seconds 10
+    STORAGE_MODE=basic python benchmarks/bench_concurrency.py   # compare with SQLite defaults
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Point the app at a temp database before it is created (unless DATABASE_URL is already set)
+_db_dir = tempfile.mkdtemp(prefix='bench-concurrency-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as expense_app  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+
+def seed(submitters, approvers):
+    """Create one manager per approver thread and spread the employees across them."""
+    db = expense_app.db
+    expense_app.run_migrations()
+    company = expense_app.Company(name='Bench Co', base_currency_code='USD')
+    db.session.add(company)
+    db.session.flush()
+    db.session.add(expense_app.User(username='admin', email='admin@example.com', role='admin',
+                                    company_id=company.id, password_hash='x'))
+    managers = []
+    for i in range(approvers):
+        manager = expense_app.User(username=f'manager{i}', email=f'manager{i}@example.com', role='manager',
+                                   company_id=company.id, password_hash='x', is_manager_approver=True)
+        db.session.add(manager)
+        managers.append(manager)
+    db.session.flush()
+    employees = []
+    for i in range(submitters):
+        employee = expense_app.User(username=f'employee{i}', email=f'employee{i}@example.com', role='employee',
+                                    company_id=company.id, password_hash='x', manager_id=managers[i % approvers].id)
+        db.session.add(employee)
+        employees.append(employee)
+    db.session.commit()
+    return ([create_access_token(identity=str(user.id)) for user in employees],
+            [create_access_token(identity=str(user.id)) for user in managers])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--submitters', type=int, default=8, help='threads submitting expenses')
+    parser.add_argument('--approvers', type=int, default=4, help='threads approving expenses')
+    parser.add_argument('--seconds', type=float, default=10, help='how long to run')
+    args = parser.parse_args()
+
+    flask_app = expense_app.create_app()
+    with flask_app.app_context():
+        employee_tokens, manager_tokens = seed(args.submitters, args.approvers)
+
+    counts = {'submit_ok': 0, 'submit_failed': 0, 'approve_ok': 0, 'approve_failed': 0, 'pending_reads': 0,
+              'locked_errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def count_lock_error(context):
+        error = context.original_exception
+        if isinstance(error, sqlite3.OperationalError) and 'database is locked' in str(error):
+            count('locked_errors')
+
+    with flask_app.app_context():
+        engine = expense_app.db.engine
+    event.listen(engine, 'handle_error', count_lock_error)
+
+    def submitter(token):
+        client = flask_app.test_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        while time.perf_counter() < deadline:
+            response = client.post('/api/expenses/submit', headers=headers, json={
+                'amount': 12.5, 'original_currency_code': 'USD', 'category': 'Travel', 'date': '2025-06-01'})
+            count('submit_ok' if response.status_code == 201 else 'submit_failed')
+
+    def approver(token):
+        client = flask_app.test_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        while time.perf_counter() < deadline:
+            pending = client.get('/api/expenses/pending', headers=headers)
+            count('pending_reads')
+            expenses = pending.get_json().get('expenses', []) if pending.status_code == 200 else []
+            if not expenses:
+                time.sleep(0.01)
+            for expense in expenses[:20]:
+                response = client.post(f"/api/expenses/{expense['id']}/approve", headers=headers, json={})
+                count('approve_ok' if response.status_code == 200 else 'approve_failed')
+
+    threads = ([threading.Thread(target=submitter, args=(token,)) for token in employee_tokens]
+               + [threading.Thread(target=approver, args=(token,)) for token in manager_tokens])
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    event.remove(engine, 'handle_error', count_lock_error)
+
+    print(f"storage_mode={flask_app.config['STORAGE_MODE']} submitters={args.submitters} "
+          f"approvers={args.approvers} seconds={elapsed:.1f}")
+    print(f"submits:   {counts['submit_ok']} ok ({counts['submit_ok'] / elapsed:.1f}/s), {counts['submit_failed']} failed")
+    print(f"approvals: {counts['approve_ok']} ok ({counts['approve_ok'] / elapsed:.1f}/s), {counts['approve_failed']} failed")
+    print(f"'database is locked' errors: {counts['locked_errors']}")
+    print(f"pending list reads: {counts['pending_reads']} ({counts['pending_reads'] / elapsed:.1f}/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+"""Reproducible load benchmark with seeded data and local API stand-ins.
+
+Seeds a throwaway database with N companies, each with an admin, a two-level
+manager hierarchy and employees, plus M expenses per company of which a share
+is already approved. A local HTTP server stands in for exchangerate-api and
+restcountries, so no run depends on the network. Then it drives login,
+submit, my-expenses, pending and approve one scenario at a time at the given
+concurrency and writes throughput and latency percentiles as JSON.
+
+The request mix comes from --seed, so two runs with the same arguments send
+the same requests and can be compared across commits:
+
+    python benchmarks/bench_load.py --companies 3 --expenses 500 --concurrency 8 --output before.json
+    git checkout <other-commit>
+    python benchmarks/bench_load.py --companies 3 --expenses 500 --concurrency 8 --output after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Point the app at a temp database before it is created (unless DATABASE_URL is already set)
+_db_dir = tempfile.mkdtemp(prefix='bench-load-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as expense_app  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+SCENARIOS = ('login', 'submit', 'my_expenses', 'pending', 'approve')
+PASSWORD = 'bench-password'
+CATEGORIES = ('Travel', 'Meals', 'Lodging', 'Supplies', 'Software')
+
+# Stand-in data: units of each currency per USD, and a country for each currency
+USD_RATES = {'USD': 1.0, 'EUR': 0.92, 'GBP': 0.79, 'INR': 83.2, 'JPY': 151.4, 'CAD': 1.36, 'AUD': 1.52, 'CHF': 0.88}
+COUNTRIES = {'USD': 'United States', 'EUR': 'Germany', 'GBP': 'United Kingdom', 'INR': 'India',
+             'JPY': 'Japan', 'CAD': 'Canada', 'AUD': 'Australia', 'CHF': 'Switzerland'}
+
+
+# --- Local API stand-ins ---
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    """Serves /v4/latest/<BASE> like exchangerate-api and /v3.1/all like restcountries."""
+
+    latency = 0.0 # Seconds added to every response, to mimic a remote API
+    counts = {'rates': 0, 'countries': 0}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        path = self.path.split('?')[0]
+        if path.startswith('/v4/latest/'):
+            base = path.rsplit('/', 1)[-1].upper()
+            if base not in USD_RATES:
+                return self._send(404, {'error': 'unsupported base currency'})
+            self._count('rates')
+            rates = {code: round(per_usd / USD_RATES[base], 6) for code, per_usd in USD_RATES.items()}
+            return self._send(200, {'base': base, 'rates': rates})
+        if path == '/v3.1/all':
+            self._count('countries')
+            return self._send(200, [{'name': {'common': name, 'official': name}, 'currencies': {code: {'name': code}}}
+                                    for code, name in COUNTRIES.items()])
+        return self._send(404, {'error': 'not found'})
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep the benchmark output clean
+
+
+def start_stub_server(latency):
+    """Start the stand-in API on a free local port and return the server."""
+    StubAPIHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAPIHandler)
+    threading.Thread(target=server.serve_forever, name='stub-api', daemon=True).start()
+    return server
+
+
+# --- Seeding ---
+
+def seed(flask_app, client, rng, args):
+    """Create the companies, users and expenses. Returns the users by role as (id, username, token).
+
+    Requests go through the test client outside any app context we hold, so
+    each one gets its own context (and its own `g` and session) like real traffic.
+    """
+    db = expense_app.db
+    batch_max = flask_app.config['EXPENSE_BATCH_MAX']
+    with flask_app.app_context():
+        expense_app.run_migrations()
+        # Every seeded user shares one hash, so seeding doesn't pay for bcrypt per user
+        password_hash = expense_app.password_hasher.hash(PASSWORD)
+    users = {'admin': [], 'manager': [], 'employee': []}
+    expense_count = approval_count = 0
+
+    for company_index in range(args.companies):
+        with flask_app.app_context():
+            currency = list(USD_RATES)[company_index % len(USD_RATES)]
+            base_currency_code = expense_app.country_index.lookup(COUNTRIES[currency]) # Filled from the restcountries stand-in
+            company = expense_app.Company(name=f'Bench Co {company_index}', base_currency_code=base_currency_code)
+            db.session.add(company)
+            db.session.flush()
+
+            def add_user(role, manager_id=None, approver=False):
+                username = f'c{company_index}-{role}{sum(len(group) for group in users.values())}'
+                user = expense_app.User(username=username, email=f'{username}@example.com', role=role,
+                                        company_id=company.id, password_hash=password_hash,
+                                        manager_id=manager_id, is_manager_approver=approver)
+                db.session.add(user)
+                db.session.flush()
+                users[role].append((user.id, username, create_access_token(identity=str(user.id))))
+                return users[role][-1]
+
+            add_user('admin')
+            # Senior managers report to nobody; each has line managers, who approve their employees
+            line_managers = []
+            for _ in range(args.senior_managers):
+                senior_id = add_user('manager', approver=True)[0]
+                for _ in range(args.managers_per_senior):
+                    line_managers.append(add_user('manager', manager_id=senior_id, approver=True))
+            employees = [add_user('employee', manager_id=line_managers[i % len(line_managers)][0])
+                         for i in range(len(line_managers) * args.employees_per_manager)]
+            db.session.commit()
+
+        # Expenses go in through the batch endpoint so the summaries and approval chains match real traffic
+        for employee_index, (_, _, token) in enumerate(employees):
+            share = args.expenses // len(employees) + (1 if employee_index < args.expenses % len(employees) else 0)
+            for start in range(0, share, batch_max):
+                rows = [random_expense(rng) for _ in range(min(batch_max, share - start))]
+                response = client.post('/api/expenses/submit/batch', headers={'Authorization': f'Bearer {token}'},
+                                       json={'expenses': rows})
+                if response.status_code != 201:
+                    raise RuntimeError(f"Seeding expenses failed: {response.status_code} {response.get_json()}")
+                expense_count += len(rows)
+
+        # Each line manager approves a share of what is waiting for them
+        for manager_id, _, token in line_managers:
+            with flask_app.app_context():
+                pending_ids = db.session.scalars(db.select(expense_app.Expense.id).filter_by(
+                    current_approver_id=manager_id, status='pending').order_by(expense_app.Expense.id)).all()
+            approve_ids = [expense_id for expense_id in pending_ids if rng.random() < args.approved_fraction]
+            for start in range(0, len(approve_ids), batch_max):
+                chunk = approve_ids[start:start + batch_max]
+                response = client.post('/api/expenses/bulk-decision', headers={'Authorization': f'Bearer {token}'},
+                                       json={'action': 'approve', 'expense_ids': chunk})
+                if response.status_code != 200:
+                    raise RuntimeError(f"Seeding approvals failed: {response.status_code} {response.get_json()}")
+                approval_count += len(chunk)
+
+    return users, {'companies': args.companies, 'users': sum(len(group) for group in users.values()),
+                   'managers': len(users['manager']), 'employees': len(users['employee']),
+                   'expenses': expense_count, 'approvals': approval_count}
+
+
+def random_expense(rng):
+    return {
+        'amount': round(rng.uniform(5, 500), 2),
+        'original_currency_code': rng.choice(list(USD_RATES)),
+        'category': rng.choice(CATEGORIES),
+        'description': 'Seeded by bench_load',
+        'date': (date(2025, 1, 1) + timedelta(days=rng.randrange(365))).isoformat()
+    }
+
+
+# --- Scenarios ---
+
+def build_requests(flask_app, scenario, rng, tokens, count):
+    """Return the exact list of (method, url, headers, body) a scenario sends."""
+    def auth(token):
+        return {'Authorization': f'Bearer {token}'}
+
+    if scenario == 'login':
+        users = tokens['employee'] + tokens['manager']
+        return [('POST', '/api/auth/login', {}, {'username': username, 'password': PASSWORD})
+                for _, username, _ in (rng.choice(users) for _ in range(count))]
+    if scenario == 'submit':
+        return [('POST', '/api/expenses/submit', auth(token), random_expense(rng))
+                for _, _, token in (rng.choice(tokens['employee']) for _ in range(count))]
+    if scenario == 'my_expenses':
+        return [('GET', '/api/expenses/my', auth(token), None)
+                for _, _, token in (rng.choice(tokens['employee']) for _ in range(count))]
+    if scenario == 'pending':
+        return [('GET', '/api/expenses/pending', auth(token), None)
+                for _, _, token in (rng.choice(tokens['manager']) for _ in range(count))]
+    if scenario == 'approve':
+        # Approve what is actually waiting, oldest first, spread over the approvers
+        token_by_id = {user_id: token for user_id, _, token in tokens['manager'] + tokens['admin']}
+        db = expense_app.db
+        with flask_app.app_context():
+            waiting = db.session.execute(db.select(expense_app.Expense.id, expense_app.Expense.current_approver_id)
+                                         .filter_by(status='pending').where(expense_app.Expense.current_approver_id.isnot(None))
+                                         .order_by(expense_app.Expense.id)).all()
+        rng.shuffle(waiting)
+        return [('POST', f'/api/expenses/{expense_id}/approve', auth(token_by_id[approver_id]), {'comment': 'bench'})
+                for expense_id, approver_id in waiting[:count]]
+    raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def run_scenario(flask_app, planned, concurrency):
+    """Send the planned requests from `concurrency` threads and summarize the results."""
+    latencies = []
+    status_counts = {}
+    lock = threading.Lock()
+    next_index = [0]
+
+    def worker():
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                if next_index[0] >= len(planned):
+                    return
+                method, url, headers, body = planned[next_index[0]]
+                next_index[0] += 1
+            started = time.perf_counter()
+            response = client.open(url, method=method, headers=headers, json=body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                status_counts[response.status_code] = status_counts.get(response.status_code, 0) + 1
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    ok = sum(n for status, n in status_counts.items() if status < 400)
+    return {
+        'requests': len(planned),
+        'ok': ok,
+        'errors': len(planned) - ok,
+        'status_codes': {str(status): n for status, n in sorted(status_counts.items())},
+        'seconds': round(wall_time, 3),
+        'throughput_rps': round(len(planned) / wall_time, 1) if wall_time else 0.0,
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p90': round(percentile(latencies, 90) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0.0
+        }
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--companies', type=int, default=2, help='companies to seed')
+    parser.add_argument('--senior-managers', type=int, default=2, help='top-level managers per company')
+    parser.add_argument('--managers-per-senior', type=int, default=3, help='line managers under each senior manager')
+    parser.add_argument('--employees-per-manager', type=int, default=5, help='employees under each line manager')
+    parser.add_argument('--expenses', type=int, default=1000, help='expenses to seed per company')
+    parser.add_argument('--approved-fraction', type=float, default=0.5, help='share of seeded expenses approved up front')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads per scenario')
+    parser.add_argument('--rounds', type=int, default=None, help='bcrypt cost (default: the app setting)')
+    parser.add_argument('--stub-latency-ms', type=float, default=20, help='delay added by the stand-in APIs')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the data and the request mix')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stub = start_stub_server(args.stub_latency_ms / 1000)
+    stub_url = f'http://127.0.0.1:{stub.server_address[1]}'
+    flask_app = expense_app.create_app()
+    flask_app.config['EXCHANGE_RATE_API_URL'] = f'{stub_url}/v4/latest/{{base}}'
+    flask_app.config['COUNTRY_INDEX_REFRESH_URL'] = f'{stub_url}/v3.1/all'
+    flask_app.config['EXCHANGE_RATE_SNAPSHOT_PATH'] = os.path.join(_db_dir, 'exchange_rates_snapshot.json')
+    if args.rounds is not None:
+        flask_app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    expense_app.rate_cache.clear()
+    with flask_app.app_context():
+        expense_app.country_index.refresh_from_api()
+
+    rng = random.Random(args.seed)
+    client = flask_app.test_client()
+    results = {}
+    started = time.perf_counter()
+    tokens, seeded = seed(flask_app, client, rng, args)
+    seeded['seconds'] = round(time.perf_counter() - started, 2)
+    for scenario in scenarios:
+        planned = build_requests(flask_app, scenario, rng, tokens, args.requests)
+        results[scenario] = run_scenario(flask_app, planned, args.concurrency)
+        print(f"{scenario:12} {results[scenario]['throughput_rps']:8.1f} req/s  "
+              f"p50 {results[scenario]['latency_ms']['p50']:7.1f} ms  "
+              f"p99 {results[scenario]['latency_ms']['p99']:7.1f} ms  "
+              f"errors {results[scenario]['errors']}", file=sys.stderr)
+    stub.shutdown()
+
+    report = {
+        'benchmark': 'bench_load',
+        'commit': git_commit(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'config': {
+            'database': flask_app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+            'storage_mode': flask_app.config['STORAGE_MODE'],
+            'bcrypt_rounds': flask_app.config['BCRYPT_LOG_ROUNDS'],
+            'concurrency': args.concurrency,
+            'requests_per_scenario': args.requests,
+            'stub_latency_ms': args.stub_latency_ms,
+            'seed': args.seed
+        },
+        'seeded': seeded,
+        'stub_api_calls': dict(StubAPIHandler.counts),
+        'scenarios': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Login latency benchmark.
+
+Seeds one user into a throwaway SQLite database, then fires concurrent
+POST /api/auth/login requests through Flask's test client and reports
+throughput plus p50/p99 latency. 503s from a saturated hashing pool are
+counted separately.
+
+    python benchmarks/bench_login.py --concurrency 16 --requests 200 --rounds 12
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Point the app at a temp database before it is created
+_db_dir = tempfile.mkdtemp(prefix='bench-login-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as expense_app  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads sending logins')
+    parser.add_argument('--requests', type=int, default=100, help='total login requests')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost (BCRYPT_LOG_ROUNDS)')
+    parser.add_argument('--workers', type=int, default=None, help='PASSWORD_HASH_WORKERS (default: CPU count)')
+    parser.add_argument('--queue-limit', type=int, default=None, help='PASSWORD_HASH_QUEUE_LIMIT')
+    args = parser.parse_args()
+
+    flask_app = expense_app.create_app()
+    flask_app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    if args.workers:
+        flask_app.config['PASSWORD_HASH_WORKERS'] = args.workers
+    if args.queue_limit is not None:
+        flask_app.config['PASSWORD_HASH_QUEUE_LIMIT'] = args.queue_limit
+
+    with flask_app.app_context():
+        expense_app.run_migrations()
+        company = expense_app.Company(name='Bench Co', base_currency_code='USD')
+        user = expense_app.User(username='bench', email='bench@example.com', role='employee', company=company)
+        user.set_password('bench-password')
+        expense_app.db.session.add(company)
+        expense_app.db.session.commit()
+
+    latencies = []
+    status_counts = {}
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def worker():
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            response = client.post('/api/auth/login', json={'username': 'bench', 'password': 'bench-password'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                status_counts[response.status_code] = status_counts.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"concurrency={args.concurrency} requests={args.requests} rounds={args.rounds} "
+          f"workers={flask_app.config['PASSWORD_HASH_WORKERS']} queue_limit={flask_app.config['PASSWORD_HASH_QUEUE_LIMIT']}")
+    print(f"status codes: {dict(sorted(status_counts.items()))}")
+    print(f"throughput:   {args.requests / wall_time:.1f} req/s")
+    if latencies:
+        print(f"latency p50:  {percentile(latencies, 50) * 1000:.1f} ms")
+        print(f"latency p99:  {percentile(latencies, 99) * 1000:.1f} ms")
+        print(f"latency mean: {statistics.mean(latencies) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
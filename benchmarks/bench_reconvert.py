@@ -0,0 +1,99 @@
+"""Bulk re-conversion benchmark.
+
+Seeds a throwaway database with a daily rate history for a few currency
+pairs and a large number of expenses spread over the same dates, then times
+reconvert_expenses() (the `flask --app app reconvert-expenses` job) and
+reports rows per second.
+
+    python benchmarks/bench_reconvert.py --expenses 1000000 --batch-size 5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Point the app at a temp database before it is created (unless DATABASE_URL is already set)
+_db_dir = tempfile.mkdtemp(prefix='bench-reconvert-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+os.environ['CONVERSION_WORKER_ENABLED'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as expense_app  # noqa: E402
+
+CURRENCIES = {'USD': 1.0, 'EUR': 1.08, 'GBP': 1.27, 'INR': 0.012, 'JPY': 0.0067} # Value of one unit in USD
+START_DATE = date(2022, 1, 1)
+
+
+def seed(rng, expenses, days):
+    db = expense_app.db
+    expense_app.run_migrations()
+    company = expense_app.Company(name='Bench Co', base_currency_code='USD')
+    db.session.add(company)
+    db.session.flush()
+    user = expense_app.User(username='bench', email='bench@example.com', role='employee', company_id=company.id,
+                            password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+
+    # A rate for every weekday; weekends are covered by EXCHANGE_RATE_MAX_AGE_DAYS
+    rates = []
+    for offset in range(days):
+        day = START_DATE + timedelta(days=offset)
+        if day.weekday() < 5:
+            for code, usd_value in CURRENCIES.items():
+                if code != 'USD':
+                    rates.append((day, code, 'USD', usd_value * rng.uniform(0.95, 1.05)))
+    expense_app.store_rates(rates, 'import')
+
+    chunk = 20000
+    foreign = [code for code in CURRENCIES if code != 'USD']
+    for start in range(0, expenses, chunk):
+        db.session.execute(db.insert(expense_app.Expense), [
+            {
+                'amount': round(rng.uniform(5, 500), 2), 'original_currency_code': rng.choice(foreign),
+                'category': 'Travel', 'date': START_DATE + timedelta(days=rng.randrange(days)), 'status': 'pending',
+                'submitted_by_id': user.id, 'company_id': company.id, 'conversion_status': 'pending'
+            }
+            for _ in range(min(chunk, expenses - start))
+        ])
+        db.session.commit()
+    expense_app.rebuild_expense_summaries()
+    return len(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--expenses', type=int, default=200000, help='expenses to seed and re-convert')
+    parser.add_argument('--days', type=int, default=3 * 365, help='days of rate history (and expense dates)')
+    parser.add_argument('--batch-size', type=int, default=None, help='RECONVERT_BATCH_SIZE (default: the app setting)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    args = parser.parse_args()
+
+    flask_app = expense_app.create_app()
+    if args.batch_size:
+        flask_app.config['RECONVERT_BATCH_SIZE'] = args.batch_size
+    with flask_app.app_context():
+        started = time.perf_counter()
+        rate_count = seed(random.Random(args.seed), args.expenses, args.days)
+        seed_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        counts = expense_app.reconvert_expenses()
+        first_pass = time.perf_counter() - started
+
+        # Second pass: every amount is already right, so this measures the read-and-compare path
+        started = time.perf_counter()
+        second = expense_app.reconvert_expenses()
+        second_pass = time.perf_counter() - started
+
+    print(f"expenses={args.expenses} rates={rate_count} batch_size={flask_app.config['RECONVERT_BATCH_SIZE']} "
+          f"(seeded in {seed_time:.1f}s)")
+    print(f"first pass:  {first_pass:.1f}s ({args.expenses / first_pass:,.0f} rows/s) {counts}")
+    print(f"second pass: {second_pass:.1f}s ({args.expenses / second_pass:,.0f} rows/s) {second}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Full-text search benchmark.
+
+Seeds a throwaway database with expenses whose descriptions are drawn from a
+small vocabulary (so some words are common and others rare), then times
+GET /api/expenses/search for a few queries as an admin (whole company) and as
+an employee (own expenses only), first page and a deep page.
+
+    python benchmarks/bench_search.py --expenses 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Point the app at a temp database before it is created (unless DATABASE_URL is already set)
+_db_dir = tempfile.mkdtemp(prefix='bench-search-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+os.environ['CONVERSION_WORKER_ENABLED'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as expense_app  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+COMMON_WORDS = ['taxi', 'lunch', 'hotel', 'train', 'client', 'office', 'dinner', 'flight', 'parking', 'coffee']
+RARE_WORDS = ['conference', 'visa', 'courier', 'translation', 'toll']
+CATEGORIES = ['Travel', 'Food', 'Supplies', 'Lodging', 'Other']
+QUERIES = ['taxi', 'client dinner', 'visa', 'courier translation', 'lodging']
+
+
+def seed(rng, expenses, employees):
+    db = expense_app.db
+    expense_app.run_migrations()
+    company = expense_app.Company(name='Bench Co', base_currency_code='USD')
+    db.session.add(company)
+    db.session.flush()
+    admin = expense_app.User(username='admin', email='admin@example.com', role='admin', company_id=company.id,
+                             password_hash='x')
+    db.session.add(admin)
+    users = [expense_app.User(username=f'employee{i}', email=f'employee{i}@example.com', role='employee',
+                              company_id=company.id, password_hash='x') for i in range(employees)]
+    db.session.add_all(users)
+    db.session.commit()
+
+    def description():
+        words = rng.sample(COMMON_WORDS, rng.randint(1, 3))
+        if rng.random() < 0.01:
+            words.append(rng.choice(RARE_WORDS))
+        rng.shuffle(words)
+        return ' '.join(words)
+
+    chunk = 20000
+    for start in range(0, expenses, chunk):
+        db.session.execute(db.insert(expense_app.Expense), [
+            {
+                'amount': round(rng.uniform(5, 500), 2), 'original_currency_code': 'USD', 'converted_amount': 1.0,
+                'category': rng.choice(CATEGORIES), 'description': description(),
+                'date': date(2023, 1, 1) + timedelta(days=rng.randrange(730)), 'status': 'pending',
+                'submitted_by_id': rng.choice(users).id, 'company_id': company.id
+            }
+            for _ in range(min(chunk, expenses - start))
+        ])
+        db.session.commit()
+    return admin.id, users[0].id
+
+
+def time_query(client, headers, query, repeat):
+    """Median latency (ms) of the first page and of the page after it, plus the first page's size."""
+    first, second, count = [], [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get('/api/expenses/search', query_string={'q': query}, headers=headers)
+        first.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.json
+        body = response.json
+        count = len(body['expenses'])
+        if body['next_cursor']:
+            started = time.perf_counter()
+            client.get('/api/expenses/search', query_string={'q': query, 'cursor': body['next_cursor']}, headers=headers)
+            second.append((time.perf_counter() - started) * 1000)
+    median = lambda values: sorted(values)[len(values) // 2] if values else float('nan')
+    return median(first), median(second), count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--expenses', type=int, default=200000, help='expenses to seed')
+    parser.add_argument('--employees', type=int, default=200, help='submitters the expenses are spread over')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query (the median is reported)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    args = parser.parse_args()
+
+    flask_app = expense_app.create_app()
+    with flask_app.app_context():
+        started = time.perf_counter()
+        admin_id, employee_id = seed(random.Random(args.seed), args.expenses, args.employees)
+        seed_time = time.perf_counter() - started
+        tokens = {'admin': create_access_token(identity=str(admin_id)),
+                  'employee': create_access_token(identity=str(employee_id))}
+
+    # Requests are made outside the app context above, so each one gets a fresh session
+    client = flask_app.test_client()
+    print(f"expenses={args.expenses} employees={args.employees} (seeded and indexed in {seed_time:.1f}s)")
+    print(f"{'as':<9} {'query':<22} {'page 1 ms':>10} {'page 2 ms':>10} {'rows':>5}")
+    for role, token in tokens.items():
+        headers = {'Authorization': f'Bearer {token}'}
+        for query in QUERIES:
+            first, second, count = time_query(client, headers, query, args.repeat)
+            print(f"{role:<9} {query:<22} {first:>10.1f} {second:>10.1f} {count:>5}")
+
+
+if __name__ == '__main__':
+    main()
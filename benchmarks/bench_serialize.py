@@ -0,0 +1,162 @@
+"""Expense list serialization benchmark.
+
+Seeds one approver's pending queue with a large number of expenses in a
+throwaway database and times building the /api/expenses/pending response
+from it, stage by stage: the previous path (ORM objects, dicts built field
+by field with .isoformat(), jsonify) against column tuples through
+SUBMITTED_EXPENSE_ROW and dump_json (with orjson, and with the json module
+fallback). Then it times the real endpoints through Flask's test client.
+Everything is reported per row, as the median over the repeats.
+
+    python benchmarks/bench_serialize.py --rows 10000 --repeat 7
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Point the app at a temp database before it is created
+_db_dir = tempfile.mkdtemp(prefix='bench-serialize-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+os.environ['CONVERSION_WORKER_ENABLED'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+import app as expense_app  # noqa: E402
+
+WORDS = ['taxi', 'airport', 'hotel', 'dinner', 'client', 'lunch', 'train', 'conference', 'parking', 'office']
+
+
+def seed(rng, rows):
+    db = expense_app.db
+    expense_app.run_migrations()
+    company = expense_app.Company(name='Bench Co', base_currency_code='USD')
+    db.session.add(company)
+    db.session.flush()
+    manager = expense_app.User(username='manager', email='manager@example.com', role='manager',
+                               company_id=company.id, is_manager_approver=True, password_hash='x')
+    db.session.add(manager)
+    db.session.flush()
+    employee = expense_app.User(username='employee', email='employee@example.com', role='employee',
+                                company_id=company.id, manager_id=manager.id, password_hash='x')
+    db.session.add(employee)
+    db.session.commit()
+
+    now = datetime.utcnow()
+    db.session.execute(db.insert(expense_app.Expense), [
+        {
+            'amount': round(rng.uniform(5, 500), 2), 'original_currency_code': 'EUR',
+            'converted_amount': round(rng.uniform(5, 500), 2), 'conversion_status': 'converted',
+            'category': rng.choice(['Travel', 'Meals', 'Office']),
+            'description': ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))),
+            'date': date(2025, 1, 1) + timedelta(days=rng.randrange(365)), 'status': 'pending',
+            'submitted_at': now - timedelta(seconds=index), 'submitted_by_id': employee.id,
+            'current_approver_id': manager.id, 'company_id': company.id
+        }
+        for index in range(rows)
+    ])
+    db.session.commit()
+    return manager.id, employee.id
+
+
+def orm_item(expense):
+    # The per-field dict the list endpoints built before SUBMITTED_EXPENSE_ROW
+    return {
+        'id': expense.id,
+        'amount': expense.amount,
+        'original_currency_code': expense.original_currency_code,
+        'converted_amount': expense.converted_amount,
+        'conversion_status': expense.conversion_status,
+        'category': expense.category,
+        'description': expense.description,
+        'date': expense.date.isoformat(),
+        'status': expense.status,
+        'submitted_by_id': expense.submitted_by_id,
+        'submitted_by_username': expense.submitted_by.username,
+        'submitted_at': expense.submitted_at.isoformat()
+    }
+
+
+def time_stages(stages, repeat):
+    """Run the stages in order `repeat` times; return {stage: median seconds}."""
+    timings = {name: [] for name, _ in stages}
+    for _ in range(repeat):
+        expense_app.db.session.remove() # Fresh session, so no run reuses objects from the identity map
+        value = None
+        for name, stage in stages:
+            started = time.perf_counter()
+            value = stage(value)
+            timings[name].append(time.perf_counter() - started)
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='expenses in the pending queue (and per response)')
+    parser.add_argument('--repeat', type=int, default=7, help='runs per measurement (the median is reported)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    args = parser.parse_args()
+
+    flask_app = expense_app.create_app({
+        'EXPENSE_PAGE_SIZE_MAX': args.rows, # So /api/expenses/my can return every row in one page
+        'EXPENSE_LIST_CACHE_SIZE': 0 # Measure building the response, not the page cache
+    })
+    with flask_app.app_context():
+        manager_id, employee_id = seed(random.Random(args.seed), args.rows)
+        tokens = {'manager': create_access_token(identity=str(manager_id)),
+                  'employee': create_access_token(identity=str(employee_id))}
+
+    pending_filter = (expense_app.Expense.current_approver_id == manager_id, expense_app.Expense.status == 'pending')
+    orm_stages = [
+        ('query', lambda _: expense_app.expense_list_query().filter(*pending_filter).all()),
+        ('serialize', lambda expenses: [orm_item(expense) for expense in expenses]),
+        ('encode', lambda items: jsonify({'expenses': items}).get_data())
+    ]
+    row_stages = [
+        ('query', lambda _: expense_app.db.session.execute(
+            expense_app.submitted_expense_select().where(*pending_filter)).all()),
+        ('serialize', expense_app.SUBMITTED_EXPENSE_ROW.dump_all),
+        ('encode', lambda items: expense_app.dump_json({'expenses': items}))
+    ]
+
+    results = []
+    with flask_app.test_request_context():
+        results.append(('ORM objects + jsonify', time_stages(orm_stages, args.repeat)))
+        if expense_app.orjson is not None:
+            results.append(('column rows + dump_json (orjson)', time_stages(row_stages, args.repeat)))
+        orjson, expense_app.orjson = expense_app.orjson, None
+        results.append(('column rows + dump_json (json)', time_stages(row_stages, args.repeat)))
+        expense_app.orjson = orjson
+
+    print(f"rows={args.rows} repeat={args.repeat} (microseconds per row, median)")
+    print(f"{'path':34} {'query':>8} {'serialize':>10} {'encode':>8} {'total':>8}")
+    for label, timings in results:
+        per_row = {name: seconds / args.rows * 1e6 for name, seconds in timings.items()}
+        print(f"{label:34} {per_row['query']:8.2f} {per_row['serialize']:10.2f} {per_row['encode']:8.2f} "
+              f"{sum(per_row.values()):8.2f}")
+
+    # The endpoints themselves: JWT check, query, serialization, encoding, ETag
+    client = flask_app.test_client()
+    print()
+    for label, url, role in [('GET /api/expenses/pending', '/api/expenses/pending', 'manager'),
+                             ('GET /api/expenses/my', f'/api/expenses/my?limit={args.rows}', 'employee')]:
+        headers = {'Authorization': f"Bearer {tokens[role]}"}
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.get(url, headers=headers)
+            timings.append(time.perf_counter() - started)
+        returned = len(response.get_json()['expenses'])
+        elapsed = statistics.median(timings)
+        print(f"{label:28} {returned} rows in {elapsed * 1000:7.1f} ms ({elapsed / returned * 1e6:.2f} us/row, "
+              f"{len(response.get_data()) / 1024:.0f} KiB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Worker cold-start benchmark.
+
+Starts fresh Python processes, the way a preforking server or an autoscaler
+starts workers, and times each stage of getting one ready: importing the app
+module, create_app(), and the first request through Flask's test client. Peak
+RSS after the first request is reported as the per-worker memory, next to a
+bare interpreter for reference. The median over all runs is printed.
+
+    python benchmarks/bench_startup.py --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run inside each child process; prints one JSON line of timings
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import app as expense_app
+imported = time.perf_counter()
+flask_app = expense_app.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'status': response.status_code,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules),
+    'loaded': [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+BARE = """
+import json, resource, sys
+print(json.dumps({'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'modules': len(sys.modules)}))
+"""
+
+# Imported only on the code paths that need them; listed if a worker loads them at startup anyway
+LAZY_MODULES = ['requests', 'urllib3', 'sqlalchemy.dialects.postgresql']
+
+
+def run_child(code, args, env):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code, *args], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes to start')
+    parser.add_argument('--path', default='/login', help='URL of the first request')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    env = dict(os.environ, PYTHONPATH=ROOT, CONVERSION_WORKER_ENABLED='0')
+    env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(db_dir, 'bench.db')}")
+
+    # One throwaway run first, so every measured run finds the bytecode cache warm (as a deployed worker would)
+    run_child(PROBE, [args.path, *LAZY_MODULES], env)
+    runs = [run_child(PROBE, [args.path, *LAZY_MODULES], env) for _ in range(args.runs)]
+    bare = [run_child(BARE, [], env) for _ in range(args.runs)]
+
+    def median(key, results=runs):
+        return statistics.median(result[key] for result in results)
+
+    print(f"runs={args.runs} first request: GET {args.path} -> {runs[0]['status']}")
+    print(f"import app:       {median('import_ms'):7.1f} ms")
+    print(f"create_app():     {median('create_app_ms'):7.1f} ms")
+    print(f"first request:    {median('first_request_ms'):7.1f} ms")
+    print(f"process total:    {median('process_ms'):7.1f} ms  (bare interpreter {median('process_ms', bare):.1f} ms)")
+    print(f"peak RSS:         {median('rss_mb'):7.1f} MB  (bare interpreter {median('rss_mb', bare):.1f} MB)")
+    print(f"modules loaded:   {median('modules'):7.0f}     (bare interpreter {median('modules', bare):.0f})")
+    print(f"lazy modules loaded at startup: {', '.join(runs[0]['loaded']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
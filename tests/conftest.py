@@ -0,0 +1,85 @@
+"""Shared fixtures: the app on a throwaway SQLite database, and seeded companies."""
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as expense_app  # noqa: E402
+
+
+@pytest.fixture
+def app_config(tmp_path):
+    """Config for a test app: its own database and snapshot file, no background threads, no real rate API."""
+    return {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'expenses.db'}",
+        'EXCHANGE_RATE_SNAPSHOT_PATH': str(tmp_path / 'exchange_rates_snapshot.json'),
+        'EXCHANGE_RATE_API_URL': 'http://127.0.0.1:9/{base}', # Nothing listens here; tests that need rates start a stub
+        'CONVERSION_WORKER_ENABLED': False,
+        'COUNTRY_INDEX_REFRESH_INTERVAL': 0,
+        'BCRYPT_LOG_ROUNDS': 4,
+        'OUTBOUND_RETRIES': 0
+    }
+
+
+@pytest.fixture
+def app(app_config, monkeypatch):
+    flask_app = expense_app.create_app(app_config)
+    # Fresh process-wide clients, so no test sees another's cached rates or open circuits
+    monkeypatch.setattr(expense_app, 'rate_cache', expense_app.ExchangeRateCache())
+    monkeypatch.setattr(expense_app, 'outbound', expense_app.OutboundClient())
+    with flask_app.app_context():
+        expense_app.run_migrations()
+    yield flask_app
+    with flask_app.app_context():
+        expense_app.db.engine.dispose()
+
+
+@pytest.fixture
+def seed(app):
+    """Return a function that adds a company (admin, manager, employees) with expenses pending for the manager.
+
+    Usernames start with `prefix`, so one test can seed several companies.
+    Everything is written in its own app context, so requests made through the
+    test client afterwards start from a clean session.
+    """
+    def seed_company(prefix='', employees=1, expenses_per_employee=1):
+        db = expense_app.db
+        with app.app_context():
+            company = expense_app.Company(name=f'{prefix}Test Co', base_currency_code='USD')
+            db.session.add(company)
+            db.session.flush()
+            admin = expense_app.User(username=f'{prefix}admin', email=f'{prefix}admin@example.com', role='admin',
+                                     company_id=company.id)
+            manager = expense_app.User(username=f'{prefix}manager', email=f'{prefix}manager@example.com', role='manager',
+                                       company_id=company.id, is_manager_approver=True)
+            manager.manager = admin
+            staff = [
+                expense_app.User(username=f'{prefix}employee{n}', email=f'{prefix}employee{n}@example.com',
+                                 role='employee', company_id=company.id)
+                for n in range(employees)
+            ]
+            for user in [admin, manager, *staff]:
+                user.set_password('password')
+            for employee in staff:
+                employee.manager = manager
+            db.session.add_all([admin, manager, *staff])
+            db.session.flush()
+
+            now = datetime.utcnow()
+            db.session.add_all([
+                expense_app.Expense(
+                    amount=10 + n, original_currency_code='USD', converted_amount=10 + n, category='Travel',
+                    description=f'taxi {n}', date=date(2025, 1, 1) + timedelta(days=n % 28), status='pending',
+                    submitted_by_id=employee.id, company_id=company.id, current_approver_id=manager.id,
+                    approval_chain=str(manager.id), submitted_at=now - timedelta(minutes=n)
+                )
+                for employee in staff for n in range(expenses_per_employee)
+            ])
+            db.session.commit()
+            return {'company_id': company.id, 'admin_id': admin.id, 'manager_id': manager.id,
+                    'employee_ids': [employee.id for employee in staff]}
+    return seed_company
@@ -0,0 +1,27 @@
+"""POST /api/expenses/submit/batch returns the new IDs in the order the expenses were submitted."""
+import app as expense_app
+
+
+def test_expense_ids_follow_the_submitted_order(app, seed):
+    seed()
+    client = app.test_client()
+    login = client.post('/api/auth/login', json={'username': 'employee0', 'password': 'password'})
+    headers = {'Authorization': f"Bearer {login.get_json()['access_token']}"}
+    rows = [
+        {'amount': amount, 'original_currency_code': currency, 'category': 'Meals', 'date': '2025-03-01'}
+        for amount, currency in [(30, 'USD'), (10, 'EUR'), (20, 'USD'), (40, 'EUR')]
+    ]
+
+    response = client.post('/api/expenses/submit/batch', json={'expenses': rows}, headers=headers)
+
+    assert response.status_code == 201
+    expense_ids = response.get_json()['expense_ids']
+    with app.app_context():
+        amounts = dict(expense_app.db.session.execute(
+            expense_app.db.select(expense_app.Expense.id, expense_app.Expense.amount)
+            .where(expense_app.Expense.id.in_(expense_ids))
+        ).all())
+        assert [amounts[expense_id] for expense_id in expense_ids] == [30, 10, 20, 40]
+        # The conversion jobs (no EUR rate is cached) point at the EUR expenses
+        queued = {job.expense_id for job in expense_app.ConversionJob.query}
+        assert queued == {expense_ids[1], expense_ids[3]}
@@ -0,0 +1,71 @@
+"""Submits and approvals from many threads at once never fail with "database is locked" (WAL mode)."""
+import sqlite3
+import threading
+
+from sqlalchemy import event
+
+import app as expense_app
+from test_statement_counts import login
+
+SUBMITS_PER_EMPLOYEE = 15
+
+
+def test_concurrent_submits_and_approvals_never_hit_a_locked_database(app, seed):
+    seed('a-', employees=3, expenses_per_employee=0)
+    seed('b-', employees=3, expenses_per_employee=0)
+    client = app.test_client()
+    employees = [login(client, f'{prefix}-employee{n}') for prefix in 'ab' for n in range(3)]
+    managers = [login(client, f'{prefix}-manager') for prefix in 'ab']
+
+    with app.app_context():
+        engine = expense_app.db.engine
+        assert expense_app.db.session.connection().exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+
+    lock_errors = []
+
+    def record_lock_error(context):
+        error = context.original_exception
+        if isinstance(error, sqlite3.OperationalError) and 'database is locked' in str(error):
+            lock_errors.append(error)
+
+    statuses = {'submit': [], 'approve': []}
+    start = threading.Barrier(len(employees) + len(managers))
+    submitted = threading.Event()
+
+    def submitter(headers):
+        client = app.test_client()
+        start.wait()
+        for _ in range(SUBMITS_PER_EMPLOYEE):
+            response = client.post('/api/expenses/submit', headers=headers, json={
+                'amount': 12.5, 'original_currency_code': 'USD', 'category': 'Travel', 'date': '2025-06-01'})
+            statuses['submit'].append(response.status_code)
+
+    def approver(headers):
+        client = app.test_client()
+        start.wait()
+        while True:
+            last_round = submitted.is_set() # Everything is submitted: stop once the queue is empty
+            expenses = client.get('/api/expenses/pending', headers=headers).get_json()['expenses']
+            for expense in expenses:
+                response = client.post(f"/api/expenses/{expense['id']}/approve", headers=headers, json={})
+                statuses['approve'].append(response.status_code)
+            if last_round and not expenses:
+                return
+
+    submitters = [threading.Thread(target=submitter, args=(headers,)) for headers in employees]
+    approvers = [threading.Thread(target=approver, args=(headers,)) for headers in managers]
+    event.listen(engine, 'handle_error', record_lock_error)
+    try:
+        for thread in submitters + approvers:
+            thread.start()
+        for thread in submitters:
+            thread.join()
+        submitted.set()
+        for thread in approvers:
+            thread.join()
+    finally:
+        event.remove(engine, 'handle_error', record_lock_error)
+
+    assert lock_errors == []
+    assert statuses['submit'] == [201] * len(employees) * SUBMITS_PER_EMPLOYEE
+    assert statuses['approve'] == [200] * len(employees) * SUBMITS_PER_EMPLOYEE
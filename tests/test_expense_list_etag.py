@@ -0,0 +1,46 @@
+"""The expense list ETags never match a response built from another database or response format."""
+import os
+
+import app as expense_app
+from test_statement_counts import login
+
+
+def my_expenses(client, headers, etag=None):
+    if etag is not None:
+        headers = {**headers, 'If-None-Match': etag}
+    return client.get('/api/expenses/my', headers=headers)
+
+
+def test_etag_does_not_survive_a_database_reset(app, seed):
+    seed(expenses_per_employee=1)
+    client = app.test_client()
+    first = my_expenses(client, login(client, 'employee0'))
+    assert len(first.get_json()['expenses']) == 1
+
+    # Start again from an empty database: same user IDs, and every list version back at 0
+    with app.app_context():
+        expense_app.db.engine.dispose()
+    os.remove(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])
+    with app.app_context():
+        expense_app.run_migrations()
+    seed(expenses_per_employee=3)
+    headers = login(client, 'employee0')
+
+    response = my_expenses(client, headers, first.headers['ETag'])
+    assert response.status_code == 200
+    assert len(response.get_json()['expenses']) == 3 # Not the page cached from the old database
+    assert response.headers['ETag'] != first.headers['ETag']
+    assert my_expenses(client, headers, response.headers['ETag']).status_code == 304
+
+
+def test_etag_changes_with_the_response_format(app, seed, monkeypatch):
+    seed()
+    client = app.test_client()
+    headers = login(client, 'employee0')
+    first = my_expenses(client, headers)
+    assert my_expenses(client, headers, first.headers['ETag']).status_code == 304
+
+    monkeypatch.setattr(expense_app, 'EXPENSE_LIST_FORMAT', expense_app.EXPENSE_LIST_FORMAT + 1)
+    response = my_expenses(client, headers, first.headers['ETag'])
+    assert response.status_code == 200
+    assert response.headers['ETag'] != first.headers['ETag']
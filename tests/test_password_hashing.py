@@ -0,0 +1,23 @@
+"""A login whose password check outlasts PASSWORD_HASH_TIMEOUT gets a 503, like a full hashing pool."""
+import time
+
+import app as expense_app
+
+
+def test_slow_hash_is_answered_with_503(app, seed, monkeypatch):
+    seed()
+    check_password_hash = expense_app.bcrypt.check_password_hash
+
+    def slow_check(password_hash, password):
+        time.sleep(0.3)
+        return check_password_hash(password_hash, password)
+
+    monkeypatch.setattr(expense_app.bcrypt, 'check_password_hash', slow_check)
+    app.config['PASSWORD_HASH_TIMEOUT'] = 0.05
+    timed_out = expense_app.password_hasher.timed_out
+
+    response = app.test_client().post('/api/auth/login', json={'username': 'employee0', 'password': 'password'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert expense_app.password_hasher.timed_out == timed_out + 1
@@ -0,0 +1,170 @@
+"""The migrations give an existing (pre-migration) database the indexes the hot queries need.
+
+A database with the original schema and some rows is upgraded with
+run_migrations(), then EXPLAIN QUERY PLAN is checked for each hot query: the
+expense and approval tables must be searched through an ix_expense_* or
+ix_approval_* index, never scanned.
+"""
+import sqlite3
+
+import pytest
+
+import app as expense_app
+
+# The schema as db.create_all() made it before the first migration
+BASELINE_SCHEMA = """
+CREATE TABLE company (
+    id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    base_currency_code VARCHAR(3) NOT NULL,
+    created_at DATETIME,
+    PRIMARY KEY (id)
+);
+CREATE TABLE user (
+    id INTEGER NOT NULL,
+    username VARCHAR(80) NOT NULL,
+    email VARCHAR(120) NOT NULL,
+    password_hash VARCHAR(120) NOT NULL,
+    role VARCHAR(20) NOT NULL,
+    company_id INTEGER NOT NULL,
+    manager_id INTEGER,
+    is_manager_approver BOOLEAN,
+    created_at DATETIME,
+    PRIMARY KEY (id),
+    UNIQUE (username),
+    UNIQUE (email),
+    FOREIGN KEY(company_id) REFERENCES company (id),
+    FOREIGN KEY(manager_id) REFERENCES user (id)
+);
+CREATE TABLE expense (
+    id INTEGER NOT NULL,
+    amount FLOAT NOT NULL,
+    original_currency_code VARCHAR(3) NOT NULL,
+    converted_amount FLOAT,
+    category VARCHAR(100) NOT NULL,
+    description TEXT,
+    date DATE NOT NULL,
+    receipt_image_path VARCHAR(255),
+    status VARCHAR(20) NOT NULL,
+    submitted_by_id INTEGER NOT NULL,
+    submitted_at DATETIME,
+    current_approver_id INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(submitted_by_id) REFERENCES user (id),
+    FOREIGN KEY(current_approver_id) REFERENCES user (id)
+);
+CREATE TABLE approval_rule (
+    id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    company_id INTEGER NOT NULL,
+    percentage_required INTEGER,
+    specific_approver_required_id INTEGER,
+    is_hybrid_rule BOOLEAN,
+    rule_type VARCHAR(20) NOT NULL,
+    sequence_order INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(company_id) REFERENCES company (id),
+    FOREIGN KEY(specific_approver_required_id) REFERENCES user (id)
+);
+CREATE TABLE approval (
+    id INTEGER NOT NULL,
+    expense_id INTEGER NOT NULL,
+    approver_id INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    comment TEXT,
+    approved_at DATETIME,
+    PRIMARY KEY (id),
+    FOREIGN KEY(expense_id) REFERENCES expense (id),
+    FOREIGN KEY(approver_id) REFERENCES user (id)
+);
+"""
+
+
+@pytest.fixture
+def migrated_app(app_config):
+    path = app_config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.execute("INSERT INTO company VALUES (1, 'Test Co', 'USD', '2025-01-01 00:00:00')")
+    connection.executemany('INSERT INTO user VALUES (?, ?, ?, ?, ?, 1, ?, ?, NULL)', [
+        (1, 'admin', 'admin@example.com', 'x', 'admin', None, 0),
+        (2, 'manager', 'manager@example.com', 'x', 'manager', 1, 1),
+        (3, 'employee', 'employee@example.com', 'x', 'employee', 2, 0)
+    ])
+    connection.executemany(
+        "INSERT INTO expense VALUES (?, 10, 'USD', 10, 'Travel', 'taxi', '2025-01-01', NULL, ?, 3, ?, ?)",
+        [(n, 'approved' if n % 2 else 'pending', f'2025-01-01 00:{n:02d}:00', None if n % 2 else 2) for n in range(1, 41)]
+    )
+    connection.executemany("INSERT INTO approval VALUES (?, ?, 2, 'approved', NULL, '2025-01-02 00:00:00')",
+                           [(n, n) for n in range(1, 41, 2)])
+    connection.commit()
+    connection.close()
+
+    flask_app = expense_app.create_app(app_config)
+    with flask_app.app_context():
+        expense_app.run_migrations()
+    yield flask_app
+    with flask_app.app_context():
+        expense_app.db.engine.dispose()
+
+
+def query_plan(statement):
+    """EXPLAIN QUERY PLAN details for a select() or ORM query, one string per plan step."""
+    statement = getattr(statement, 'statement', statement) # ORM query -> select()
+    sql = str(statement.compile(dialect=expense_app.db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    return [row[3] for row in expense_app.db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def newest_first(statement):
+    return statement.order_by(expense_app.Expense.submitted_at.desc(), expense_app.Expense.id.desc()).limit(51)
+
+
+HOT_QUERIES = {
+    # GET /api/expenses/my
+    'my expenses': (lambda: newest_first(
+        expense_app.EXPENSE_ROW.select().where(expense_app.Expense.submitted_by_id == 3)),
+        'ix_expense_submitted_by_submitted_at'),
+    # GET /api/expenses/pending, the pending stream and the manager dashboard
+    'pending queue': (lambda: expense_app.submitted_expense_select().where(
+        expense_app.Expense.current_approver_id == 2, expense_app.Expense.status == 'pending'),
+        'ix_expense_approver_status'),
+    # The admin dashboard
+    'company expenses': (lambda: newest_first(
+        expense_app.expense_list_query().filter(expense_app.Expense.company_id == 1)),
+        'ix_expense_company_submitted_at'),
+    # GET /api/admin/expenses/export, one keyset batch
+    'export batch': (lambda: expense_app.EXPORT_ROW.select()
+        .join(expense_app.User, expense_app.Expense.submitted_by_id == expense_app.User.id)
+        .where(expense_app.Expense.company_id == 1, expense_app.Expense.id > 0)
+        .order_by(expense_app.Expense.id).limit(1000),
+        'ix_expense_company_id'),
+    # Approval history for an export batch
+    'approval history': (lambda: expense_app.APPROVAL_ROW.select(expense_app.Approval.expense_id)
+        .join(expense_app.approval_approver, expense_app.Approval.approver_id == expense_app.approval_approver.id)
+        .where(expense_app.Approval.expense_id.in_([1, 3, 5]))
+        .order_by(expense_app.Approval.expense_id, expense_app.Approval.id),
+        'ix_approval_expense_id')
+}
+
+
+@pytest.mark.parametrize('name', list(HOT_QUERIES))
+def test_hot_query_uses_an_index(migrated_app, name):
+    build, index_name = HOT_QUERIES[name]
+    with migrated_app.app_context():
+        plan = query_plan(build())
+
+    assert any(index_name in step for step in plan), plan
+    assert not any(step.startswith(('SCAN expense', 'SCAN approval')) for step in plan), plan
+
+
+def test_migrations_upgrade_the_existing_rows(migrated_app):
+    with migrated_app.app_context():
+        assert expense_app.db.session.scalar(
+            expense_app.db.select(expense_app.db.func.count()).where(expense_app.Expense.company_id.is_(None))) == 0
+        assert {row.version for row in expense_app.SchemaVersion.query} == {version for version, _ in expense_app.MIGRATIONS}
+        # Spend summaries are built from the copied Expense.company_id
+        summary = expense_app.db.session.execute(
+            expense_app.db.select(expense_app.ExpenseSummary.company_id, expense_app.db.func.sum(expense_app.ExpenseSummary.expense_count))
+            .group_by(expense_app.ExpenseSummary.company_id)
+        ).all()
+        assert summary == [(1, 40)]
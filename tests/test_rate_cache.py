@@ -0,0 +1,155 @@
+"""ExchangeRateCache against a local stub of the rate API: TTL hits and misses, LRU eviction, fallbacks."""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app as expense_app
+
+RATES = {'USD': {'EUR': 0.9, 'INR': 83.0}, 'EUR': {'USD': 1.1}, 'GBP': {'USD': 1.25}}
+
+
+@pytest.fixture
+def rate_api(app):
+    """Serve /<base> from RATES on a local port and point the app at it; `up` and `calls` are adjustable."""
+    state = {'up': True, 'calls': []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            base = self.path.strip('/')
+            state['calls'].append(base)
+            if not state['up']:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = json.dumps({'base': base, 'rates': RATES[base]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.config['EXCHANGE_RATE_API_URL'] = f'http://127.0.0.1:{server.server_address[1]}/{{base}}'
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_fresh_table_is_served_from_memory(app, rate_api):
+    with app.app_context():
+        assert expense_app.rate_cache.get_rates('USD') == RATES['USD']
+        assert expense_app.rate_cache.get_rates('USD') == RATES['USD']
+        assert expense_app.rate_cache.peek('USD') == RATES['USD']
+        assert expense_app.get_conversion_rate('USD', 'INR') == 83.0
+        stats = expense_app.rate_cache.stats()
+    assert rate_api['calls'] == ['USD']
+    assert (stats['hits'], stats['misses']) == (3, 1)
+
+
+def test_expired_table_is_fetched_again(app, rate_api):
+    app.config['EXCHANGE_RATE_CACHE_TTL'] = 0.2
+    with app.app_context():
+        expense_app.rate_cache.get_rates('USD')
+        time.sleep(0.3)
+        assert expense_app.rate_cache.peek('USD') is None
+        assert expense_app.rate_cache.get_rates('USD') == RATES['USD']
+        stats = expense_app.rate_cache.stats()
+    assert rate_api['calls'] == ['USD', 'USD']
+    assert (stats['hits'], stats['misses']) == (0, 2)
+
+
+def test_least_recently_used_table_is_evicted(app, rate_api):
+    app.config['EXCHANGE_RATE_CACHE_SIZE'] = 2
+    with app.app_context():
+        expense_app.rate_cache.get_rates('USD')
+        expense_app.rate_cache.get_rates('EUR')
+        expense_app.rate_cache.get_rates('USD') # USD is now the most recently used
+        expense_app.rate_cache.get_rates('GBP') # Evicts EUR
+        assert expense_app.rate_cache.stats()['cached_currencies'] == ['USD', 'GBP']
+        expense_app.rate_cache.get_rates('EUR')
+    assert rate_api['calls'] == ['USD', 'EUR', 'GBP', 'EUR']
+
+
+def test_snapshot_is_served_when_the_api_is_down(app, rate_api):
+    with app.app_context():
+        expense_app.rate_cache.get_rates('USD') # Written to the on-disk snapshot
+    # Make the snapshot three days old
+    path = app.config['EXCHANGE_RATE_SNAPSHOT_PATH']
+    with open(path) as f:
+        snapshot = json.load(f)
+    snapshot['USD']['fetched_at'] -= 3 * 86400
+    with open(path, 'w') as f:
+        json.dump(snapshot, f)
+
+    with app.app_context():
+        expense_app.rate_cache.clear() # As after a restart: nothing in memory
+        rate_api['up'] = False
+        assert expense_app.rate_cache.get_rates('USD') == RATES['USD']
+        # The snapshot is a fallback, never a fresh table: no inline conversion with it
+        assert expense_app.rate_cache.peek('USD') is None
+        assert expense_app.cached_conversion_rate('USD', 'INR') is None
+        stats = expense_app.rate_cache.stats()
+    assert (stats['snapshot_hits'], stats['fetch_errors']) == (1, 1)
+
+
+def test_stale_table_is_served_until_the_retry_backoff_ends(app, rate_api):
+    app.config['EXCHANGE_RATE_CACHE_TTL'] = 0.2
+    app.config['EXCHANGE_RATE_RETRY_BACKOFF'] = 0.3
+    with app.app_context():
+        expense_app.rate_cache.get_rates('USD')
+        time.sleep(0.3)
+        rate_api['up'] = False
+        assert expense_app.rate_cache.get_rates('USD') == RATES['USD'] # Fetch fails, expired table served
+        assert expense_app.rate_cache.get_rates('USD') == RATES['USD'] # Backing off: no API call
+        assert expense_app.rate_cache.peek('USD') is None
+        assert rate_api['calls'] == ['USD', 'USD']
+
+        time.sleep(0.35)
+        rate_api['up'] = True
+        assert expense_app.rate_cache.get_rates('USD') == RATES['USD']
+        assert expense_app.rate_cache.peek('USD') == RATES['USD']
+        stats = expense_app.rate_cache.stats()
+    assert rate_api['calls'] == ['USD', 'USD', 'USD']
+    assert stats['stale_hits'] == 2
+
+
+def test_no_rates_without_api_or_snapshot(app, rate_api):
+    rate_api['up'] = False
+    with app.app_context():
+        assert expense_app.rate_cache.get_rates('USD') is None
+        assert expense_app.get_conversion_rate('USD', 'INR') is None
+
+
+def test_parallel_fetches_keep_the_snapshot_readable(app):
+    # The conversion worker fetches several base currencies at once; each fetch saves the snapshot
+    bases = [f'C{n:02d}' for n in range(8)]
+    rates = {f'Q{n:03d}': n / 7 for n in range(300)} # Big enough for the writes to overlap
+    path = app.config['EXCHANGE_RATE_SNAPSHOT_PATH']
+    for _ in range(10):
+        cache = expense_app.ExchangeRateCache()
+        barrier = threading.Barrier(len(bases))
+
+        def save(base):
+            with app.app_context():
+                barrier.wait()
+                cache._save_snapshot(base, rates, time.time())
+
+        threads = [threading.Thread(target=save, args=(base,)) for base in bases]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(path) as f:
+            snapshot = json.load(f)
+        assert set(bases) <= set(snapshot)
+    assert [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')] == []
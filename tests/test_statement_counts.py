@@ -0,0 +1,56 @@
+"""Hot endpoints run a fixed number of SQL statements, however many expenses they list."""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+import app as expense_app
+
+
+@contextmanager
+def count_statements(app):
+    """Collect every statement the app's engine executes inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = expense_app.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def login(client, username):
+    """Log in through the API: returns the JWT header, and leaves the login session on the client."""
+    response = client.post('/api/auth/login', json={'username': username, 'password': 'password'})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+def statements_for(app, url, username):
+    client = app.test_client()
+    headers = login(client, username)
+    with count_statements(app) as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return statements
+
+
+@pytest.mark.parametrize('url, role', [
+    ('/api/expenses/pending', 'manager'),
+    ('/manager', 'manager'),
+    ('/admin', 'admin')
+])
+def test_statement_count_does_not_grow_with_rows(app, seed, url, role):
+    seed('small-', employees=1, expenses_per_employee=1)
+    seed('large-', employees=8, expenses_per_employee=5) # 40 expenses from 8 submitters
+
+    small = statements_for(app, url, f'small-{role}')
+    large = statements_for(app, url, f'large-{role}')
+
+    assert len(large) == len(small), '\n'.join(large)
+    assert len(small) <= 6, '\n'.join(small)